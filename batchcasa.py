@@ -0,0 +1,319 @@
+"""
+    This module is a command line tool that computes the CASA measures of many data sets without a display.
+
+    Every data set header (a *_main.txt file) is loaded with SpermContainer.loadDataSet, which parses the sperm
+    files and computes every measure, and the measures are written out as two tables, one row per glyph and one row
+    per sperm, in CSV or NPZ format. No QApplication is constructed, only the Qt value types are used.
+
+    usage : python batchcasa.py [options] header_or_directory_or_glob ...
+"""
+
+import matplotlib
+
+# pylab is only imported by the plotting functions, make sure it never looks for a display
+matplotlib.use('Agg')
+
+import argparse
+import csv
+import fnmatch
+import glob
+import os
+import sys
+import time
+
+from multiprocessing import (Pool, cpu_count)
+
+import numpy
+
+from PyQt4.QtCore import (QString)
+
+from pycasadata import (SpermContainer, ALL_FAMILIES)
+from glyphdesigns import (AVERAGE_POSITION)
+
+HEADER_PATTERN = '*main*.txt'
+
+# the per glyph measures and the Sperm getter that returns the measure of a glyph, in table order
+GLYPH_MEASURES = (('VCL', 'getVCL'), ('VAP', 'getVAP'), ('VSL', 'getVSL'),
+                  ('BCF', 'getBCF'), ('ALH', 'getALH'), ('MAD', 'getMAD'),
+                  ('headAngle', 'getHeadAngle'), ('headLength', 'getHeadLength'), ('headWidth', 'getHeadWidth'),
+                  ('arcLength', 'getArcLength'), ('changeInAngle', 'getChangeInAngle'),
+                  ('torque', 'getTorque'), ('asymmetry', 'getAsymmetry'),
+                  ('headUncertainty', 'getHeadUncertainty'), ('flagellumUncertainty', 'getFlagellumUncertainty'))
+
+
+class DataSetResult:
+    """
+        DataSetResult holds the measure tables of a single data set, or the reason it could not be loaded.
+    """
+
+    def __init__(self, header):
+        self.header = header
+        self.ok = False
+        self.message = ''
+        self.glyphs = None
+        self.sperms = None
+        self.nSperms = 0
+        self.nFrames = 0
+        self.seconds = 0.0
+
+
+def findHeaders(arguments):
+    """
+        Return the sorted data set headers named by the arguments, each one a header file, a glob or a directory
+        that is searched for files matching HEADER_PATTERN.
+    """
+
+    headers = set()
+
+    for argument in arguments:
+
+        matches = glob.glob(argument) or [argument]
+
+        for path in matches:
+
+            if os.path.isdir(path):
+                for (root, dirs, files) in os.walk(path):
+                    for name in fnmatch.filter(files, HEADER_PATTERN):
+                        headers.add(os.path.abspath(os.path.join(root, name)))
+
+            elif os.path.isfile(path):
+                headers.add(os.path.abspath(path))
+
+            else:
+                print('no data set found : %s' % path)
+
+    return sorted(headers)
+
+
+def ratios(numerators, denominators):
+    """
+        Return the elementwise ratio of two lists of measures, NaN where the denominator is zero.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.asarray(numerators, dtype=numpy.float64) / numpy.asarray(denominators, dtype=numpy.float64)
+
+
+def newTable(names):
+    return [(name, []) for name in names]
+
+
+def appendColumns(table, values):
+    """
+        Extend every column of a table, values is a dict of equal length sequences keyed by column name.
+    """
+    for (name, column) in table:
+        column.extend(values[name])
+
+
+def measureTables(container, header):
+    """
+        Return glyphs, sperms; the per glyph and per sperm measure tables of a loaded SpermContainer.
+
+        A table is a list of (column name, list of values) pairs.
+    """
+
+    names = [name for (name, getter) in GLYPH_MEASURES]
+
+    glyphs = newTable(['dataSet', 'sperm', 'glyph', 'x', 'y'] + names + ['LIN', 'WOB', 'STR'])
+    sperms = newTable(['dataSet', 'sperm', 'frames', 'glyphs'] + names + ['LIN', 'WOB', 'STR'])
+
+    for (index, sperm) in enumerate(container):
+
+        nGlyphs = sperm.getNumberOfGlyphs()
+
+        # a measure that is missing for a glyph is None, which becomes NaN
+        values = dict((name, numpy.array([getattr(sperm, getter)(i) for i in range(nGlyphs)], dtype=numpy.float64))
+                      for (name, getter) in GLYPH_MEASURES)
+
+        values['LIN'] = ratios(values['VSL'], values['VCL'])
+        values['WOB'] = ratios(values['VAP'], values['VCL'])
+        values['STR'] = ratios(values['VSL'], values['VAP'])
+
+        positions = sperm.getPositions(AVERAGE_POSITION)[:nGlyphs]
+
+        glyphValues = dict(values)
+        glyphValues['dataSet'] = [header] * nGlyphs
+        glyphValues['sperm'] = [index] * nGlyphs
+        glyphValues['glyph'] = range(nGlyphs)
+        glyphValues['x'] = [p.x() for p in positions]
+        glyphValues['y'] = [p.y() for p in positions]
+
+        appendColumns(glyphs, glyphValues)
+
+        with numpy.errstate(invalid='ignore'):
+            spermValues = dict((name, [column.mean() if len(column) else numpy.nan])
+                               for (name, column) in values.items())
+
+        spermValues['dataSet'] = [header]
+        spermValues['sperm'] = [index]
+        spermValues['frames'] = [len(sperm)]
+        spermValues['glyphs'] = [nGlyphs]
+
+        appendColumns(sperms, spermValues)
+
+    return glyphs, sperms
+
+
+def processDataSet(job):
+    """
+        Return the DataSetResult of loading and measuring a single data set, job is a picklable tuple of
+        header, processes, quiet so this can run in a worker.
+    """
+
+    header, processes, quiet = job
+
+    result = DataSetResult(header)
+    stdout = sys.stdout
+    t0 = time.time()
+
+    try:
+        if quiet:
+            sys.stdout = open(os.devnull, 'w')
+
+        container = SpermContainer()
+        result.ok, message = container.loadDataSet(QString(header), processes, ALL_FAMILIES)
+        result.message = str(message)
+
+        if result.ok:
+            result.glyphs, result.sperms = measureTables(container, header)
+            result.nSperms = len(container)
+            result.nFrames = sum(len(sperm) for sperm in container)
+
+    except Exception as e:
+        result.ok = False
+        result.message = 'File : %s exception of type <%s> raised' % (header, e)
+
+    finally:
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    result.seconds = time.time() - t0
+
+    return result
+
+
+def mergeTables(tables):
+    """
+        Return a single table with the rows of all of the tables, which must have the same columns.
+    """
+
+    merged = newTable([name for (name, column) in tables[0]])
+
+    for table in tables:
+        appendColumns(merged, dict(table))
+
+    return merged
+
+
+def writeCSV(table, fileName):
+    with open(fileName, 'wb') as outFile:
+        writer = csv.writer(outFile)
+        writer.writerow([name for (name, column) in table])
+        writer.writerows(zip(*[column for (name, column) in table]))
+
+
+def writeNPZ(table, fileName):
+    """
+        Write a table as a compressed NumPy archive, one array per column, the column order is kept in 'columns'.
+    """
+    arrays = dict((name, numpy.asarray(column)) for (name, column) in table)
+    arrays['columns'] = numpy.array([name for (name, column) in table])
+    numpy.savez_compressed(fileName, **arrays)
+
+
+WRITERS = {'csv': writeCSV, 'npz': writeNPZ}
+
+
+def runBatch(headers, outputDirectory='.', prefix='casa', fileFormat='csv', processes=None, quiet=True):
+    """
+        Load and measure every data set in headers and write the glyph and sperm tables, return the number of
+        data sets that failed.
+
+        With fewer data sets than processes every data set loads its sperms in a pool of its own, otherwise the
+        data sets are shared out between the workers of a single pool.
+    """
+
+    if processes is None:
+        processes = cpu_count()
+
+    t0 = time.time()
+
+    if len(headers) >= processes > 1:
+
+        pool = Pool(processes)
+
+        try:
+            results = pool.map(processDataSet, [(header, 1, quiet) for header in headers], 1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    else:
+        results = [processDataSet((header, processes, quiet)) for header in headers]
+
+    elapsed = time.time() - t0
+
+    failed = 0
+
+    for result in results:
+        if result.ok:
+            print('%-60s %4d sperms %7d frames %8.2f s' % (result.header, result.nSperms, result.nFrames,
+                                                           result.seconds))
+        else:
+            failed += 1
+            print('FAILED %s : %s' % (result.header, result.message))
+
+    loaded = [result for result in results if result.ok]
+
+    if loaded:
+
+        if not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory)
+
+        for (name, tables) in (('glyphs', [result.glyphs for result in loaded]),
+                               ('sperms', [result.sperms for result in loaded])):
+            fileName = os.path.join(outputDirectory, '%s_%s.%s' % (prefix, name, fileFormat))
+            WRITERS[fileFormat](mergeTables(tables), fileName)
+            print('written : %s' % fileName)
+
+    nSperms = sum(result.nSperms for result in loaded)
+    nFrames = sum(result.nFrames for result in loaded)
+
+    print('%d data sets (%d failed), %d sperms, %d frames in %.2f s with %d processes' %
+          (len(results), failed, nSperms, nFrames, elapsed, processes))
+
+    if elapsed > 0.0:
+        print('throughput : %.2f data sets/s, %.2f sperms/s, %.1f frames/s' %
+              (len(results) / elapsed, nSperms / elapsed, nFrames / elapsed))
+
+    return failed
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Compute the CASA measures of many data sets without a display.')
+    parser.add_argument('datasets', nargs='+', help='data set headers, globs or directories to search for '
+                                                    'headers matching %s' % HEADER_PATTERN)
+    parser.add_argument('-o', '--output', default='.', help='directory the tables are written to')
+    parser.add_argument('-p', '--prefix', default='casa', help='prefix of the table file names')
+    parser.add_argument('-f', '--format', default='csv', choices=sorted(WRITERS), help='table file format')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes, '
+                                                                         'every core by default')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the loaders')
+
+    args = parser.parse_args(argv)
+
+    headers = findHeaders(args.datasets)
+
+    if not headers:
+        print('no data sets to process')
+        return 1
+
+    failed = runBatch(headers, args.output, args.prefix, args.format, args.processes, not args.verbose)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
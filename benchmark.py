@@ -0,0 +1,419 @@
+"""
+    This module is a reproducible benchmark of the stages that turn a sperm track file into glyphs.
+
+    Every track file of the data sets, and synthetic tracks made by repeating a real track end to end, is run
+    through each stage separately: parsing the file, fitting the flagella, smoothing the path, finding the path
+    crossings, the flagellum torque and asymmetry, opening a Sperm for the path view, which only computes the glyph
+    positions, and the full load of a Sperm with computeMeasures. With --gui the construction of the GlyphView scene
+    of every data set header is timed too, this needs a display.
+
+    For every stage the best wall time of a number of repeats, the cost per frame and the peak memory of the
+    process are recorded, and the results are saved as JSON so that two commits can be compared with --compare.
+
+    usage : python benchmark.py [options] [data set directories]
+"""
+
+import matplotlib
+
+# pylab is only imported by the plotting functions, only the --gui stage needs a display
+matplotlib.use('Agg')
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy
+
+import pycasadata
+
+from computation import (smoothArray, hanning, intersectPoints, averageTorque, averageAsymmetry,
+                         convertArrayToPath)
+from trackfile import (TrackData, readTrackFile, writeTrackFile, trackFiles)
+from spermtrack import (buildSpermTrack)
+
+DATA_SETS = ('data/AllSpermData', 'data/set2', 'data/set5_subsets')
+
+# the track that is repeated to make the synthetic tracks and the number of times it is repeated
+SYNTHETIC_TRACK = 'data/set2/set2_sperm1.txt'
+SYNTHETIC_SCALES = (4, 16)
+
+# frames per glyph window of the per window stages, as computeMeasures does with one second windows at 50 FPS
+WINDOW = 50
+
+
+def peakMemory():
+    """
+        Return the peak resident memory of the process so far in MB, or None where it can not be measured.
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on Mac OS X and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+
+    return peak / 1024.0
+
+
+def scaleTrack(track, scale):
+    """
+        Return a TrackData made by repeating track scale times end to end.
+
+        Each copy follows on from the last, its frame IDs continue from the previous copy and its points are
+        moved by the displacement of the centroid over the whole track, so the path keeps going.
+    """
+
+    if not len(track.centroidIDs):
+        return track
+
+    span = track.centroidIDs.max() + 1
+    shift = track.centroids[-1] - track.centroids[0]
+
+    def ids(values):
+        return numpy.concatenate([values + k * span for k in range(scale)])
+
+    def moved(points):
+        return numpy.concatenate([points + k * shift for k in range(scale)])
+
+    def offsets(values):
+        return numpy.concatenate([values[:1]] + [values[1:] + k * values[-1] for k in range(scale)])
+
+    scaled = TrackData()
+    scaled.spermID = track.spermID
+
+    scaled.centroidIDs = ids(track.centroidIDs)
+    scaled.tCerts = numpy.tile(track.tCerts, scale)
+    scaled.centroids = moved(track.centroids)
+
+    scaled.ellipseIDs = ids(track.ellipseIDs)
+    scaled.lengths = numpy.tile(track.lengths, scale)
+    scaled.widths = numpy.tile(track.widths, scale)
+    scaled.centres = moved(track.centres)
+    scaled.tilts = numpy.tile(track.tilts, scale)
+
+    scaled.headIDs = ids(track.headIDs)
+    scaled.hCerts = numpy.tile(track.hCerts, scale)
+    scaled.headOffsets = offsets(track.headOffsets)
+    scaled.headPoints = moved(track.headPoints)
+
+    scaled.flagellumIDs = ids(track.flagellumIDs)
+    scaled.fCerts = numpy.tile(track.fCerts, scale)
+    scaled.flagellumOffsets = offsets(track.flagellumOffsets)
+    scaled.flagellumPoints = moved(track.flagellumPoints)
+
+    return scaled
+
+
+def timeStage(function, repeats):
+    """
+        Return seconds, memory, result; the best wall time of repeats calls of function, the growth of the peak
+        memory of the process during the calls in MB and the result of the last call.
+    """
+
+    before = peakMemory()
+    best = None
+    result = None
+
+    for i in range(repeats):
+        t0 = time.time()
+        result = function()
+        elapsed = time.time() - t0
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    after = peakMemory()
+    growth = None if before is None else after - before
+
+    return best, growth, result
+
+
+def windows(nFrames, window=WINDOW):
+    return [(start, min(start + window, nFrames)) for start in range(0, nFrames - 1, window)]
+
+
+def trackStages(fileName, context):
+    """
+        Return a list of (stage name, function) pairs, the stages of a single track file in pipeline order.
+
+        Each stage reuses the output of the previous ones, which is computed once before it is timed.
+    """
+
+    state = {}
+
+    def parse():
+        state['data'] = readTrackFile(fileName)
+        return state['data']
+
+    def fitSpline():
+        state['track'] = buildSpermTrack(state['data'])
+        return state['track']
+
+    def smooth():
+        centroids = state['track'].centroids
+        state['avgPath'] = smoothArray(centroids, hanning(min(500, len(centroids) - 1)))
+        return state['avgPath']
+
+    def crossings():
+        path = convertArrayToPath(state['track'].centroids)
+        avgPath = convertArrayToPath(state['avgPath'])
+        return [intersectPoints(path[start:end], avgPath[start:end]) for (start, end) in windows(len(path))]
+
+    def torque():
+        track = state['track']
+        torques = []
+
+        for (start, end) in windows(len(track)):
+            flagella = track.denseFlagella(start, end)
+            torques.append(averageTorque(track.flagella(start, end) if flagella is None else flagella,
+                                         context.viscosity))
+
+        return torques
+
+    def asymmetry():
+        track = state['track']
+        path = convertArrayToPath(track.centroids)
+        return [averageAsymmetry(path[start:end], [convertArrayToPath(f) for f in track.flagella(start, end)])
+                for (start, end) in windows(len(track))]
+
+    def openSperm():
+        return pycasadata.Sperm(1, fileName, context)
+
+    def loadSperm():
+        sperm = pycasadata.Sperm(1, fileName, context)
+        sperm.computeMeasures()
+        return sperm
+
+    return [('parse', parse), ('fitSpline', fitSpline), ('smooth', smooth), ('intersectPoints', crossings),
+            ('torque', torque), ('asymmetry', asymmetry), ('openSperm', openSperm), ('loadSperm', loadSperm)]
+
+
+def benchmarkTrack(fileName, dataSet, repeats, context, scale=1):
+    """
+        Return a list of result records, one per stage, for a single track file.
+    """
+
+    records = []
+    nFrames = None
+
+    for (stage, function) in trackStages(fileName, context):
+
+        record = {'dataSet': dataSet, 'file': fileName, 'scale': scale, 'stage': stage}
+
+        try:
+            seconds, growth, result = timeStage(function, repeats)
+        except Exception as e:
+            record['error'] = '%s : %s' % (type(e).__name__, e)
+            records.append(record)
+            break
+
+        if stage == 'fitSpline':
+            nFrames = len(result)
+
+        record['seconds'] = seconds
+        record['memoryGrowthMB'] = growth
+        record['peakMemoryMB'] = peakMemory()
+        records.append(record)
+
+    for record in records:
+        record['frames'] = nFrames
+
+        if nFrames and 'seconds' in record:
+            record['perFrameMs'] = record['seconds'] * 1000.0 / nFrames
+
+    return records
+
+
+def benchmarkScene(header, repeats):
+    """
+        Return a list of result records for the construction of the GlyphView scenes of a data set header.
+
+        This constructs a QApplication and so needs a display.
+    """
+
+    from PyQt4.QtGui import (QApplication)
+    from PyQt4.QtCore import (QString)
+
+    from glyphview import (GlyphView)
+    from dialogs import (GlyphControlDialog)
+    from glyphdesigns import (CHEN_DESIGN, AVERAGE_POSITION)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    container = pycasadata.SpermContainer()
+    ok, message = container.loadDataSet(QString(header))
+
+    if not ok:
+        return [{'dataSet': header, 'file': header, 'stage': 'GlyphView', 'error': str(message)}]
+
+    dialog = GlyphControlDialog(20.0, 4.5, 4.0, 1.5, 2, CHEN_DESIGN, AVERAGE_POSITION)
+    nFrames = sum(len(sperm) for sperm in container)
+    records = []
+
+    for (stage, mode) in (('GlyphView', GlyphView.GLYPH_VIEW), ('PathView', GlyphView.PATH_VIEW)):
+
+        def build():
+            view = GlyphView(container, dialog)
+            view.setViewMode(mode)
+            app.processEvents()
+            return view
+
+        seconds, growth, view = timeStage(build, repeats)
+
+        records.append({'dataSet': header, 'file': header, 'scale': 1, 'stage': stage, 'frames': nFrames,
+                        'seconds': seconds, 'perFrameMs': seconds * 1000.0 / max(nFrames, 1),
+                        'memoryGrowthMB': growth, 'peakMemoryMB': peakMemory(),
+                        'sceneItems': len(view.scene().items())})
+
+    return records
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(dataSets=DATA_SETS, scales=SYNTHETIC_SCALES, repeats=3, fps=50.0, viscosity=1.0, gui=False):
+    """
+        Return the benchmark results of every track file of the data sets, of the synthetic tracks and, with gui,
+        of the GlyphView scenes, as a dict ready to be saved as JSON.
+    """
+
+    # the track cache would hide the cost of parsing and fitting
+    pycasadata.USE_TRACK_CACHE = False
+    context = pycasadata.AcquisitionContext(fps, 1.0, viscosity)
+
+    results = {'revision': gitRevision(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(),
+               'repeats': repeats, 'fps': fps, 'window': WINDOW, 'records': []}
+
+    stdout = sys.stdout
+
+    def quietly(function, *args):
+        # the loaders print their progress, keep the benchmark output readable
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return function(*args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    def report(records):
+        for record in records:
+            if 'perFrameMs' in record:
+                print('%-40s %-16s %6d frames %10.2f ms %8.4f ms/frame' %
+                      (os.path.basename(record['file']), record['stage'], record['frames'],
+                       record['seconds'] * 1000.0, record['perFrameMs']))
+            elif 'error' in record:
+                print('%-40s %-16s FAILED %s' % (os.path.basename(record['file']), record['stage'],
+                                                 record['error']))
+
+    for dataSet in dataSets:
+        for fileName in trackFiles(dataSet):
+            records = quietly(benchmarkTrack, fileName, dataSet, repeats, context)
+            report(records)
+            results['records'].extend(records)
+
+    if scales and os.path.isfile(SYNTHETIC_TRACK):
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            track = readTrackFile(SYNTHETIC_TRACK)
+
+            for scale in scales:
+                fileName = os.path.join(directory, 'synthetic_x%d.txt' % scale)
+                writeTrackFile(scaleTrack(track, scale), fileName)
+                records = quietly(benchmarkTrack, fileName, 'synthetic', repeats, context, scale)
+
+                for record in records:
+                    record['file'] = '%s x%d' % (SYNTHETIC_TRACK, scale)
+
+                report(records)
+                results['records'].extend(records)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if gui:
+        for dataSet in dataSets:
+            for header in sorted(os.listdir(dataSet)):
+                if 'main' in header and header.endswith('.txt'):
+                    records = quietly(benchmarkScene, os.path.join(dataSet, header), repeats)
+                    report(records)
+                    results['records'].extend(records)
+
+    return results
+
+
+def compareResults(oldResults, newResults):
+    """
+        Print the speed up of every stage of every file between two sets of results.
+    """
+
+    def key(record):
+        return record['file'], record.get('scale', 1), record['stage']
+
+    old = dict((key(record), record) for record in oldResults['records'] if 'seconds' in record)
+
+    print('comparing %s to %s' % (oldResults.get('revision'), newResults.get('revision')))
+
+    for record in newResults['records']:
+
+        previous = old.get(key(record))
+
+        if previous is None or 'seconds' not in record:
+            continue
+
+        speedUp = previous['seconds'] / record['seconds'] if record['seconds'] > 0.0 else float('inf')
+
+        print('%-40s %-16s %10.2f ms -> %10.2f ms  x%.2f%s' %
+              (os.path.basename(record['file']), record['stage'], previous['seconds'] * 1000.0,
+               record['seconds'] * 1000.0, speedUp, '  SLOWER' if speedUp < 0.9 else ''))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the PyCASA pipeline.')
+    parser.add_argument('datasets', nargs='*', default=list(DATA_SETS), help='data set directories')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file the results are saved to')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='repeats of every stage, the best is kept')
+    parser.add_argument('-s', '--scales', type=int, nargs='*', default=list(SYNTHETIC_SCALES),
+                        help='repeats of %s in the synthetic tracks' % SYNTHETIC_TRACK)
+    parser.add_argument('--fps', type=float, default=50.0, help='frames per second of the track files')
+    parser.add_argument('--gui', action='store_true', help='also time the GlyphView scenes, needs a display')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.datasets, args.scales, args.repeats, args.fps, gui=args.gui)
+
+    with open(args.output, 'w') as outFile:
+        json.dump(results, outFile, indent=1, sort_keys=True)
+
+    print('results saved to : %s' % args.output)
+
+    if args.compare:
+        with open(args.compare) as inFile:
+            compareResults(json.load(inFile), results)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+    This module bakes the colour maps of the glyphs into lookup tables.
+
+    The maps used to be matplotlib LinearSegmentedColormap objects, which meant importing pylab at startup and
+    evaluating the map once per colour channel in every paint. Here every map is interpolated once, at import,
+    into a table of N entries, as RGBA floats, as 8 bit RGB and as QColors, so a lookup is an index computation
+    for a single value or for an array of values. The tables hold exactly the colours matplotlib gives for the
+    same segment data, see testColourMaps.
+"""
+
+import sys
+
+import numpy
+
+from PyQt4.QtGui import (QColor)
+
+### the segment data of the colour maps, as for matplotlib.colors.LinearSegmentedColormap ###
+
+VSLColourDict = { 'red'  : ((0.00,0.0,0.0), (0.0035,1.0,1.0), (0.083,1.0,1.0), (0.16,1.0,1.0),
+                            (0.33,0.5,0.5), (0.6600,0.0,0.0), (1.000,0.0,0.0)),
+                  'green': ((0.0,0.0,0.0), (0.0035,1.0,1.0), (0.083,0.75,0.75), (0.16,0.0,0.0),
+                            (0.33,1.0,1.0), (0.66,1.0,1.0), (1.0,0.0,0.0)),
+                  'blue' : ((0.0,0.0,0.0), (0.0035,0.0,0.0), (0.083,0.5,0.5),   (0.16,1.0,1.0),
+                            (0.33,0.5,0.5), (0.66,1.0,1.0), (1.0,1.0,1.0))   }
+
+UncertaintyColourDict = { 'red'  : ((0.0,0.0,0.0), (0.5,1.0,1.0), (1.0,1.0,1.0)),
+                          'green': ((0.0,1.0,1.0), (0.5,1.0,1.0), (1.0,0.0,0.0)),
+                          'blue' : ((0.0,0.0,0.0), (0.5,0.0,0.0), (1.0,0.0,0.0))   }
+
+timeColourDict = { 'red':   ( (0.0, 0.894117647, 0.894117647), (0.2, 0.556862745, 0.556862745),
+                              (0.4, 0.529411765, 0.529411765), (0.6, 0.890196078, 0.890196078),
+                              (0.8, 0.084507042, 0.084507042), (1.0, 0.239215686, 0.23921568 ) ),
+                   'green': ( (0.0, 0.674509804, 0.674509804), (0.2, 0.854901961, 0.854901961),
+                              (0.4, 0.439215686, 0.439215686), (0.6, 0.207843137, 0.207843137),
+                              (0.8, 0.823529412, 0.823529412), (1.0, 0.098039216, 0.098039216) ),
+                   'blue':  ( (0.0, 0.674509804, 0.674509804), (0.2, 0.592156863, 0.592156863),
+                              (0.4, 0.815686275, 0.815686275), (0.6, 0.207843137, 0.207843137),
+                              (0.8, 0.2,         0.2        ), (1.0, 0.68627451,  0.68627451 ) ) }
+
+# the number of entries of the tables, as the matplotlib colour maps they replace
+LUT_SIZE = 256
+
+
+def mappingArray(N, segments):
+    """
+        Return the N values of one channel of a colour map interpolated from its (x, y0, y1) segments, as
+        matplotlib.colors.makeMappingArray.
+    """
+
+    segments = numpy.asarray(segments, dtype=numpy.float64)
+    x = segments[:, 0] * (N - 1)
+    y0 = segments[:, 1]
+    y1 = segments[:, 2]
+
+    if N == 1:
+        return numpy.array([y0[-1]])
+
+    xind = (N - 1) * numpy.linspace(0.0, 1.0, N)
+    ind = numpy.searchsorted(x, xind)[1:-1]
+
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = numpy.concatenate([[y1[0]], distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1], [y0[-1]]])
+
+    return numpy.clip(lut, 0.0, 1.0)
+
+
+class ColourLUT:
+    """
+        ColourLUT is a colour map baked into a table of N colours.
+
+        Calling it with a value in [0, 1] returns an (r, g, b, a) tuple and with an array of values an (M, 4)
+        array, as a matplotlib colour map. Values below 0 or above 1 take the first or last colour, as does NaN.
+    """
+
+    def __init__(self, name, segments, N=LUT_SIZE):
+
+        self.name = name
+        self.N = N
+
+        self.rgba = numpy.ones((N, 4))
+
+        for (channel, colour) in enumerate(('red', 'green', 'blue')):
+            self.rgba[:, channel] = mappingArray(N, segments[colour])
+
+        self.rgb8 = numpy.round(self.rgba[:, :3] * 255.0).astype(numpy.uint8)
+
+        self.__tuples = [tuple(row) for row in self.rgba.tolist()]
+        self.__colours = [QColor.fromRgbF(*row) for row in self.__tuples]
+
+    def __repr__(self):
+        return 'ColourLUT( %s, %d )' % (self.name, self.N)
+
+    def __len__(self):
+        return self.N
+
+    def __call__(self, value):
+
+        if numpy.ndim(value) == 0:
+            return self.__tuples[self.index(float(value))]
+
+        return self.rgba[self.indices(value)]
+
+    def index(self, value):
+        """
+            Return the entry of the table for a single value, a NaN gets the first entry.
+        """
+        return int(min(value * self.N, self.N - 1)) if value > 0.0 else 0
+
+    def indices(self, values):
+        """
+            Return the entries of the table for an array of values, a NaN gets the first entry.
+        """
+        values = numpy.nan_to_num(numpy.asarray(values, dtype=numpy.float64) * self.N)
+        return numpy.clip(values, 0, self.N - 1).astype(numpy.int64)
+
+    def qColor(self, value):
+        """
+            Return the QColor of a value, the QColors are shared by every lookup so they must not be changed.
+        """
+        return self.__colours[self.index(value)]
+
+    def qColors(self, values):
+        """
+            Return the list of the QColors of an array of values.
+        """
+        return [self.__colours[i] for i in self.indices(values).tolist()]
+
+
+VSLColourMap = ColourLUT('VSLColormap', VSLColourDict)
+UncertaintyColourMap = ColourLUT('UncertaintyColormap', UncertaintyColourDict)
+timeColourMap = ColourLUT('TimeColormap', timeColourDict)
+
+
+def testColourMaps(samples=100000, seed=0):
+    """
+        Compare the scalar and vectorised lookups of the tables with the matplotlib colour maps they replace.
+    """
+
+    from matplotlib.colors import (LinearSegmentedColormap)
+
+    print('testing the colour lookup tables against matplotlib')
+
+    values = numpy.random.RandomState(seed).uniform(-0.1, 1.1, samples)
+    values = numpy.concatenate([values, numpy.linspace(0.0, 1.0, 1025), [0.0, 1.0, numpy.nan]])
+
+    failures = 0
+
+    for (lut, segments) in ((VSLColourMap, VSLColourDict), (UncertaintyColourMap, UncertaintyColourDict),
+                            (timeColourMap, timeColourDict)):
+
+        reference = LinearSegmentedColormap(lut.name, segments, lut.N)
+        with numpy.errstate(invalid='ignore'):
+            expected = numpy.asarray(reference(values))
+
+        errors = []
+
+        if not numpy.array_equal(lut(values), expected):
+            errors.append('vectorised')
+
+        if [lut(v) for v in values[:2000].tolist()] != [tuple(row) for row in expected[:2000].tolist()]:
+            errors.append('scalar')
+
+        if [lut.qColor(v).getRgbF() for v in values[-1028:-1].tolist()] != \
+           [QColor.fromRgbF(*row).getRgbF() for row in expected[-1028:-1].tolist()]:
+            errors.append('QColor')
+
+        failures += len(errors)
+        print('%-20s %s' % (lut.name, 'ok' if not errors else ', '.join(errors)))
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testColourMaps(int(sys.argv[1]))
+    else:
+        testColourMaps()
@@ -12,18 +12,20 @@ from __future__ import division
 from PyQt4.QtGui import (QVector2D, QGraphicsView, QGraphicsScene, QPainter, QApplication, QPen)
 from PyQt4.QtCore import (QPointF, QLineF, QRectF, Qt)
 
-from math import (pi, cos, acos, atan2, atan, degrees, log, isnan)
+from math import (pi, cos, acos, atan2, atan, degrees, isnan)
+from multiprocessing import (Pool, cpu_count)
 from geometry import (toPoint, toVector, intersectPoint)
 
 from mygraphicsitems import (PolyLine)
 
 from scipy.interpolate import (splprep, splev)
+from scipy.signal import fftconvolve
 from numpy import linspace
 
 #import Numeric
 import numpy
-import pylab
 import sys
+import time
 
 
 def average(values):
@@ -80,10 +82,11 @@ def GrayHancockCoefficients(l=0.001, b=0.09):
         Return the resistive force coefficients for a default set of parameters.
 
         The resistive forces that are exerted on the flagellum by the fluid the cell is swimming in are given
-        by this function. These were originally estimated by Gray and Hancock in 1955.
+        by this function. These were originally estimated by Gray and Hancock in 1955. l may also be an array of
+        lengths.
     """
 
-    Ct = (2.0 * pi) / (log((2.0 * l) / b) - 0.5)
+    Ct = (2.0 * pi) / (numpy.log((2.0 * l) / b) - 0.5)
     Cn = 2.0 * Ct
 
     return Ct, Cn
@@ -124,6 +127,22 @@ def convertNumPyToPath(x, y):
     return path
 
 
+def convertArrayToPath(points):
+    """
+        Return path, a list of QPointF objects from an (N, 2) numpy array of points.
+    """
+
+    return [QPointF(x, y) for (x, y) in numpy.asarray(points).tolist()]
+
+
+def convertPathToArray(path):
+    """
+        Return an (N, 2) numpy array of points from a list of QPointF objects.
+    """
+
+    return numpy.array([(p.x(), p.y()) for p in path], dtype=numpy.float64).reshape(-1, 2)
+
+
 def fitSpline(points, smoothness, degree, nPoints=100):
     """
         Return a smoothed list of QPointF points representing a path.
@@ -139,14 +158,105 @@ def fitSpline(points, smoothness, degree, nPoints=100):
 
     x, y = convertPathForNumPy(points)
 
+    fitted = fitSplineArray(numpy.column_stack((x, y)), smoothness, degree, nPoints)
+
+    return convertNumPyToPath(fitted[:, 0], fitted[:, 1])
+
+
+# the parameter values the fitted splines are evaluated at, cached by number of points
+SPLINE_GRIDS = {}
+
+# the number of curves fitted by each worker when fitSplines runs in parallel
+SPLINE_CHUNK = 256
+
+
+def splineGrid(nPoints):
+    """
+        Return the read only array of nPoints evenly spaced spline parameter values from 0 to 1.
+    """
+
+    if nPoints not in SPLINE_GRIDS:
+        grid = linspace(0, 1, nPoints)
+        grid.setflags(write=False)
+        SPLINE_GRIDS[nPoints] = grid
+
+    return SPLINE_GRIDS[nPoints]
+
+
+def fitSplineArray(points, smoothness, degree, nPoints=100):
+    """
+        Return an (nPoints, 2) array of points on a smoothing spline fitted to an (N, 2) array of points.
+
+        This is the NumPy counterpart of fitSpline, the points never pass through QPointF objects.
+    """
+
     # find the knot points
 
-    t, u = splprep([x, y], s=smoothness, k=degree)
+    t, u = splprep([points[:, 0], points[:, 1]], s=smoothness, k=degree)
 
     # evaluate spline, including interpolated points
-    xNew, yNew = splev(linspace(0, 1, nPoints), t)
+    xNew, yNew = splev(splineGrid(nPoints), t)
+
+    return numpy.column_stack((xNew, yNew))
+
+
+def fitSplineChunk(job):
+    """
+        Return an (M, nPoints, 2) array of the splines fitted to a chunk of curves, job is a picklable tuple of
+        curves, smoothness, degree, nPoints so this can run in a worker.
+    """
+
+    curves, smoothness, degree, nPoints = job
+    fitted = numpy.empty((len(curves), nPoints, 2))
+
+    for (i, points) in enumerate(curves):
+        fitted[i] = fitSplineArray(points, smoothness, degree, nPoints)
+
+    return fitted
+
+
+def fitSplines(curves, smoothness, degree, nPoints=100, processes=1):
+    """
+        Return a dense (M, nPoints, 2) array of the smoothing splines fitted to each of M curves.
+
+        curves    : a list of (N_i, 2) arrays, every curve must have more than one point
+        processes : with more than one process the curves are fitted in chunks in a pool of workers,
+                    processes=None uses every core.
+    """
+
+    chunks = [curves[i:i + SPLINE_CHUNK] for i in range(0, len(curves), SPLINE_CHUNK)]
+
+    if processes is None:
+        processes = cpu_count()
 
-    return convertNumPyToPath(xNew, yNew)
+    processes = min(processes, len(chunks))
+
+    if processes < 2:
+        return fitSplineChunk((curves, smoothness, degree, nPoints))
+
+    pool = Pool(processes)
+
+    try:
+        fitted = pool.map(fitSplineChunk, [(chunk, smoothness, degree, nPoints) for chunk in chunks])
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return numpy.concatenate(fitted)
+
+
+def lastGoodIndices(counts):
+    """
+        Return for each of a sequence of curves the index of the last curve, up to and including itself, with more
+        than one point, or -1 if there is none yet.
+
+        counts : the number of points in each curve, in order
+    """
+
+    counts = numpy.asarray(counts)
+    indices = numpy.where(counts > 1, numpy.arange(len(counts)), -1)
+
+    return numpy.maximum.accumulate(indices) if len(indices) else indices
 
 
 def factorial(n):
@@ -424,41 +534,47 @@ def averageVector(centroids=None):
     return avgVec / (N - 1)
 
 
-def hanning(w):
+# windows are cached by (name, w) as they are reused for every window of every sperm
+WINDOWS = {}
+
+# above this window length smoothArray convolves using the FFT rather than summing the weighted points directly
+FFT_WINDOW_LENGTH = 1024
+
+
+def cachedWindow(name, w, weights):
     """
-        Return a Hanning window, a list of floating point weights, of length w.
+        Return the read only array of the window name of length w, computing it with weights(j, a) the first time.
     """
 
-    window = []
-
-    m = int(w * 0.5)
-    a = w * 0.5
+    key = (name, w)
 
-    for j in range(-m, m + 1):
-        window.append(0.5 * (1.0 + cos((pi * j) / a)))
+    if key not in WINDOWS:
+        m = int(w * 0.5)
+        a = w * 0.5
+        window = weights(numpy.arange(-m, m + 1, dtype=numpy.float64), a)
+        window.setflags(write=False)
+        WINDOWS[key] = window
 
-    return window
+    return WINDOWS[key]
 
 
-def hamming(w):
+def hanning(w):
     """
-        Return a Hamming window, a list of floating point weights, of length w.
+        Return a Hanning window, an array of floating point weights, of length w.
     """
+    return cachedWindow('hanning', w, lambda j, a: 0.5 * (1.0 + numpy.cos((pi * j) / a)))
 
-    window = []
 
-    m = int(w * 0.5)
-    a = w * 0.5
-
-    for j in range(-m, m + 1):
-        window.append(0.54 + 0.46 * cos((pi * j) / a))
-
-    return window
+def hamming(w):
+    """
+        Return a Hamming window, an array of floating point weights, of length w.
+    """
+    return cachedWindow('hamming', w, lambda j, a: 0.54 + 0.46 * numpy.cos((pi * j) / a))
 
 
 def blackman(w):
     """
-        Return a Blackman window, a list of floating point weights, of length w.
+        Return a Blackman window, an array of floating point weights, of length w.
 
         The coefficients in this function are taken from the description of the Blackman window on Wikipedia.
     """
@@ -467,57 +583,88 @@ def blackman(w):
     c1 = 0.24828
     c2 = 0.038424
 
-    window = []
+    return cachedWindow('blackman', w,
+                        lambda j, a: c0 + c1 * numpy.cos((pi * j) / a) + c2 * numpy.cos((2.0 * pi * j) / a))
 
-    m = int(w * 0.5)
-    a = w * 0.5
-
-    for j in range(-m, m + 1):
-        window.append(c0 + c1 * cos((pi * j) / a) + c2 * cos((2.0 * pi * j) / a))
 
-    return window
+def smoothArray(points, window):
+    """
+        Return an (N, 2) array of points smoothed by passing a window over the (N, 2) array points.
 
+        The path is padded with copies of its end points, convolved with the window and scaled by 2 / len(window).
+        The first and last points are kept as they are. Windows longer than FFT_WINDOW_LENGTH are convolved with
+        the FFT.
 
-def smooth(path, window):
+        points : (N, 2) array of the points of a path.
+        window : an odd length array of scalar weights i.e. from hanning, hamming or blackman.
     """
-        Return a smoothed list of QPointF point objects that are smoothed using an arbitrary window.
 
-        Here we take a list of points representing a path and smooth the path by passing a window over the points.
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    window = numpy.asarray(window, dtype=numpy.float64)
 
-        path   : is a list of QPointF objects representing a path.
-        window : is a list of scalar weights precomputed using a window function i.e. hanning, hamming or blackman.
+    N = len(points)
+    w = len(window)
+
+    if N < w or w < 3:
+        return points.copy()
+
+    m = int(w * 0.5)
+    padded = numpy.concatenate((numpy.repeat(points[:1], m, axis=0), points, numpy.repeat(points[-1:], m, axis=0)))
+
+    if w > FFT_WINDOW_LENGTH:
+        # the window is reversed so that the convolution weights the points in the same order as the window
+        smoothed = fftconvolve(padded, window[::-1, numpy.newaxis], mode='valid')
+        smoothed *= 2.0 / w
+    else:
+        smoothed = windowSums(padded, window)
+
+    smoothed[0] = points[0]
+    smoothed[-1] = points[-1]
 
+    return smoothed
+
+
+def windowSums(padded, window):
     """
+        Return the (len(padded) - len(window) + 1, 2) array of the window weighted sums of the (M, 2) array padded,
+        scaled by 2 / len(window), i.e. the smoothed points of an already padded path.
 
-    N = len(path)
+        There is one pass per weight over all of the points, the terms are summed in the same order as the
+        original point by point loop so the result does not change by rounding, and any run of the padded path
+        gives the same bits for the points it covers.
+    """
     w = len(window)
+    N = len(padded) - w + 1
 
-    padded = setValue(w, path[0]) + path + setValue(w, path[-1])
-    smoothed = []
+    if N < 1:
+        return numpy.zeros((0, 2))
 
-    if N < w or w < 3:
-        return path
+    smoothed = numpy.zeros((N, 2))
 
-    n = 2.0 / w
+    for k in range(w):
+        smoothed += padded[k:k + N] * window[k]
 
-    smoothed.append(path[0])
+    smoothed *= 2.0 / w
 
-    for i in range(w + 1, w + N - 1):
+    return smoothed
 
-        m = int(w * 0.5)
-        sumPoint = QPointF(0.0, 0.0)
-        k = 0
-
-        for j in range(-m, m + 1):
-            sumPoint += padded[i + j] * window[k]
-            k += 1
-        
-        sumPoint *= n
-        smoothed.append(sumPoint)
-    
-    smoothed.append(path[N - 1])
 
-    return smoothed
+def smooth(path, window):
+    """
+        Return a smoothed list of QPointF point objects that are smoothed using an arbitrary window.
+
+        Here we take a list of points representing a path and smooth the path by passing a window over the points,
+        see smoothArray.
+
+        path   : is a list of QPointF objects representing a path.
+        window : is a list of scalar weights precomputed using a window function i.e. hanning, hamming or blackman.
+
+    """
+
+    if len(path) < len(window) or len(window) < 3:
+        return path
+
+    return convertArrayToPath(smoothArray(convertPathToArray(path), window))
 
 
 def catMullRomFit(p, nPoints=100):
@@ -606,10 +753,257 @@ def amplitudes(path, avgPath):
     return amps
 
 
+CELL_ROW = 1 << 20
+
+# the cell keys of a group of segments start at a multiple of this, above every key of the grid
+GROUP_STRIDE = CELL_ROW * CELL_ROW
+
+# a segment that overlaps more grid cells than this is tested against the bounding boxes of the other polyline
+MAX_SEGMENT_CELLS = 64
+
+# the number of bounding box tests done at once for the long segments
+BOX_BLOCK = 1 << 18
+
+
+def cellBounds(starts, ends, size, origin):
+    """
+        Return lo, span; the first grid cell and the number of grid cells along x and y of the bounding box of
+        every segment, for grid cells of side size.
+    """
+
+    lo = numpy.floor((numpy.minimum(starts, ends) - origin) / size).astype(numpy.int64)
+    hi = numpy.floor((numpy.maximum(starts, ends) - origin) / size).astype(numpy.int64)
+
+    return lo, hi - lo + 1
+
+
+def segmentCells(indices, lo, span, groups):
+    """
+        Return segments, cells; every grid cell overlapped by the bounding box of each of the segments indices, as
+        pairs of segment index and cell key, lo and span are given by cellBounds. The key holds the group of the
+        segment so that segments of different groups never share a cell.
+    """
+
+    counts = span[indices, 0] * span[indices, 1]
+
+    segments = numpy.repeat(indices, counts)
+    k = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    nx = span[segments, 0]
+    cx = lo[segments, 0] + k % nx
+    cy = lo[segments, 1] + k // nx
+
+    # cells are keyed by group then by row so that the key stays unique over the whole grid
+    return segments, groups[segments] * GROUP_STRIDE + cy * CELL_ROW + cx
+
+
+def boxPairs(indices, p1, p2, pGroups, others, q1, q2, qGroups):
+    """
+        Return i, j; the index pairs of the segments p1[i]p2[i], i in indices, and q1[j]q2[j], j in others, of the
+        same group whose bounding boxes overlap, tested about BOX_BLOCK pairs at a time.
+    """
+
+    # the segments of the same group as each segment of indices are a run of the others sorted by group
+    others = others[numpy.argsort(qGroups[others], kind='mergesort')]
+    groups = qGroups[others]
+    first = numpy.searchsorted(groups, pGroups[indices], side='left')
+    counts = numpy.searchsorted(groups, pGroups[indices], side='right') - first
+    total = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+    iPairs = [numpy.zeros(0, dtype=numpy.int64)]
+    jPairs = [numpy.zeros(0, dtype=numpy.int64)]
+    start = 0
+
+    while start < len(indices):
+
+        stop = max(start + 1, numpy.searchsorted(total, total[start] + BOX_BLOCK, side='right') - 1)
+        n = counts[start:stop]
+
+        i = numpy.repeat(indices[start:stop], n)
+        k = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+        j = others[numpy.repeat(first[start:stop], n) + k]
+
+        overlap = numpy.all((numpy.minimum(p1[i], p2[i]) <= numpy.maximum(q1[j], q2[j])) &
+                            (numpy.minimum(q1[j], q2[j]) <= numpy.maximum(p1[i], p2[i])), axis=1)
+
+        iPairs.append(i[overlap])
+        jPairs.append(j[overlap])
+        start = stop
+
+    return numpy.concatenate(iPairs), numpy.concatenate(jPairs)
+
+
+def candidateSegmentPairs(p1, p2, q1, q2, groups=None):
+    """
+        Return i, j; the index pairs of the segments p1[i]p2[i] and q1[j]q2[j] whose bounding boxes share a grid cell.
+
+        The grid is sized on the larger of the median segment lengths of the two polylines so that each segment
+        only touches a few cells. After sorting the cells of one polyline, the cells of the other are matched with
+        a binary search, so the cost is O(N log N) plus the number of candidate pairs rather than the O(N^2) of
+        testing every pair.
+
+        A segment of zero length is parallel to every segment so it never crosses one and is left out, a stationary
+        track then costs nothing. A segment that overlaps more than MAX_SEGMENT_CELLS cells, e.g. a jump of a
+        stationary track, is instead tested against the bounding boxes of the segments of the other polyline.
+
+        groups : the group of every segment of both polylines, e.g. its glyph window, only the segments of the same
+                 group are paired and a segment of a negative group is left out. By default there is one group.
+    """
+
+    if groups is None:
+        pGroups = numpy.zeros(len(p1), dtype=numpy.int64)
+        qGroups = numpy.zeros(len(q1), dtype=numpy.int64)
+    else:
+        pGroups = qGroups = numpy.asarray(groups, dtype=numpy.int64)
+
+    pLengths = numpy.hypot(*(p2 - p1).T)
+    qLengths = numpy.hypot(*(q2 - q1).T)
+    pMoving = numpy.flatnonzero((pLengths > 0.0) & (pGroups >= 0))
+    qMoving = numpy.flatnonzero((qLengths > 0.0) & (qGroups >= 0))
+
+    if not (len(pMoving) and len(qMoving)):
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    allPoints = numpy.concatenate((p1, p2, q1, q2))
+    origin = allPoints.min(axis=0)
+    size = max(numpy.median(pLengths[pMoving]), numpy.median(qLengths[qMoving]))
+
+    # the grid may not be wider than a row of keys, grow the cells for very sparse data
+    size = max(size, (allPoints.max(axis=0) - origin).max() / (CELL_ROW - 2))
+
+    pLo, pSpan = cellBounds(p1, p2, size, origin)
+    qLo, qSpan = cellBounds(q1, q2, size, origin)
+
+    pLong = pSpan[pMoving, 0] * pSpan[pMoving, 1] > MAX_SEGMENT_CELLS
+    qLong = qSpan[qMoving, 0] * qSpan[qMoving, 1] > MAX_SEGMENT_CELLS
+
+    pSegments, pCells = segmentCells(pMoving[~pLong], pLo, pSpan, pGroups)
+    qSegments, qCells = segmentCells(qMoving[~qLong], qLo, qSpan, qGroups)
+
+    order = numpy.argsort(qCells, kind='mergesort')
+    qSegments = qSegments[order]
+    qCells = qCells[order]
+
+    first = numpy.searchsorted(qCells, pCells, side='left')
+    last = numpy.searchsorted(qCells, pCells, side='right')
+    counts = last - first
+
+    i = numpy.repeat(pSegments, counts)
+    k = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    j = qSegments[numpy.repeat(first, counts) + k]
+
+    # the long segments of either polyline against every segment of the other
+    pi, pj = boxPairs(pMoving[pLong], p1, p2, pGroups, qMoving, q1, q2, qGroups)
+    qj, qi = boxPairs(qMoving[qLong], q1, q2, qGroups, pMoving, p1, p2, pGroups)
+
+    i = numpy.concatenate((i, pi, qi))
+    j = numpy.concatenate((j, pj, qj))
+
+    # two segments can share more than one cell, keep every pair once in (i, j) order
+    pairs = numpy.unique(i * len(q1) + j)
+
+    return pairs // len(q1), pairs % len(q1)
+
+
+def crossingPoints(path, avgPath):
+    """
+        Return an (M, 2) array of the points where the segments of path cross the segments of avgPath.
+
+        The crossings are in the order of the segments of path then of avgPath and every pair of segments is
+        tested in the same way as geometry.intersect. Pairs of parallel segments have no single crossing point
+        and are ignored.
+
+        path    : (N, 2) array of the points of the path of a sperm
+        avgPath : (N, 2) array of a smoothed version of path
+    """
+    return crossingSegments(path, avgPath)[2]
+
+
+def crossingSegments(path, avgPath, groups=None):
+    """
+        Return i, j, points; the crossings of crossingPoints together with the index i of the segment of path and
+        the index j of the segment of avgPath of each of them.
+
+        groups : the group of every segment of path and avgPath, which then have the same number of points, only
+                 the segments of the same group are tested, see candidateSegmentPairs
+    """
+
+    path = numpy.asarray(path, dtype=numpy.float64).reshape(-1, 2)
+    avgPath = numpy.asarray(avgPath, dtype=numpy.float64).reshape(-1, 2)
+
+    if len(path) < 2 or len(avgPath) < 2:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0, 2))
+
+    p1 = path[:-1]
+    p2 = path[1:]
+    q1 = avgPath[:-1]
+    q2 = avgPath[1:]
+
+    i, j = candidateSegmentPairs(p1, p2, q1, q2, groups)
+
+    a = q2[j] - q1[j]
+    b = p2[i] - p1[i]
+    c = p1[i] - q1[j]
+
+    d = c[:, 1] * a[:, 0] - c[:, 0] * a[:, 1]
+    e = c[:, 1] * b[:, 0] - c[:, 0] * b[:, 1]
+    f = a[:, 1] * b[:, 0] - a[:, 0] * b[:, 1]
+
+    # d and e must lie between 0 and f, whatever the sign of f
+    low = numpy.minimum(f, 0.0)
+    high = numpy.maximum(f, 0.0)
+    hit = (f != 0.0) & (d >= low) & (d <= high) & (e >= low) & (e <= high)
+
+    i = i[hit]
+    j = j[hit]
+
+    s1 = p1[i]
+    s2 = p2[i]
+    t1 = q1[j]
+    t2 = q2[j]
+
+    u = s1[:, 0] * s2[:, 1] - s1[:, 1] * s2[:, 0]
+    v = t1[:, 0] * t2[:, 1] - t1[:, 1] * t2[:, 0]
+    ds = s1 - s2
+    dt = t1 - t2
+    den = ds[:, 0] * dt[:, 1] - ds[:, 1] * dt[:, 0]
+
+    return i, j, (u[:, numpy.newaxis] * dt - ds * v[:, numpy.newaxis]) / den[:, numpy.newaxis]
+
+
 def intersectPoints(path, avgPath):
     """
         Return a list of all of the intersection points between the sperm path and it's average path
 
+        The last point of path always closes the list. The crossings are found by crossingPoints, which only tests
+        the pairs of segments that are close to each other, rather than every pair of segments.
+
+        path     : set of QPointF objects representing the path of a sperm
+        avgPath  : a smoothed version of path
+    """
+
+    intersections = []
+    N = len(path)
+    M = len(avgPath)
+
+    if not (M == N):
+        return intersections
+
+    intersections = convertArrayToPath(crossingPoints(convertPathToArray(path), convertPathToArray(avgPath)))
+
+    if not len(intersections):
+        intersections.append(path[-1])
+
+    elif intersections[-1] != path[-1]:
+        intersections.append(path[-1])
+
+    return intersections
+
+
+def intersectPointsBruteForce(path, avgPath):
+    """
+        Return a list of all of the intersection points between the sperm path and it's average path
+
+        This is the original implementation of intersectPoints, it is kept as the reference for testIntersectPoints.
         This is achieved using a less than optimal algorithm, N^2. All line segments are computed for
         each of the paths and all line segments are tested for intersection.
 
@@ -861,10 +1255,18 @@ def viscousDrag(i, flagella):
 def averageViscousDrag(flagella):
     """
       Return the average viscous drag forces over a set of captured flagella.
+
+      Flagella that all have the same number of points are computed in one batch by batchViscousDrag.
     """
 
     N = len(flagella)
+    stacked = stackFlagella(flagella)
+
+    if stacked is not None:
+        drag = batchViscousDrag(stacked).mean(axis=0)
+        return QVector2D(drag[0], drag[1])
 
+    flagella = [convertArrayToPath(f) if isinstance(f, numpy.ndarray) else f for f in flagella]
     totalViscousDrag = 0.0
 
     for i in range(N):
@@ -922,10 +1324,17 @@ def torque(i, flagella, viscosity):
 def averageTorque(flagella, viscosity):
     """
       Return the average viscous drag forces over a set of captured flagella.
+
+      Flagella that all have the same number of points are computed in one batch by batchTorque.
     """
 
     N = len(flagella)
+    stacked = stackFlagella(flagella)
+
+    if stacked is not None:
+        return float(batchTorque(stacked, viscosity).mean())
 
+    flagella = [convertArrayToPath(f) if isinstance(f, numpy.ndarray) else f for f in flagella]
     totalTorque = 0.0
 
     for i in range(N):
@@ -934,6 +1343,150 @@ def averageTorque(flagella, viscosity):
     return totalTorque / N
 
 
+def stackFlagella(flagella):
+    """
+        Return a (frames, points, 2) array of a set of flagella, or None if they differ in their number of points.
+
+        flagella : a (frames, points, 2) array or a list of (points, 2) arrays or of lists of QPointF objects.
+    """
+
+    if isinstance(flagella, numpy.ndarray):
+        return flagella if flagella.ndim == 3 else None
+
+    arrays = [f if isinstance(f, numpy.ndarray) else convertPathToArray(f) for f in flagella]
+
+    if not arrays or len(set(len(f) for f in arrays)) != 1:
+        return None
+
+    return numpy.array(arrays, dtype=numpy.float64).reshape(len(arrays), -1, 2)
+
+
+def resistiveForces(flagella, Ct, Cn, velocities=None):
+    """
+        Return a (frames, points, 2) array of the resistive force on every point of every flagellum.
+
+        This is the batched form of the substitute closures of torque and viscousDrag, the tangents, normals and
+        frame to frame velocities are differenced exactly as in tangentVector, normalVector and positionVector.
+
+        flagella   : a (frames, points, 2) array of flagella
+        Ct, Cn     : the tangential and normal Gray and Hancock coefficients, scalars or arrays of shape (frames,)
+        velocities : a (frames, points, 2) array of the velocities of the points, by default they are differenced
+                     from the flagella themselves
+    """
+
+    X = flagella
+    nFrames, nPoints = X.shape[:2]
+
+    # tangents, one sided at the ends of the flagellum and central in between
+    t = numpy.empty_like(X)
+    ends = X[:, 1] - X[:, 0]
+    t[:, 0] = ends / numpy.hypot(ends[:, 0], ends[:, 1])[:, numpy.newaxis]
+    ends = X[:, -1] - X[:, -2]
+    t[:, -1] = ends / numpy.hypot(ends[:, 0], ends[:, 1])[:, numpy.newaxis]
+    middle = X[:, 2:] - X[:, :-2]
+    t[:, 1:-1] = middle / (numpy.hypot(middle[..., 0], middle[..., 1]) * 0.5)[..., numpy.newaxis]
+
+    n = numpy.empty_like(t)
+    n[..., 0] = -t[..., 1]
+    n[..., 1] = t[..., 0]
+
+    # velocities, one sided at the first and last frames and central in between
+    U = numpy.zeros_like(X) if velocities is None else velocities
+
+    if nFrames > 1 and velocities is None:
+        U[0] = X[1] - X[0]
+        U[-1] = X[-1] - X[-2]
+        U[1:-1] = (X[2:] - X[:-2]) * 0.5
+
+    Ct = numpy.reshape(Ct, (-1, 1))
+    Cn = numpy.reshape(Cn, (-1, 1))
+
+    st = (t * U).sum(axis=2) * Ct
+    sn = (n * U).sum(axis=2) * Cn
+
+    return t * st[..., numpy.newaxis] + n * sn[..., numpy.newaxis]
+
+
+def segmentLengths(flagella):
+    """
+        Return a (frames, points - 1) array of the lengths of the segments of a (frames, points, 2) array of flagella.
+    """
+    d = flagella[:, 1:] - flagella[:, :-1]
+    return numpy.hypot(d[..., 0], d[..., 1])
+
+
+def batchViscousDrag(flagella):
+    """
+        Return a (frames, 2) array of the viscous drag force acting on each of a (frames, points, 2) array of flagella.
+    """
+
+    flagella = numpy.asarray(flagella, dtype=numpy.float64)
+
+    if flagella.shape[0] == 0 or flagella.shape[1] < 2:
+        return numpy.zeros((flagella.shape[0], 2))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        dS = segmentLengths(flagella)
+        Ct, Cn = GrayHancockCoefficients(dS.sum(axis=1))
+        f = resistiveForces(flagella, Ct, Cn)
+
+        # trapezoidal integration along the flagellum
+        return (dS[..., numpy.newaxis] * (f[:, :-1] + 0.5 * (f[:, 1:] - f[:, :-1]))).sum(axis=1)
+
+
+def batchTorque(flagella, viscosity, velocities=None):
+    """
+        Return a (frames,) array of the torque acting on each of a (frames, points, 2) array of flagella.
+
+        The result matches torque(i, flagella, viscosity) for every frame i. The velocities of the points may be
+        given, see resistiveForces.
+    """
+
+    flagella = numpy.asarray(flagella, dtype=numpy.float64)
+
+    if flagella.shape[0] == 0 or flagella.shape[1] < 2:
+        return numpy.zeros(flagella.shape[0])
+
+    Ct, Cn = GrayHancockCoefficients()
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        dS = segmentLengths(flagella)
+        f = resistiveForces(flagella, Ct, Cn, velocities)
+
+        X = flagella
+        moments = X[..., 0] * f[..., 1] - X[..., 1] * f[..., 0]
+
+        # the same terms as the loop in torque
+        terms = moments[:, :-1] + 0.5 * (moments[:, 1:] - X[:, :-1, 0] * f[:, :-1, 1] - X[:, :-1, 1] * f[:, :-1, 0])
+        torques = (dS * terms).sum(axis=1)
+
+    torques[numpy.isnan(torques)] = 0.0
+
+    return numpy.abs(torques) * viscosity
+
+
+def frameTorques(flagella, viscosity):
+    """
+        Return a (frames, 3) array of the torque of every frame of a (frames, points, 2) array of flagella, with the
+        velocities of its points differenced centrally, forwards and backwards.
+
+        The torque of a frame only depends on its own velocities, so batchTorque of any run of frames i to j is the
+        forward torque of frame i, the backward torque of frame j - 1 and the central torque of the frames between.
+    """
+
+    X = numpy.asarray(flagella, dtype=numpy.float64)
+    central = numpy.zeros_like(X)
+    forward = numpy.zeros_like(X)
+    backward = numpy.zeros_like(X)
+
+    if len(X) > 1:
+        central[1:-1] = (X[2:] - X[:-2]) * 0.5
+        forward[:-1] = X[1:] - X[:-1]
+        backward[1:] = X[1:] - X[:-1]
+
+    return numpy.column_stack([batchTorque(X, viscosity, U) for U in (central, forward, backward)])
+
+
 def signedDistance(p, l1, l2):
     """
         Return the signed distance of a point in relation to a line segment.
@@ -983,6 +1536,8 @@ def printPath(centroids):
 
 
 def graphKinematics(path, avgPath, ints):
+    import pylab
+
     fig = pylab.figure()
     pathX, pathY = convertPathForNumPy(path)
     avgX, avgY = convertPathForNumPy(avgPath)
@@ -1000,6 +1555,8 @@ def graphKinematics(path, avgPath, ints):
 
 
 def testKinematics():     
+    import pylab
+
     path = [QPointF(0, 0), QPointF(2, -4), QPointF(5, -1), QPointF(7, 3), QPointF(7, 6),
             QPointF(6, 8), QPointF(7, 12), QPointF(10, 15), QPointF(13, 14), QPointF(16, 10),
             QPointF(19, 9), QPointF(22, 12), QPointF(22, 15), QPointF(23, 18), QPointF(26, 19),
@@ -1049,8 +1606,179 @@ def testKinematics():
     pylab.show()
 
 
+def testIntersectPoints(root='data', window=150, tolerance=1e-6):
+    """
+        Compare intersectPoints against intersectPointsBruteForce on the centroid paths of the bundled tracks.
+    """
+
+    from trackfile import (readTrackFile, rowsOf, trackFiles)
+
+    failures = 0
+
+    for fileName in trackFiles(root):
+
+        track = readTrackFile(fileName)
+        centroids = track.centroids[rowsOf(track.centroidIDs, track.completeFrameIDs())]
+        totalPath = convertArrayToPath(centroids)
+        N = len(totalPath)
+
+        if N < 3:
+            continue
+
+        avgPath = smooth(totalPath, hanning(min(window, N - 1)))
+
+        fastTime = 0.0
+        slowTime = 0.0
+        crossings = 0
+
+        for start in range(0, N - 1, window):
+
+            path = totalPath[start: start + window]
+            avgP = avgPath[start: start + window]
+
+            t0 = time.time()
+            fast = intersectPoints(path, avgP)
+            t1 = time.time()
+
+            try:
+                slow = intersectPointsBruteForce(path, avgP)
+            except ZeroDivisionError:
+                # collinear segments have no single crossing point, the brute force version divides by zero
+                print('skipped %s frames %d to %d : collinear segments' % (fileName, start, start + len(path)))
+                continue
+
+            t2 = time.time()
+
+            fastTime += t1 - t0
+            slowTime += t2 - t1
+            crossings += len(slow)
+
+            same = len(fast) == len(slow) and \
+                all(abs(p.x() - q.x()) <= tolerance and abs(p.y() - q.y()) <= tolerance for (p, q) in zip(fast, slow))
+
+            if not same:
+                failures += 1
+                print('FAILED %s frames %d to %d : %d intersections, expected %d' %
+                      (fileName, start, start + len(path), len(fast), len(slow)))
+
+        print('%-40s %5d frames %5d intersections  %8.2f ms  (brute force %8.2f ms)' %
+              (fileName, N, crossings, fastTime * 1000.0, slowTime * 1000.0))
+
+    print('intersectPoints : %d failures' % failures)
+
+    return failures == 0
+
+
+def testDegenerateCrossings(N=5000, tolerance=1e-9):
+    """
+        Check crossingSegments on stationary, collinear and parallel segments, where intersectPointsBruteForce
+        divides by zero, and on a stationary track with a single jump, against crossings known in advance.
+    """
+
+    def line(x0, y0, x1, y1, n=N):
+        return numpy.column_stack((numpy.linspace(x0, x1, n), numpy.linspace(y0, y1, n)))
+
+    still = numpy.zeros((N, 2))
+    jump = numpy.zeros((N, 2))
+    jump[N // 2:] = (10.0, 0.0)
+    across = numpy.tile((5.0, -1.0), (N, 1))
+    across[-1] = (5.0, 1.0)
+
+    # name, path, avgPath, the (i, j) segment pairs of the crossings and the crossing points
+    cases = (('stationary', still, still, [], []),
+             ('stationary and moving', still, line(-1.0, -1.0, 1.0, 1.0), [], []),
+             ('collinear', line(0.0, 0.0, 10.0, 0.0), line(0.0, 0.0, 10.0, 0.0), [], []),
+             ('parallel', line(0.0, 0.0, 10.0, 0.0), line(0.0, 1.0, 10.0, 1.0), [], []),
+             ('touching', numpy.array([(0.0, 0.0), (2.0, 2.0)]), numpy.array([(2.0, 2.0), (4.0, 0.0)]),
+              [(0, 0)], [(2.0, 2.0)]),
+             ('zigzag', numpy.array([(0.0, 0.0), (2.0, 2.0), (4.0, 0.0)]), line(0.0, 1.0, 4.0, 1.0, 3),
+              [(0, 0), (1, 1)], [(1.0, 1.0), (3.0, 1.0)]),
+             ('stationary with a jump', jump, across, [(N // 2 - 1, N - 2)], [(5.0, 0.0)]))
+
+    failures = 0
+
+    for (name, path, avgPath, segments, points) in cases:
+
+        i, j, crossings = crossingSegments(path, avgPath)
+        candidates = len(candidateSegmentPairs(path[:-1], path[1:], avgPath[:-1], avgPath[1:])[0])
+
+        same = list(zip(i.tolist(), j.tolist())) == segments and len(crossings) == len(points) and \
+            numpy.allclose(crossings.reshape(-1, 2), numpy.reshape(points, (-1, 2)), rtol=0.0, atol=tolerance)
+
+        # a segment is paired with its few neighbours, never with every degenerate segment
+        if not same or candidates > 4 * len(path):
+            failures += 1
+            print('FAILED %s : %d crossings, expected %d, %d candidate pairs' %
+                  (name, len(crossings), len(points), candidates))
+
+    print('degenerate crossings : %d failures' % failures)
+
+    return failures == 0
+
+
+def testTorque(root='data', window=50, tolerance=1e-5):
+    """
+        Compare batchTorque and batchViscousDrag against torque and viscousDrag on the flagella of the bundled tracks.
+
+        torque and viscousDrag work with QVector2D, which holds single precision values in Qt 4, so they are compared
+        to a relative tolerance near single precision. Their sums round to the largest value of the window, so a
+        value that nearly cancels out is compared to that tolerance of the largest value instead.
+    """
+
+    from trackfile import (readTrackFile, trackFiles)
+    from spermtrack import buildSpermTrack
+
+    def close(values, expected, equalNaN=False):
+        finite = numpy.abs(expected[numpy.isfinite(expected)])
+        scale = finite.max() if len(finite) else 0.0
+        return numpy.allclose(values, expected, rtol=tolerance, atol=tolerance * scale, equal_nan=equalNaN)
+
+    failures = 0
+
+    for fileName in trackFiles(root):
+
+        track = buildSpermTrack(readTrackFile(fileName))
+        N = len(track)
+
+        fastTime = 0.0
+        slowTime = 0.0
+
+        for start in range(0, N - 1, window):
+
+            stacked = stackFlagella(track.flagella(start, min(start + window, N)))
+
+            if stacked is None:
+                print('skipped %s frames %d to %d : flagella missing' % (fileName, start, start + window))
+                continue
+
+            flagella = [convertArrayToPath(f) for f in stacked]
+
+            t0 = time.time()
+            torques = batchTorque(stacked, 1.0)
+            drags = batchViscousDrag(stacked)
+            t1 = time.time()
+            slowTorques = numpy.array([torque(i, flagella, 1.0) for i in range(len(flagella))])
+            slowDrags = numpy.array([(d.x(), d.y()) for d in [viscousDrag(i, flagella) for i in range(len(flagella))]])
+            t2 = time.time()
+
+            fastTime += t1 - t0
+            slowTime += t2 - t1
+
+            if not (close(torques, slowTorques) and close(drags, slowDrags, True)):
+                failures += 1
+                print('FAILED %s frames %d to %d' % (fileName, start, start + len(flagella)))
+
+        print('%-40s %5d frames  %8.2f ms  (brute force %8.2f ms)' %
+              (fileName, N, fastTime * 1000.0, slowTime * 1000.0))
+
+    print('torque : %d failures' % failures)
+
+    return failures == 0
+
+
 def testMechanics():
-    
+    import pylab
+
     flagellum = [QPointF(0.0, 5.0), QPointF(0.5, 4.8),  QPointF(1.0, 4.6),  QPointF(1.5, 4.2),
                  QPointF(2.0, 4.1), QPointF(2.5, 4.3), QPointF(3.0, 5.0),  QPointF(3.5, 5.6),
                  QPointF(4.0, 6.0), QPointF(4.5, 6.1), QPointF(5.0, 6.25), QPointF(5.5, 6.2),
@@ -1111,4 +1839,7 @@ def testCatMullRom():
 
 if __name__ == "__main__":
 
+    testIntersectPoints()
+    testDegenerateCrossings()
+    testTorque()
     testCatMullRom()
\ No newline at end of file
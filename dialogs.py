@@ -7,6 +7,8 @@ from PyQt4.QtGui  import ( QDialog, QLabel, QSpinBox, QDoubleSpinBox, QLayout, Q
 
 from PyQt4.QtCore import ( SIGNAL, SLOT )
 
+from math import ceil
+
 import glyphdesigns as designs
 
 def VGroupBox(label='group label', items = None, flat = False):
@@ -108,7 +110,7 @@ class GlyphControlDialog(QDialog):
     def __init__(self, CBase, CScale, HScale, TScale, thickness=2,
                  design   = designs.CHEN_ALT_DESIGN,
                  strategy = designs.MIDDLE_POSITION,
-                 parent=None):
+                 parent=None, timeStep=1.0, smoothingWindow=500):
         super(GlyphControlDialog,self).__init__(parent)
 
         self.setWindowTitle("Glyph Controls")
@@ -191,9 +193,40 @@ class GlyphControlDialog(QDialog):
 
         positionGroup.setLayout(positionLayout)
 
+        windowGroup  = QGroupBox('Glyph Windows', self)
+        windowLayout = QGridLayout()
+
+        self.__timeStepSpinBox  = QDoubleSpinBox()
+        self.__smoothingSpinBox = QSpinBox()
+
+        # the minimum is set from the frame rate of each data set, see setMinimumTimeStep
+        self.__timeStepSpinBox.setDecimals(3)
+        self.__timeStepSpinBox.setMinimum(0.1); self.__timeStepSpinBox.setMaximum(60.0)
+        self.__timeStepSpinBox.setSingleStep(0.1)
+        self.__smoothingSpinBox.setMinimum(3); self.__smoothingSpinBox.setMaximum(10000)
+        self.__smoothingSpinBox.setSingleStep(10)
+
+        self.__timeStepSpinBox.setValue(timeStep)
+        self.__smoothingSpinBox.setValue(smoothingWindow)
+
+        # re-windowing is done from the per frame series, only recompute when the user has finished typing
+        self.__timeStepSpinBox.setKeyboardTracking(False)
+        self.__smoothingSpinBox.setKeyboardTracking(False)
+
+        windowLayout.addWidget( QLabel('Time Step'), 0, 0 )
+        windowLayout.addWidget( self.__timeStepSpinBox, 0, 1 )
+        windowLayout.addWidget( QLabel('secs'), 0, 2 )
+
+        windowLayout.addWidget( QLabel('Smoothing Window'), 1, 0 )
+        windowLayout.addWidget( self.__smoothingSpinBox, 1, 1 )
+        windowLayout.addWidget( QLabel('frames'), 1, 2 )
+
+        windowGroup.setLayout(windowLayout)
+
         groupsLayout.addWidget( scalingGroup )
         groupsLayout.addWidget( designGroup  )
         groupsLayout.addWidget( positionGroup )
+        groupsLayout.addWidget( windowGroup )
 
         self.setLayout(groupsLayout)
 
@@ -243,6 +276,32 @@ class GlyphControlDialog(QDialog):
         return self.__thicknessSpinBox.value()
     # end def
 
+    def getCurrentTimeStep(self):
+        return self.__timeStepSpinBox.value()
+    # end def
+
+    def setCurrentTimeStep(self, timeStep):
+        """
+            Show a time step without signalling the change, e.g. to restore one that could not be used.
+        """
+        self.__timeStepSpinBox.blockSignals(True)
+        self.__timeStepSpinBox.setValue(timeStep)
+        self.__timeStepSpinBox.blockSignals(False)
+    # end def
+
+    def setMinimumTimeStep(self, timeStep):
+        """
+            Set the shortest time step a data set allows, rounded up to the decimals shown. A current time step
+            below it is raised to it, which is signalled as any other change.
+        """
+        scale = 10.0 ** self.__timeStepSpinBox.decimals()
+        self.__timeStepSpinBox.setMinimum(ceil(timeStep * scale) / scale)
+    # end def
+
+    def getCurrentSmoothingWindow(self):
+        return self.__smoothingSpinBox.value()
+    # end def
+
     def areSegmentsOn(self):
         return self.__segmentsCheckBox.isChecked()
     # end def
@@ -283,4 +342,12 @@ class GlyphControlDialog(QDialog):
         self.connect( self.__thicknessSpinBox, SIGNAL("valueChanged(int)"), widget, SLOT(slot) )
     # end def
 
+    def connectToTimeStepSpinBox(self, widget, slot):
+        self.connect( self.__timeStepSpinBox, SIGNAL("valueChanged(double)"), widget, SLOT(slot) )
+    # end def
+
+    def connectToSmoothingSpinBox(self, widget, slot):
+        self.connect( self.__smoothingSpinBox, SIGNAL("valueChanged(int)"), widget, SLOT(slot) )
+    # end def
+
 # end class
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+    This module computes the shape measures of the flagellum for every frame of a track at once.
+
+    arcLength, changeInAngle and asymmetry in computation.py walk the points of one flagellum at a time as
+    QPointF objects. The fitted flagella all have the same number of points so here they are stacked into one
+    (frames, points, 2) array and the arc length, the change in angle between the base and the tip and the signed
+    asymmetry about the medial axis are computed for every frame in a few array operations. The per frame values
+    are kept as prefix sums so the average over any window of frames costs O(1), see windowShapes.
+"""
+
+import sys
+
+import numpy
+
+from computation import (segmentLengths)
+from kinematics import (prefixSums, windowBounds)
+
+# the per frame shape measures, in the order of the columns of shapeSums, in pixels and radians
+SHAPE_MEASURES = ('arcLength', 'changeInAngle', 'asymmetry')
+
+# the window averages of the shape measures, in pixels and degrees
+SHAPE_DTYPE = numpy.dtype([(name, numpy.float64) for name in SHAPE_MEASURES])
+
+
+def slopeAngles(u, v):
+    """
+        Return the angles between the slopes of the (M, 2) arrays of vectors u and v, as computation.signedAngle.
+    """
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        m1 = numpy.where(u[:, 0] == 0.0, u[:, 1], u[:, 1] / u[:, 0])
+        m2 = numpy.where(v[:, 0] == 0.0, v[:, 1], v[:, 1] / v[:, 0])
+        return numpy.arctan(numpy.abs(m2 - m1) / (1.0 + m1 * m2))
+
+
+def denseShapes(centroids, flagella):
+    """
+        Return an (F, 3) array of the arc length, change in angle and asymmetry of F flagella that all have the same
+        number of points, centroids is the (F, 2) array of the head centroids of the frames.
+    """
+
+    F, P = flagella.shape[:2]
+    shapes = numpy.zeros((F, 3))
+
+    if F == 0 or P == 0:
+        return shapes
+
+    shapes[:, 0] = segmentLengths(flagella).sum(axis=1) if P > 1 else 0.0
+
+    # the medial axis runs from the centroid to the base of the flagellum
+    base = flagella[:, 0]
+    axis = base - centroids
+
+    if P > 1:
+        baseAngles = numpy.abs(slopeAngles(axis, flagella[:, 1] - base))
+        tipAngles = numpy.abs(slopeAngles(axis, flagella[:, -1] - flagella[:, -2]))
+        shapes[:, 1] = tipAngles - baseAngles
+
+    # the signed distance of every point from the medial axis, as computation.signedDistance
+    c = centroids[:, numpy.newaxis]
+    b = base[:, numpy.newaxis]
+    distances = (c[..., 0] - flagella[..., 0]) * (b[..., 1] - flagella[..., 1]) - \
+                (b[..., 0] - flagella[..., 0]) * (c[..., 1] - flagella[..., 1])
+    shapes[:, 2] = distances.sum(axis=1)
+
+    return shapes
+
+
+def frameShapes(centroids, flagella):
+    """
+        Return an (F, 3) array of the arc length, change in angle and asymmetry of every frame, in the order of
+        SHAPE_MEASURES.
+
+        centroids : (F, 2) array of the head centroids
+        flagella  : (F, P, 2) array of the fitted flagella or a list of (P_i, 2) arrays, see Sperm.getDenseFlagella.
+                    A frame without a flagellum has zero for every measure, as in computation.py.
+    """
+
+    centroids = numpy.asarray(centroids, dtype=numpy.float64).reshape(-1, 2)
+
+    if isinstance(flagella, numpy.ndarray) and flagella.ndim == 3:
+        return denseShapes(centroids, numpy.asarray(flagella, dtype=numpy.float64))
+
+    # the frames with the same number of points are stacked together
+    flagella = [numpy.asarray(f, dtype=numpy.float64).reshape(-1, 2) for f in flagella]
+    counts = numpy.array([len(f) for f in flagella])
+    shapes = numpy.zeros((len(flagella), 3))
+
+    for count in numpy.unique(counts[counts > 0]):
+        frames = numpy.flatnonzero(counts == count)
+        shapes[frames] = denseShapes(centroids[frames], numpy.array([flagella[i] for i in frames]))
+
+    return shapes
+
+
+def shapeSums(centroids, flagella):
+    """
+        Return the (F + 1, 3) prefix sums of frameShapes, the sums over the frames i to j are sums[j] - sums[i].
+    """
+    return prefixSums(frameShapes(centroids, flagella))
+
+
+def windowShapes(sums, ranges):
+    """
+        Return a SHAPE_DTYPE record of the average shape measures of each of the (start, end) frame ranges.
+    """
+
+    starts, ends = windowBounds(ranges)
+    windows = numpy.zeros(len(starts), dtype=SHAPE_DTYPE)
+
+    if not len(starts):
+        return windows
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        averages = (sums[ends] - sums[starts]) / (ends - starts)[:, numpy.newaxis]
+
+    windows['arcLength'] = averages[:, 0]
+    windows['changeInAngle'] = numpy.degrees(averages[:, 1])
+    windows['asymmetry'] = averages[:, 2]
+
+    return windows
+
+
+def testFlagellumShapes(root='data', timeStep=1.0, fps=50.0, tolerance=1e-6):
+    """
+        Compare windowShapes with averageArcLength, averageChangeInAngle and averageAsymmetry on every glyph window
+        of every track file, to a relative tolerance near single precision as the references use QVector2D, which
+        holds floats in Qt 4.
+    """
+
+    from computation import (averageArcLength, averageChangeInAngle, averageAsymmetry, convertArrayToPath)
+    from pycasadata import (AcquisitionContext, glyphFrameRanges)
+    from spermtrack import (buildSpermTrack)
+    from trackfile import (readTrackFile, trackFiles)
+
+    print('testing windowShapes against computation.py on : %s' % root)
+
+    context = AcquisitionContext(fps)
+    failures = 0
+
+    for fileName in trackFiles(root):
+
+        track = buildSpermTrack(readTrackFile(fileName))
+        ranges = [(s, e) for (s, e) in glyphFrameRanges(len(track), context, timeStep) if e > s]
+
+        dense = track.denseFlagella(0, len(track))
+        flagella = dense if dense is not None else track.flagella(0, len(track))
+        windows = windowShapes(shapeSums(track.centroids, flagella), ranges)
+        errors = []
+
+        for (index, (start, end)) in enumerate(ranges):
+
+            path = convertArrayToPath(track.centroids[start:end])
+            paths = [convertArrayToPath(f) for f in track.flagella(start, end)]
+
+            expected = {'arcLength': averageArcLength(paths),
+                        'changeInAngle': averageChangeInAngle(path, paths),
+                        'asymmetry': averageAsymmetry(path, paths)}
+
+            for (name, value) in expected.items():
+                if abs(windows[name][index] - value) > tolerance * max(1.0, abs(value)):
+                    errors.append('%s %d : %r != %r' % (name, index, windows[name][index], value))
+
+        failures += len(errors)
+        print('%-50s %4d windows %s' % (fileName, len(ranges), 'ok' if not errors else ', '.join(errors[:3])))
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testFlagellumShapes(sys.argv[1])
+    else:
+        testFlagellumShapes()
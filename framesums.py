@@ -0,0 +1,170 @@
+"""
+    This module aggregates the per frame series of a sperm track over windows of frames in constant time.
+
+    A FrameSums object keeps the prefix sums of named per frame series, e.g. the head lengths, the certainties, the
+    flagellum shapes or the torques, so the sum or the average of a series over any window of frames is the
+    difference of two rows whatever the length of the window. The glyph windows of any time step, not only the
+    default one second, are then answered without going back to the frames, see Sperm.setTimeStep.
+"""
+
+import sys
+
+import numpy
+
+from kinematics import (prefixSums, windowBounds)
+
+
+class FrameSums:
+    """
+        FrameSums holds the prefix sums of named per frame series, a series has one value or one row per frame.
+    """
+
+    def __init__(self):
+        self.__sums = {}
+
+    def __contains__(self, name):
+        return name in self.__sums
+
+    def __repr__(self):
+        return 'FrameSums( %s )' % ', '.join(sorted(self.__sums))
+
+    def names(self):
+        return sorted(self.__sums)
+
+    def add(self, name, values):
+        """
+            Add, or replace, the series name from its per frame values.
+        """
+        self.__sums[name] = prefixSums(values)
+
+    def remove(self, name):
+        self.__sums.pop(name, None)
+
+    def clear(self):
+        self.__sums = {}
+
+    def prefix(self, name):
+        """
+            Return the prefix sums of the series name, the sum over the frames i to j is prefix[j] - prefix[i].
+        """
+        return self.__sums[name]
+
+    def frames(self, name):
+        return len(self.__sums[name]) - 1
+
+    def sum(self, name, start, end):
+        prefix = self.__sums[name]
+        return prefix[end] - prefix[start]
+
+    def average(self, name, start, end):
+        """
+            Return the average of the series name over the frames start to end, as computation.average.
+        """
+        if not end > start:
+            raise ZeroDivisionError('ZeroDivisionError averaging an empty window')
+
+        return self.sum(name, start, end) / float(end - start)
+
+    def sums(self, name, ranges):
+        """
+            Return the sums of the series name over every (start, end) frame range, one row per range.
+        """
+        starts, ends = windowBounds(ranges)
+        prefix = self.__sums[name]
+        return prefix[ends] - prefix[starts]
+
+    def averages(self, name, ranges):
+        """
+            Return the averages of the series name over every (start, end) frame range, NaN for an empty range.
+        """
+        starts, ends = windowBounds(ranges)
+        totals = self.sums(name, ranges)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return totals / (ends - starts).reshape((-1,) + (1,) * (totals.ndim - 1))
+
+
+def windowTorque(sums, start, end):
+    """
+        Return the average torque of the frames start to end, as averageTorque, from a FrameSums holding the
+        computation.frameTorques of the track as the series 'torques'.
+    """
+
+    n = end - start
+
+    if n < 2:
+        return 0.0
+
+    prefix = sums.prefix('torques')
+    forward = prefix[start + 1, 1] - prefix[start, 1]
+    backward = prefix[end, 2] - prefix[end - 1, 2]
+    central = prefix[end - 1, 0] - prefix[start + 1, 0]
+
+    return float((forward + backward + central) / n)
+
+
+def testFrameSums(root='data', timeSteps=(1.0, 0.5, 0.1), fps=50.0, tolerance=1e-9):
+    """
+        Compare the window averages of a FrameSums with average and averageTorque on the glyph windows of every
+        track file for several time steps.
+    """
+
+    from computation import (average, averageTorque, frameTorques)
+    from pycasadata import (AcquisitionContext, glyphFrameRanges)
+    from spermtrack import (buildSpermTrack)
+    from trackfile import (readTrackFile, trackFiles)
+
+    print('testing FrameSums against average and averageTorque on : %s' % root)
+
+    context = AcquisitionContext(fps)
+    failures = 0
+
+    for fileName in trackFiles(root):
+
+        track = buildSpermTrack(readTrackFile(fileName))
+        dense = track.denseFlagella(0, len(track))
+
+        sums = FrameSums()
+
+        for name in ('lengths', 'widths', 'hCerts', 'fCerts'):
+            sums.add(name, getattr(track, name))
+
+        if dense is not None:
+            sums.add('torques', frameTorques(dense, 1.0))
+
+        errors = []
+        nWindows = 0
+
+        for timeStep in timeSteps:
+
+            ranges = glyphFrameRanges(len(track), context, timeStep)
+            nWindows += len(ranges)
+
+            for (start, end) in ranges:
+
+                expected = [(name, sums.average(name, start, end), average(getattr(track, name)[start:end]))
+                            for name in ('lengths', 'widths', 'hCerts', 'fCerts')]
+
+                if dense is not None:
+                    expected.append(('torque', windowTorque(sums, start, end),
+                                     averageTorque(dense[start:end], 1.0)))
+
+                for (name, value, reference) in expected:
+                    if abs(value - reference) > tolerance * max(1.0, abs(reference)):
+                        errors.append('%s %d:%d' % (name, start, end))
+
+        failures += len(errors)
+        print('%-50s %4d windows %s' % (fileName, nWindows, 'ok' if not errors else ', '.join(errors[:5])))
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testFrameSums(sys.argv[1])
+    else:
+        testFrameSums()
@@ -6,8 +6,6 @@ from numpy import (dot, concatenate, repeat, argmax, argmin, take, random, array
 from PyQt4.QtGui import (QPolygonF, QVector2D)
 from PyQt4.QtCore import (QPointF, QRectF, Qt)
 
-import pylab
-
 
 def toVector(p):
     """
@@ -314,6 +312,8 @@ def QtHull(points):
 
 
 if __name__ == "__main__":
+    import pylab
+
     #sample = 10*array([(x,y) for x in arange(10) for y in arange(10)])
     sample = 100 * random.random((32, 2))
     hull = qHull(sample)
@@ -3,37 +3,14 @@
     in designs_backup.txt as they aren't really needed anymore
 """
 
+import math
+
 import geometry
 from PyQt4.QtGui  import ( QColor, QPolygonF, QPen )
 from PyQt4.QtCore import ( QPointF, Qt )
-from pylab import *
-
-### SciPy colour look-up tables ###
-
-VSLColourDict = { 'red'  : ((0.00,0.0,0.0), (0.0035,1.0,1.0), (0.083,1.0,1.0), (0.16,1.0,1.0),
-                            (0.33,0.5,0.5), (0.6600,0.0,0.0), (1.000,0.0,0.0)),
-                  'green': ((0.0,0.0,0.0), (0.0035,1.0,1.0), (0.083,0.75,0.75), (0.16,0.0,0.0),
-                            (0.33,1.0,1.0), (0.66,1.0,1.0), (1.0,0.0,0.0)),
-                  'blue' : ((0.0,0.0,0.0), (0.0035,0.0,0.0), (0.083,0.5,0.5),   (0.16,1.0,1.0),
-                            (0.33,0.5,0.5), (0.66,1.0,1.0), (1.0,1.0,1.0))   }
-
-UncertaintyColourDict = { 'red'  : ((0.0,0.0,0.0), (0.5,1.0,1.0), (1.0,1.0,1.0)),
-                          'green': ((0.0,1.0,1.0), (0.5,1.0,1.0), (1.0,0.0,0.0)),
-                          'blue' : ((0.0,0.0,0.0), (0.5,0.0,0.0), (1.0,0.0,0.0))   }
-
-timeColourDict = { 'red':   ( (0.0, 0.894117647, 0.894117647), (0.2, 0.556862745, 0.556862745),
-                              (0.4, 0.529411765, 0.529411765), (0.6, 0.890196078, 0.890196078),
-                              (0.8, 0.084507042, 0.084507042), (1.0, 0.239215686, 0.23921568 ) ),
-                   'green': ( (0.0, 0.674509804, 0.674509804), (0.2, 0.854901961, 0.854901961),
-                              (0.4, 0.439215686, 0.439215686), (0.6, 0.207843137, 0.207843137),
-                              (0.8, 0.823529412, 0.823529412), (1.0, 0.098039216, 0.098039216) ),
-                   'blue':  ( (0.0, 0.674509804, 0.674509804), (0.2, 0.592156863, 0.592156863),
-                              (0.4, 0.815686275, 0.815686275), (0.6, 0.207843137, 0.207843137),
-                              (0.8, 0.2,         0.2        ), (1.0, 0.68627451,  0.68627451 ) ) }
-
-VSLColourMap         = matplotlib.colors.LinearSegmentedColormap('VSLColormap',VSLColourDict,256)
-UncertaintyColourMap = matplotlib.colors.LinearSegmentedColormap('UncertaintyColormap',UncertaintyColourDict,256)
-timeColourMap        = matplotlib.colors.LinearSegmentedColormap('TimeColormap',timeColourDict,256)
+
+# the colour maps are baked into lookup tables, see colourmaps.py
+from colourmaps import ( VSLColourMap, UncertaintyColourMap, timeColourMap )
 
 GLYPH_DESIGN = 0; BIRMINGHAM_DESIGN = 1; CHEN_DESIGN = 2; CHEN_ALT_DESIGN = 3
 
@@ -74,10 +51,8 @@ def drawGlyphDesign( painter, CBase, CScale, HScale, FScale,
     painter.drawEllipse( geometry.square( Rvap ) ) # draw VAP
 
     painter.setPen( QColor.fromRgbF( 0.5, 0.5, 0.5 )  )
-    red   = VSLColourMap(vsl/300.0)[0]
-    green = VSLColourMap(vsl/300.0)[1]
-    blue  = VSLColourMap(vsl/300.0)[2]
-    painter.setBrush( QColor.fromRgbF( red, green, blue )  )
+    vslColour = VSLColourMap.qColor(vsl/300.0)
+    painter.setBrush( vslColour  )
     painter.drawEllipse( geometry.square( Rvsl ) ) # draw VSL
 
     painter.setPen( Qt.NoPen )
@@ -132,10 +107,8 @@ def drawGlyphDesign( painter, CBase, CScale, HScale, FScale,
     # Draw the head with the uncertainty mapping
     painter.rotate(headAngle)
     painter.setPen( Qt.black )
-    red   = UncertaintyColourMap(headUncertainty)[0]
-    green = UncertaintyColourMap(headUncertainty)[1]
-    blue  = UncertaintyColourMap(headUncertainty)[2]
-    painter.setBrush( QColor.fromRgbF( red, green, blue )  )
+    headColour = UncertaintyColourMap.qColor(headUncertainty)
+    painter.setBrush( headColour  )
     painter.drawEllipse( geometry.rectangle( (width*HScale)/CScale, (length*HScale)/CScale ) )
 # end def
 
@@ -175,10 +148,8 @@ def drawBirminghamDesign( painter, CBase, CScale, HScale, FScale,
     painter.drawEllipse( geometry.square( Rvap ) ) # draw VAP
 
     painter.setPen( QColor.fromRgbF( 0.5, 0.5, 0.5 )  )
-    red   = VSLColourMap(vsl/300.0)[0]
-    green = VSLColourMap(vsl/300.0)[1]
-    blue  = VSLColourMap(vsl/300.0)[2]
-    painter.setBrush( QColor.fromRgbF( red, green, blue )  )
+    vslColour = VSLColourMap.qColor(vsl/300.0)
+    painter.setBrush( vslColour  )
     painter.drawEllipse( geometry.square( Rvsl ) ) # draw VSL
 
     painter.setPen( Qt.NoPen )
@@ -218,9 +189,7 @@ def drawBirminghamDesign( painter, CBase, CScale, HScale, FScale,
     painter.drawLine( QPointF(-r,0.0), QPointF(r,0.0) )
     painter.drawLine( QPointF(0.0,0.0), QPointF(0.0,r + (arcLength * FScale) / CScale )  )
 
-    flagellumColour = QColor.fromRgbF( UncertaintyColourMap(flagellumUncertainty)[0],
-                                       UncertaintyColourMap(flagellumUncertainty)[1],
-                                       UncertaintyColourMap(flagellumUncertainty)[2] )
+    flagellumColour = UncertaintyColourMap.qColor(flagellumUncertainty)
     painter.setPen( QPen( flagellumColour, 3.0 ) )
     painter.translate(0.0, r)
     painter.drawLine( QPointF(0.0,0.0), QPointF(0.0,(arcLength * FScale) / CScale )  )
@@ -244,9 +213,7 @@ def drawBirminghamDesign( painter, CBase, CScale, HScale, FScale,
     painter.rotate(headAngle)
     painter.setPen( Qt.black )
 
-    headColour = QColor.fromRgbF( UncertaintyColourMap(headUncertainty)[0],
-                                  UncertaintyColourMap(headUncertainty)[1],
-                                  UncertaintyColourMap(headUncertainty)[2] )
+    headColour = UncertaintyColourMap.qColor(headUncertainty)
 
     painter.setBrush( headColour  )
     painter.drawEllipse( geometry.rectangle( (width*HScale)/CScale, (length*HScale)/CScale ) )
@@ -315,11 +282,9 @@ def drawChenDesign( painter, CBase, CScale, HScale, FScale,
     painter.setPen( QPen(Qt.black, lineWidth) )
     painter.drawArc(geometry.square(Rvap), startAngle, toAngle) # draw VAP
 
-    red   = VSLColourMap(vsl/300.0)[0]
-    green = VSLColourMap(vsl/300.0)[1]
-    blue  = VSLColourMap(vsl/300.0)[2]
+    vslColour = VSLColourMap.qColor(vsl/300.0)
     painter.setPen( Qt.NoPen )
-    painter.setBrush( QColor.fromRgbF( red, green, blue )  )
+    painter.setBrush( vslColour  )
     painter.drawPie(geometry.square(Rvsl), startAngle, toAngle) # draw VSL
 
     painter.setPen( QPen(QColor.fromRgbF( 0.5, 0.5, 0.5 ), lineWidth) )
@@ -366,9 +331,7 @@ def drawChenDesign( painter, CBase, CScale, HScale, FScale,
     painter.drawLine( QPointF(-r,0.0), QPointF(r,0.0) )
     painter.drawLine( QPointF(0.0,0.0), QPointF(0.0, r + (arcLength * FScale) / CScale )  )
 
-    flagellumColour = QColor.fromRgbF( UncertaintyColourMap(flagellumUncertainty)[0],
-                                       UncertaintyColourMap(flagellumUncertainty)[1],
-                                       UncertaintyColourMap(flagellumUncertainty)[2] )
+    flagellumColour = UncertaintyColourMap.qColor(flagellumUncertainty)
 
     painter.setPen( QPen( flagellumColour, lineWidth * 3.0  ) )
     painter.save()    # push matrix
@@ -405,9 +368,7 @@ def drawChenDesign( painter, CBase, CScale, HScale, FScale,
     painter.rotate(headAngle)
     painter.setPen( QPen(Qt.black, lineWidth) )
 
-    headColour = QColor.fromRgbF( UncertaintyColourMap(headUncertainty)[0],
-                                  UncertaintyColourMap(headUncertainty)[1],
-                                  UncertaintyColourMap(headUncertainty)[2] )
+    headColour = UncertaintyColourMap.qColor(headUncertainty)
 
     painter.setBrush( headColour  )
     painter.drawEllipse( geometry.rectangle( (width*HScale)/CScale, (length*HScale)/CScale ) )
@@ -475,11 +436,9 @@ def drawChenAltDesign( painter, CBase, CScale, HScale, FScale,
     painter.setPen( Qt.black )
     painter.drawArc(geometry.square(Rvap), startAngle, toAngle) # draw VAP
 
-    red   = VSLColourMap(vsl/300.0)[0]
-    green = VSLColourMap(vsl/300.0)[1]
-    blue  = VSLColourMap(vsl/300.0)[2]
+    vslColour = VSLColourMap.qColor(vsl/300.0)
     painter.setPen( Qt.NoPen )
-    painter.setBrush( QColor.fromRgbF( red, green, blue )  )
+    painter.setBrush( vslColour  )
     painter.drawPie(geometry.square(Rvsl), startAngle, toAngle) # draw VSL
 
     painter.setPen( QColor.fromRgbF( 0.5, 0.5, 0.5 )  )
@@ -530,9 +489,7 @@ def drawChenAltDesign( painter, CBase, CScale, HScale, FScale,
     dk = ( 50.0 * FScale ) / CScale
     guideLength = k * dk
 
-    flagellumColour = QColor.fromRgbF( UncertaintyColourMap(flagellumUncertainty)[0],
-                                       UncertaintyColourMap(flagellumUncertainty)[1],
-                                       UncertaintyColourMap(flagellumUncertainty)[2] )
+    flagellumColour = UncertaintyColourMap.qColor(flagellumUncertainty)
 
     painter.save()    # push matrix
     painter.translate(0.0, r)
@@ -572,9 +529,7 @@ def drawChenAltDesign( painter, CBase, CScale, HScale, FScale,
     painter.rotate(headAngle)
     painter.setPen( Qt.black )
 
-    headColour = QColor.fromRgbF( UncertaintyColourMap(headUncertainty)[0],
-                                  UncertaintyColourMap(headUncertainty)[1],
-                                  UncertaintyColourMap(headUncertainty)[2] )
+    headColour = UncertaintyColourMap.qColor(headUncertainty)
 
     painter.setBrush( headColour  )
     painter.drawEllipse( geometry.rectangle( (width*HScale)/CScale, (length*HScale)/CScale ) )
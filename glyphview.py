@@ -1,25 +1,33 @@
-from PyQt4.QtGui import (QVector2D, QPainter, QGraphicsItem, QGraphicsScene, QGraphicsView,
-                         QPen, QBrush, QColor, QPolygonF, QGraphicsLineItem, QGraphicsRectItem,
-                         QGraphicsPolygonItem, QGraphicsEllipseItem, QGraphicsSimpleTextItem, QFont)
+from PyQt4.QtGui import (QVector2D, QPainter, QPicture, QPainterPath, QGraphicsItem, QGraphicsScene, QGraphicsView,
+                         QPen, QBrush, QColor, QPolygonF, QGraphicsLineItem, QGraphicsRectItem, QImage,
+                         QGraphicsPolygonItem, QGraphicsEllipseItem, QGraphicsSimpleTextItem, QFont, QFontMetricsF)
 
 from PyQt4.QtCore import (Qt, QPoint, QPointF, QLineF, QRectF, qWarning, pyqtSlot)
 
-from glyphdesigns import (timeColourMap)
+from colourmaps import (timeColourMap)
 
-from math import (degrees, atan2)
-from computation import (polarAngle)
+from math import (degrees, atan2, log, ceil)
+from collections import OrderedDict
+
+import numpy
+from computation import (polarAngle, convertArrayToPath)
 from geometry import (QtHull, square)
 
 from mygraphicsitems import (PolyLine)
 
 import glyphdesigns as designs
 
-from pycasadata import(START_POSITION, END_POSITION)
+from pycasadata import(START_POSITION, END_POSITION, MIN_GLYPH_FRAMES)
 
 
 #noinspection PyOldStyleClasses
 class GlyphItem(QGraphicsItem):
 
+    # the drawings of the glyphs recorded as QPictures, keyed by the design, the scales and the parameters, the least
+    # recently painted one is dropped when the cache is full
+    PICTURE_CACHE_SIZE = 4096
+    __pictures = OrderedDict()
+
     def __init__(self, CBase, CScale, HScale, TScale,
                  position, parameters, drawFunc, thickness, summary, parent=None):
 
@@ -36,6 +44,8 @@ class GlyphItem(QGraphicsItem):
         self.__TScale = TScale
         self.__summary = summary
 
+        self.__parameters = tuple(parameters) if parameters is not None else None
+
         if parameters is not None:
             self.__headUncertainty = parameters[0]
             self.__flagellumUncertainty = parameters[1]
@@ -59,6 +69,39 @@ class GlyphItem(QGraphicsItem):
         return square(self.__size)
 
     def paint(self, painter, option, widget=None):
+        """
+            Replay the recorded drawing of the glyph, the design is only drawn again when a glyph with new
+            parameters or new settings is painted for the first time.
+        """
+
+        key = (self.__drawFunc, self.__CBase, self.__CScale, self.__HScale, self.__TScale,
+               self.__myThickness, self.__summary, self.__parameters)
+
+        picture = GlyphItem.__pictures.pop(key, None)
+
+        if picture is None:
+
+            picture = QPicture()
+            recorder = QPainter(picture)
+            self.__draw(recorder)
+            recorder.end()
+
+            if len(GlyphItem.__pictures) >= self.PICTURE_CACHE_SIZE:
+                GlyphItem.__pictures.popitem(last=False)
+
+        # the painted picture moves to the most recent end of the cache
+        GlyphItem.__pictures[key] = picture
+
+        painter.drawPicture(0, 0, picture)
+
+    @staticmethod
+    def clearPictures():
+        """
+            Drop the recorded drawings of every glyph, e.g. when the glyph settings have changed.
+        """
+        GlyphItem.__pictures.clear()
+
+    def __draw(self, painter):
 
         self.__drawFunc(painter, self.__CBase, self.__CScale, self.__HScale, self.__TScale,
                         self.__headUncertainty, self.__flagellumUncertainty,
@@ -69,6 +112,25 @@ class GlyphItem(QGraphicsItem):
 
     def setDrawFunction(self, function):
         self.__drawFunc = function
+        self.update()
+
+    def setScales(self, CBase, CScale, HScale, TScale):
+        """
+            Change the scales of the glyph in place, its bounding rectangle follows the base and glyph scales.
+        """
+        self.prepareGeometryChange()
+
+        self.__CBase = CBase
+        self.__CScale = CScale
+        self.__HScale = HScale
+        self.__TScale = TScale
+
+        self.__size = ((self.__CBase + self.__vcl) / self.__CScale) * 1.2
+        self.update()
+
+    def setThickness(self, thickness):
+        self.__myThickness = thickness
+        self.update()
 
     def setPosition(self, position):
         if isinstance(position, QPointF):
@@ -90,6 +152,127 @@ class GlyphItem(QGraphicsItem):
             raise ValueError
 
 
+#noinspection PyOldStyleClasses
+class TrackItem(QGraphicsItem):
+    """
+        TrackItem draws the whole centroid path of a sperm, coloured by time or in a single colour.
+
+        The consecutive steps of the path with the same colour are joined into one QPainterPath, so a track costs
+        one draw call per colour of the time colour map whatever its number of frames. When the view is zoomed
+        out the path is decimated so that its vertices stay about a pixel apart, and the runs of the path outside
+        the exposed rectangle are skipped.
+    """
+
+    PEN_WIDTH = 2.0
+    PATH_COLOUR = QColor(0, 206, 209)
+
+    # the smallest distance in pixels between the vertices of a decimated path
+    MIN_VERTEX_SPACING = 1.0
+
+    def __init__(self, points, nFrames, colourPath=True, parent=None):
+
+        super(TrackItem, self).__init__(parent)
+
+        # the exposed rectangle is needed to skip the runs that are not repainted
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+        self.__myPoints = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        self.__myNFrames = max(nFrames, 1)
+        self.__myColourPath = bool(colourPath)
+
+        # the runs of the path for each decimation stride, as (pen, path, bounds) tuples
+        self.__myRuns = {}
+
+        steps = numpy.diff(self.__myPoints, axis=0)
+        self.__myStep = float(numpy.hypot(steps[:, 0], steps[:, 1]).mean()) if len(steps) else 0.0
+
+        self.__myBounds = QRectF()
+
+        if len(self.__myPoints):
+            (left, top), (right, bottom) = self.__myPoints.min(axis=0), self.__myPoints.max(axis=0)
+            w = self.PEN_WIDTH
+            self.__myBounds = QRectF(left - w, top - w, right - left + 2.0 * w, bottom - top + 2.0 * w)
+
+    def boundingRect(self):
+        return self.__myBounds
+
+    def paint(self, painter, option, widget=None):
+
+        if len(self.__myPoints) < 2:
+            return
+
+        stride = self.__stride(option.levelOfDetailFromTransform(painter.worldTransform()))
+
+        if stride not in self.__myRuns:
+            self.__myRuns[stride] = self.__buildRuns(stride)
+
+        exposed = option.exposedRect
+        painter.setBrush(Qt.NoBrush)
+
+        for (pen, path, bounds) in self.__myRuns[stride]:
+            if bounds.intersects(exposed):
+                painter.setPen(pen)
+                painter.drawPath(path)
+
+    def setColourPath(self, state):
+        state = bool(state)
+
+        if state != self.__myColourPath:
+            self.__myColourPath = state
+            self.__myRuns = {}
+            self.update()
+
+    def __stride(self, levelOfDetail):
+        """
+            Return the power of two number of frames between the vertices drawn at a level of detail.
+        """
+        spacing = levelOfDetail * self.__myStep
+
+        if spacing <= 0.0 or spacing >= self.MIN_VERTEX_SPACING:
+            return 1
+
+        return 2 ** int(ceil(log(self.MIN_VERTEX_SPACING / spacing, 2)))
+
+    def __buildRuns(self, stride):
+
+        N = len(self.__myPoints)
+        indices = numpy.arange(0, N, stride)
+
+        if indices[-1] != N - 1:
+            indices = numpy.append(indices, N - 1)
+
+        vertices = self.__myPoints[indices].tolist()
+        nSteps = len(indices) - 1
+
+        if self.__myColourPath:
+            # a step has the colour of the frame it starts from, looked up for every step at once
+            colours = numpy.asarray(timeColourMap(indices[:-1] / float(self.__myNFrames)))
+            rgb = numpy.round(colours[:, :3] * 255.0).astype(numpy.int64)
+            changes = numpy.flatnonzero(numpy.any(rgb[1:] != rgb[:-1], axis=1)) + 1
+        else:
+            rgb = None
+            changes = numpy.array([], dtype=numpy.int64)
+
+        starts = [0] + changes.tolist()
+        ends = changes.tolist() + [nSteps]
+
+        w = self.PEN_WIDTH
+        runs = []
+
+        for (start, end) in zip(starts, ends):
+
+            path = QPainterPath(QPointF(*vertices[start]))
+
+            for (x, y) in vertices[start + 1:end + 1]:
+                path.lineTo(x, y)
+
+            colour = self.PATH_COLOUR if rgb is None else QColor(*rgb[start].tolist())
+            bounds = path.controlPointRect().adjusted(-w, -w, w, w)
+            runs.append((QPen(QBrush(colour), w), path, bounds))
+
+        return runs
+
+
 #noinspection PyOldStyleClasses
 class GridItem(QGraphicsItem):
 
@@ -181,8 +364,40 @@ class GridItem(QGraphicsItem):
         return self.__myGridOn
 
 
+#noinspection PyOldStyleClasses
+class PictureItem(QGraphicsItem):
+    """
+        PictureItem draws a recorded QPicture, e.g. text that is laid out once and shared between items.
+    """
+
+    def __init__(self, picture, parent=None):
+
+        super(PictureItem, self).__init__(parent)
+
+        self.__myPicture = picture
+        # the bounds of recorded text are estimated, leave a margin so that it is never clipped
+        self.__myBounds = QRectF(picture.boundingRect()).adjusted(-2.0, -2.0, 2.0, 2.0)
+
+    def boundingRect(self):
+        return self.__myBounds
+
+    def paint(self, painter, option, widget=None):
+        painter.drawPicture(0, 0, self.__myPicture)
+
+
 #noinspection PyOldStyleClasses
 class ColourMapItem(QGraphicsItem):
+    """
+        ColourMapItem is the legend of the time colour map, a bar with a tick and a label every so many seconds.
+
+        The bar is a QImage with one pixel per frame, scaled to the size of the item, and the labels are recorded
+        once as a QPicture. Both are shared by every legend with the same frames, size and frame rate, so
+        rebuilding the scene or repainting the view never draws the legend frame by frame.
+    """
+
+    # the colour bars keyed by (horizontal, nFrames) and the labels keyed by (width, height, nFrames, fps, ticks)
+    __images = {}
+    __labels = {}
 
     def __init__(self, width, height, nFrames, fps, ticks=10, parent=None):
 
@@ -201,6 +416,8 @@ class ColourMapItem(QGraphicsItem):
         else:
             self.__myDT = self.__myHeight / self.__myTicks
 
+        self.__myImage = self.__colourBar()
+
         self.__annotate()
 
     def boundingRect(self):
@@ -209,30 +426,15 @@ class ColourMapItem(QGraphicsItem):
     def paint(self, painter, option, widget=None):
 
         painter.drawRect(self.boundingRect())
+        painter.drawImage(self.boundingRect(), self.__myImage)
+
+        painter.setPen(QPen(Qt.black))
+        painter.setBrush(QBrush(Qt.NoBrush))
 
         # draw the colour map horizontally
         if self.__myWidth > self.__myHeight:
 
             dx = self.__myWidth / (self.__myNFrames - 1)
-            x = 0.0
-            painter.setPen(QPen(Qt.NoPen))
-
-            # draw the bars in the colour map
-            for i in range(self.__myNFrames):
-
-                value = float(i) / float(self.__myNFrames)
-                red = timeColourMap(value)[0]
-                green = timeColourMap(value)[1]
-                blue = timeColourMap(value)[2]
-
-                drawColour = QColor.fromRgbF(red, green, blue, 1.0)
-
-                painter.setBrush(QBrush(drawColour))
-                painter.drawRect(QRectF(x, 0, dx * 1.1, self.__myHeight))
-                x += dx
-
-            painter.setPen(QPen(Qt.black))
-            painter.setBrush(QBrush(Qt.NoBrush))
 
             # draw the ticks
             for t in range(0, self.__myTicks + 1):
@@ -243,25 +445,6 @@ class ColourMapItem(QGraphicsItem):
 
             # the colour map has to be vertical
             dy = self.__myHeight / (self.__myNFrames - 1)
-            y = self.__myHeight - 1
-
-            painter.setPen(QPen(Qt.NoPen))
-
-            # draw the bars in the colour map
-            for i in range(self.__myNFrames):
-                value = float(i) / float(self.__myNFrames)
-                red = timeColourMap(value)[0]
-                green = timeColourMap(value)[1]
-                blue = timeColourMap(value)[2]
-                drawColour = QColor.fromRgbF(red, green, blue, 1.0)
-                painter.setBrush(QBrush(drawColour))
-                painter.drawRect(QRectF(0, y, self.__myWidth, dy * 1.5))
-                y -= dy
-
-            # draw the tick marks
-
-            painter.setPen(QPen(Qt.black))
-            painter.setBrush(QBrush(Qt.NoBrush))
 
             # draw the ticks
             for t in range(self.__myTicks, -1, -1):
@@ -269,30 +452,74 @@ class ColourMapItem(QGraphicsItem):
                 tPos = t * self.__myDT
                 painter.drawLine(QLineF(QPointF(0, tPos + dy * 0.5), QPointF(self.__myWidth + 5.0, tPos + dy * 0.5)))
 
+    def __colourBar(self):
+        """
+            Return the QImage of the colour bar, one pixel per frame with the first frame on the left or the bottom.
+        """
+
+        horizontal = self.__myWidth > self.__myHeight
+        key = (horizontal, self.__myNFrames)
+
+        if key not in ColourMapItem.__images:
+
+            nFrames = max(self.__myNFrames, 1)
+            rgb = timeColourMap.rgb8[timeColourMap.indices(numpy.arange(nFrames) / float(nFrames))].astype(numpy.uint32)
+            pixels = 0xFF000000 | (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+            if horizontal:
+                w, h = nFrames, 1
+            else:
+                w, h = 1, nFrames
+                pixels = pixels[::-1]
+
+            data = numpy.ascontiguousarray(pixels, dtype=numpy.uint32).tostring()
+            ColourMapItem.__images[key] = QImage(data, w, h, QImage.Format_RGB32).copy()
+
+        return ColourMapItem.__images[key]
+
     def __annotate(self):
 
-        dt = (self.__myNFrames - 1.0) / (self.__myTicks * self.__myFPS)
+        key = (self.__myWidth, self.__myHeight, self.__myNFrames, self.__myFPS, self.__myTicks)
 
-        # draw the colour map horizontally
-        if self.__myWidth > self.__myHeight:
+        if key not in ColourMapItem.__labels:
 
-            dx = self.__myWidth / self.__myNFrames
-            for t in range(0, self.__myTicks + 1):
-                tPos = t * self.__myDT
-                string = '%.1f' % (t * dt)
-                text = QGraphicsSimpleTextItem(string, self)
-                text.translate(tPos - dx * 0.5, self.__myHeight + 6.0)
-                text.rotate(-60.0)
+            dt = (self.__myNFrames - 1.0) / (self.__myTicks * self.__myFPS)
 
-        else:
+            font = QFont()
+            metrics = QFontMetricsF(font)
 
-            # the colour map has to be vertical
-            for t in range(self.__myTicks, -1, -1):
-                tPos = t * self.__myDT
-                string = '%.1f' % ((self.__myTicks - t) * dt)
-                text = QGraphicsSimpleTextItem(string, self)
-                textOffset = text.boundingRect().height() * 0.5
-                text.translate(self.__myWidth + 6.0, tPos - textOffset)
+            picture = QPicture()
+            painter = QPainter(picture)
+            painter.setFont(font)
+            painter.setPen(QPen(Qt.black))
+
+            # draw the colour map horizontally
+            if self.__myWidth > self.__myHeight:
+
+                dx = self.__myWidth / self.__myNFrames
+                for t in range(0, self.__myTicks + 1):
+                    tPos = t * self.__myDT
+                    string = '%.1f' % (t * dt)
+                    painter.save()
+                    painter.translate(tPos - dx * 0.5, self.__myHeight + 6.0)
+                    painter.rotate(-60.0)
+                    painter.drawText(QPointF(0.0, metrics.ascent()), string)
+                    painter.restore()
+
+            else:
+
+                # the colour map has to be vertical
+                for t in range(self.__myTicks, -1, -1):
+                    tPos = t * self.__myDT
+                    string = '%.1f' % ((self.__myTicks - t) * dt)
+                    textOffset = metrics.height() * 0.5
+                    painter.drawText(QPointF(self.__myWidth + 6.0, tPos - textOffset + metrics.ascent()), string)
+
+            painter.end()
+
+            ColourMapItem.__labels[key] = picture
+
+        PictureItem(ColourMapItem.__labels[key], self)
 
 
 #noinspection PyOldStyleClasses
@@ -426,6 +653,12 @@ class GlyphView(QGraphicsView):
     PATH_VIEW = 2
     SUMMARY_VIEW = 3
 
+    # the glyph windows of the levels of detail as multiples of the time step, from zoomed out to zoomed in
+    GLYPH_LEVELS = (4.0, 2.0, 1.0, 0.5)
+
+    # the fewest frames of a glyph window, see glyphFrameRanges
+    MIN_GLYPH_FRAMES = MIN_GLYPH_FRAMES
+
     def __init__(self, spermContainer, glyphControlDialog=None, parent=None):
 
         super(GlyphView, self).__init__(parent)
@@ -444,6 +677,20 @@ class GlyphView(QGraphicsView):
         self.__mySceneScale = 1.0
         self.__myViewMode = self.GLYPH_VIEW
 
+        # the handles of the items drawn for the sperms, the slots change them in place
+        self.__clearItems()
+
+        # the time step of the dialog and the level of detail of the glyphs, the sperms use their product
+        self.__myTimeStep = 1.0
+        self.__myGlyphLevel = 1.0
+        self.__myLevelsComputed = False
+
+        if glyphControlDialog is not None:
+            self.__myTimeStep = glyphControlDialog.getCurrentTimeStep()
+            spermContainer.setSmoothingWindow(glyphControlDialog.getCurrentSmoothingWindow())
+
+        spermContainer.setTimeStep(self.__myTimeStep)
+
         theScene = GlyphScene(self)
 
         self.setScene(theScene)
@@ -456,6 +703,10 @@ class GlyphView(QGraphicsView):
 
         fBox = self.scene().getWorkSpace().mapToScene(QPointF(0.0, 0.0))
 
+        # the scene deletes every item when its frame is updated
+        self.__clearItems()
+        self.__myLevelsComputed = False
+
         if self.__mySpermContainer.isEmpty():
 
             frameWidth = self.scene().getFrameWidth()
@@ -527,22 +778,22 @@ class GlyphView(QGraphicsView):
     @pyqtSlot(float)
     def cBaseChanged(self, CBase):
         self.__myCBase = CBase
-        self.update()
+        self.__updateGlyphScales()
 
     @pyqtSlot(float)
     def cScaleChanged(self, CScale):
         self.__myCScale = CScale
-        self.update()
+        self.__updateGlyphScales()
 
     @pyqtSlot(float)
     def hScaleChanged(self, HScale):
         self.__myHScale = HScale
-        self.update()
+        self.__updateGlyphScales()
 
     @pyqtSlot(float)
     def tScaleChanged(self, TScale):
         self.__myTScale = TScale
-        self.update()
+        self.__updateGlyphScales()
 
     @pyqtSlot(int)
     def designChanged(self, design):
@@ -558,32 +809,90 @@ class GlyphView(QGraphicsView):
         elif design is designs.CHEN_ALT_DESIGN:
             self.__drawFunction = designs.drawChenAltDesign
 
-        self.update()
+        GlyphItem.clearPictures()
+
+        for glyph in self.__glyphItems():
+            glyph.setDrawFunction(self.__myDisplaySettings.getCurrentDesign())
 
     @pyqtSlot(int)
     def positionChanged(self, strategy):
         self.__myPositionStrategy = strategy
-        self.update()
+        self.__placeGlyphs()
 
     @pyqtSlot(int)
     def toggleColourPath(self, state):
         self.__myColourPathOn = state
-        self.update()
+        self.__colourPath()
 
     @pyqtSlot(int)
     def toggleSegmentsOn(self, state):
         self.__mySegmentsOn = state
-        self.update()
+
+        for item in self.__mySegmentItems:
+            item.setVisible(self.__myDisplaySettings.areSegmentsOn())
 
     @pyqtSlot(int)
     def thicknessChanged(self, thickness):
         self.__thickness = thickness
-        self.update()
+        GlyphItem.clearPictures()
+
+        for glyph in self.__glyphItems():
+            glyph.setThickness(self.__myDisplaySettings.getCurrentThickness())
+
+    @pyqtSlot(float)
+    def timeStepChanged(self, timeStep):
+        # only the window measures are computed again, from the per frame series of the sperms
+        previous = self.__myTimeStep
+        self.__myTimeStep = max(timeStep, self.getMinimumTimeStep())
+        self.__myLevelsComputed = False
+
+        try:
+            self.__setGlyphLevel(self.__glyphLevel())
+            self.__rebuildGlyphs()
+
+        except (IndexError, ValueError, ZeroDivisionError) as e:
+            qWarning('in GlyphView.timeStepChanged()... no glyph windows of %.3f secs : %s' % (timeStep, e))
+
+            self.__myTimeStep = previous
+            self.__myDisplaySettings.setCurrentTimeStep(previous)
+            self.__setGlyphLevel(self.__glyphLevel())
+            self.__rebuildGlyphs()
+
+    @pyqtSlot(int)
+    def smoothingWindowChanged(self, w):
+        self.__mySpermContainer.setSmoothingWindow(w)
+        self.__myLevelsComputed = False
+        self.__rebuildGlyphs()
+
+    def getMinimumTimeStep(self):
+        """
+            Return the shortest time step whose glyph windows have MIN_GLYPH_FRAMES frames at the frame rate of the
+            data set, with half a frame to spare as the bounds of the windows are rounded down to whole frames.
+        """
+        if self.__mySpermContainer.isEmpty():
+            return 0.0
+
+        return (self.MIN_GLYPH_FRAMES + 0.5) / float(self.__mySpermContainer.getFPS())
+
+    def getGlyphTimeSteps(self):
+        """
+            Return the time steps of the glyph windows of the levels of detail, from zoomed out to zoomed in.
+        """
+        return [self.__myTimeStep * level for level in self.__glyphLevels()]
+
+    def computeGlyphLevels(self):
+        """
+            Compute the glyph measures of every level of detail now, so that zooming only swaps between them. The
+            glyph view does it on its first swap of level, the other views only need the measures they draw.
+        """
+        self.__mySpermContainer.computeGlyphLevels(self.getGlyphTimeSteps())
+        self.__myLevelsComputed = True
 
     def getGlyphScaleParameters(self):
         return self.__myCBase, self.__myCScale
 
     def clear(self):
+        self.__clearItems()
         self.scene().clear()
 
     def setViewMode(self, viewMode):
@@ -602,6 +911,16 @@ class GlyphView(QGraphicsView):
             # zooming out
             self.scale(1.0 / scaleFactor, 1.0 / scaleFactor)
 
+        level = self.__glyphLevel()
+
+        if level != self.__myGlyphLevel:
+
+            if self.__myViewMode is self.GLYPH_VIEW and not self.__myLevelsComputed:
+                self.computeGlyphLevels()
+
+            self.__setGlyphLevel(level)
+            self.__rebuildGlyphs()
+
     def mousePressEvent(self, event):
         self.__myPanFrom = event.pos()
         self.setCursor(Qt.ClosedHandCursor)
@@ -617,96 +936,199 @@ class GlyphView(QGraphicsView):
 
     ### private member functions of the class
 
+    def __glyphLevels(self):
+        """
+            Return the levels of detail whose glyph windows are long enough at the frame rate of the data set, but
+            shorter than the recording, which has no glyph window of its own length. The time step of the dialog is
+            always a level.
+        """
+
+        if self.__mySpermContainer.isEmpty():
+            return [1.0]
+
+        minimum = self.getMinimumTimeStep()
+        duration = self.__mySpermContainer.getNFrames() / float(self.__mySpermContainer.getFPS())
+
+        return [level for level in self.GLYPH_LEVELS
+                if level == 1.0 or minimum <= self.__myTimeStep * level < duration]
+
+    def __glyphLevel(self):
+        """
+            Return the level of detail for the scale of the view, each doubling of the scale halves the windows.
+        """
+        scale = abs(self.transform().m11())
+        wanted = 2.0 ** -round(log(scale, 2))
+        return min(self.__glyphLevels(), key=lambda level: abs(log(level / wanted, 2)))
+
+    def __setGlyphLevel(self, level):
+        self.__myGlyphLevel = level
+        self.__mySpermContainer.setTimeStep(self.__myTimeStep * level)
+
+    def __clearItems(self):
+        self.__myPathItems = []
+        self.__mySegmentItems = []
+        self.__myGlyphItems = []
+        self.__mySummaryItems = []
+
+    def __glyphItems(self):
+        return [glyph for glyphs in self.__myGlyphItems for glyph in glyphs] + self.__mySummaryItems
+
     def __drawGlyphs(self):
 
+        colourPath = self.__myDisplaySettings.getCurrentPathState()
+        nFrames = self.__mySpermContainer.getNFrames()
+
+        print "number of sperm to visualize -- %d" % (len(self.__mySpermContainer))
+        for sperm in self.__mySpermContainer:
+
+            track = TrackItem(sperm.getCentroids(0, len(sperm)), nFrames, colourPath)
+            self.scene().addItemToFrame(track)
+            self.__myPathItems.append(track)
+
+        self.__addGlyphs()
+
+    def __addGlyphs(self):
+        """
+            Add the segments and the glyphs of the glyph windows of every sperm and keep their handles.
+        """
+
         CBase = self.__myDisplaySettings.getCurrentCBase()
         CScale = self.__myDisplaySettings.getCurrentCScale()
         TScale = self.__myDisplaySettings.getCurrentTScale()
         HScale = self.__myDisplaySettings.getCurrentHScale()
         drawFunc = self.__myDisplaySettings.getCurrentDesign()
-        strategy = self.__myDisplaySettings.getCurrentPositioning()
-        colourPath = self.__myDisplaySettings.getCurrentPathState()
         segmentsOn = self.__myDisplaySettings.areSegmentsOn()
         thickness = self.__myDisplaySettings.getCurrentThickness()
 
-        print "number of sperm to visualize -- %d" % (len(self.__mySpermContainer))
         for (i, sperm) in enumerate(self.__mySpermContainer):
 
             numberOfGlyphs = sperm.getNumberOfGlyphs()
             print "sperm %d : number of glyphs -- %d" % (i, numberOfGlyphs)
 
-            positions = sperm.getCentroids(0, len(sperm))
+            # the segments are always there and only shown or hidden by the segments check box
+            starts = sperm.getPositions(START_POSITION)
+            ends = sperm.getPositions(END_POSITION)
 
-            for index in range(len(positions) - 1):
+            pen = QPen(QBrush(Qt.red), 2.0)
+            segments = []
 
-                drawColour = QColor(0, 206, 209)
-
-                if colourPath:
-                    value = float(index) / float(self.__mySpermContainer.getNFrames())
-                    red = timeColourMap(value)[0]
-                    green = timeColourMap(value)[1]
-                    blue = timeColourMap(value)[2]
-                    drawColour = QColor.fromRgbF(red, green, blue, 1.0)
+            if len(starts):
+                ellipse = QGraphicsEllipseItem(QRectF(starts[0].x() - 2, starts[0].y() - 2, 4, 4))
+                ellipse.setPen(Qt.red)
+                ellipse.setBrush(QBrush(Qt.red))
+                segments.append(ellipse)
 
-                pen = QPen(QBrush(drawColour), 2.0)
-                line = QGraphicsLineItem(QLineF(positions[index], positions[index + 1]))
+            for index in range(len(starts)):
+                line = QGraphicsLineItem(QLineF(starts[index], ends[index]))
                 line.setPen(pen)
-                self.scene().addItemToFrame(line)
+                segments.append(line)
+                ellipse = QGraphicsEllipseItem(QRectF(ends[index].x() - 2, ends[index].y() - 2, 4, 4))
+                ellipse.setPen(Qt.red)
+                ellipse.setBrush(QBrush(Qt.red))
+                segments.append(ellipse)
 
-            if segmentsOn:
+            for item in segments:
+                item.setVisible(segmentsOn)
+                self.scene().addItemToFrame(item)
 
-                starts = sperm.getPositions(START_POSITION)
-                ends = sperm.getPositions(END_POSITION)
+            self.__mySegmentItems.extend(segments)
 
-                pen = QPen(QBrush(Qt.red), 2.0)
+            glyphs = []
 
-                ellipse = QGraphicsEllipseItem(QRectF(starts[0].x() - 2, starts[0].y() - 2, 4, 4))
-                ellipse.setPen(Qt.red)
-                ellipse.setBrush(QBrush(Qt.red))
+            for index in range(numberOfGlyphs):
+                glyph = GlyphItem(CBase, CScale, HScale, TScale,
+                                  QPointF(), sperm.getParameters(index), drawFunc,
+                                  thickness, False)
+                self.scene().addItemToFrame(glyph)
+                glyphs.append(glyph)
+
+            self.__myGlyphItems.append(glyphs)
+
+        self.__placeGlyphs()
+
+    def __placeGlyphs(self):
+        """
+            Move and orient the glyphs of every sperm for the current layout strategy.
+        """
+
+        strategy = self.__myDisplaySettings.getCurrentPositioning()
 
-                self.scene().addItemToFrame(ellipse)
-                for index in range(len(starts)):
-                    line = QGraphicsLineItem(QLineF(starts[index], ends[index]))
-                    line.setPen(pen)
-                    self.scene().addItemToFrame(line)
-                    ellipse = QGraphicsEllipseItem(QRectF(ends[index].x() - 2, ends[index].y() - 2, 4, 4))
-                    ellipse.setPen(Qt.red)
-                    ellipse.setBrush(QBrush(Qt.red))
-                    self.scene().addItemToFrame(ellipse)
+        for (sperm, glyphs) in zip(self.__mySpermContainer, self.__myGlyphItems):
 
             glyphPositions = sperm.getPositions(strategy)
             glyphDirections = sperm.getDirections(strategy)
 
-            for index in range(numberOfGlyphs):
-                print 'drawing glyphs'
-                glyph = GlyphItem(CBase, CScale, HScale, TScale,
-                                  glyphPositions[index], sperm.getParameters(index), drawFunc,
-                                  thickness, False)
+            for (index, glyph) in enumerate(glyphs):
+                glyph.resetTransform()
+                glyph.setPosition(glyphPositions[index])
                 # start from the x-axis
                 glyph.rotate(90.0)
                 orientAngle = degrees(polarAngle(glyphDirections[index]))
                 glyph.rotate(orientAngle)
-                self.scene().addItemToFrame(glyph)
 
-        def __drawSummaryGlyph(self):
-            """
-                Draw a summary glyph of the sperm tract.
-            """
-
-            CBase = self.__myDisplaySettings.getCurrentCBase()
-            CScale = self.__myDisplaySettings.getCurrentCScale()
-            TScale = self.__myDisplaySettings.getCurrentTScale()
-            HScale = self.__myDisplaySettings.getCurrentHScale()
-            drawFunc = self.__myDisplaySettings.getCurrentDesign()
-            thickness = self.__myDisplaySettings.getCurrentThickness()
-
-            for sperm in self.__mySpermContainer:
-                x = self.scene().getWorkSpace().boundingRect().width() * 0.5
-                y = self.scene().getWorkSpace().boundingRect().height() * 0.5
-                center = self.scene().getWorkSpace().mapToScene(QPointF(x, y))
-                glyph = GlyphItem(CBase, CScale, HScale, TScale, center,
-                                  sperm.getSummaryParameters(), drawFunc, thickness, True)
-                self.scene().addItemToFrame(glyph)
+    def __colourPath(self):
+        """
+            Colour the path of every sperm by time, or in a single colour.
+        """
+
+        colourPath = self.__myDisplaySettings.getCurrentPathState()
+
+        for track in self.__myPathItems:
+            track.setColourPath(colourPath)
+
+    def __updateGlyphScales(self):
+
+        CBase = self.__myDisplaySettings.getCurrentCBase()
+        CScale = self.__myDisplaySettings.getCurrentCScale()
+        TScale = self.__myDisplaySettings.getCurrentTScale()
+        HScale = self.__myDisplaySettings.getCurrentHScale()
+
+        GlyphItem.clearPictures()
+
+        for glyph in self.__glyphItems():
+            glyph.setScales(CBase, CScale, HScale, TScale)
+
+    def __rebuildGlyphs(self):
+        """
+            Replace the segments and the glyphs after the glyph windows have changed, every other item is kept.
+        """
+
+        for item in self.__mySegmentItems + self.__glyphItems():
+            self.scene().removeItem(item)
+
+        self.__mySegmentItems = []
+        self.__myGlyphItems = []
+        self.__mySummaryItems = []
+
+        if self.__mySpermContainer.isEmpty():
+            return
+
+        if self.__myViewMode is self.GLYPH_VIEW:
+            self.__addGlyphs()
+
+        elif self.__myViewMode is self.SUMMARY_VIEW:
+            self.__drawSummaryGlyph()
+
+    def __drawSummaryGlyph(self):
+        """
+            Draw a summary glyph of the sperm tract.
+        """
+
+        CBase = self.__myDisplaySettings.getCurrentCBase()
+        CScale = self.__myDisplaySettings.getCurrentCScale()
+        TScale = self.__myDisplaySettings.getCurrentTScale()
+        HScale = self.__myDisplaySettings.getCurrentHScale()
+        drawFunc = self.__myDisplaySettings.getCurrentDesign()
+        thickness = self.__myDisplaySettings.getCurrentThickness()
+
+        for sperm in self.__mySpermContainer:
+            x = self.scene().getWorkSpace().boundingRect().width() * 0.5
+            y = self.scene().getWorkSpace().boundingRect().height() * 0.5
+            center = self.scene().getWorkSpace().mapToScene(QPointF(x, y))
+            glyph = GlyphItem(CBase, CScale, HScale, TScale, center,
+                              sperm.getSummaryParameters(), drawFunc, thickness, True)
+            self.scene().addItemToFrame(glyph)
+            self.__mySummaryItems.append(glyph)
 
     def __drawSperm(self):
 
@@ -730,6 +1152,6 @@ class GlyphView(QGraphicsView):
     def __drawPath(self):
 
         for sperm in self.__mySpermContainer:
-            path = PolyLine(sperm.getCentroids(0, len(sperm)))
+            path = PolyLine(convertArrayToPath(sperm.getCentroids(0, len(sperm))))
             path.setPen(QPen(QColor(0, 206, 209), 3.0))
             self.scene().addItemToFrame(path)
\ No newline at end of file
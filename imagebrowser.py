@@ -189,7 +189,7 @@ class MainWindow(QMainWindow):
                                                   'Sperm file (%s)' % self.__mySpermContainer.formats())
         if not fName.isEmpty():
             try:
-                ok, msg = self.__mySpermContainer.loadDataSet(fName)
+                ok, msg = self.__mySpermContainer.loadDataSet(fName, mapped=True)
                 self.statusBar().showMessage(msg, 5000)
             except (IOError, OSError) as e:
                 QMessageBox.warning( None, 'File Load Error', unicode(e))
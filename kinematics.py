@@ -0,0 +1,359 @@
+"""
+    This module computes the kinematic measures and the glyph positions of every glyph window of a track at once.
+
+    The functions in computation.py take the path of a single window as a list of QPointF objects and walk it
+    point by point. Here the whole centroid path and its smoothed path are (N, 2) arrays and the glyph windows are
+    given by their frame boundaries, every per frame or per step quantity is computed once for the whole track and
+    the sums over a window are read from prefix sums, so a window costs O(1) whatever its length. The crossings of
+    the two paths are found in one pass by computation.crossingSegments and shared out between the windows.
+
+    The results are NumPy structured arrays with one record per window, in pixel and frame units, see
+    KINEMATICS_DTYPE and POSITIONS_DTYPE. They match averageVelocity, straightLineVelocity, intersectPoints,
+    amplitudes, meanAngularDensity, averagePosition and averageVector to rounding, see testKinematicWindows.
+"""
+
+import sys
+
+import numpy
+
+from computation import (crossingSegments)
+
+# the kinematic measures of a glyph window, velocities in pixels per frame, amplitudes in pixels, angles in degrees
+KINEMATICS_DTYPE = numpy.dtype([('VCL', numpy.float64), ('VSL', numpy.float64), ('VAP', numpy.float64),
+                                ('BCF', numpy.int64), ('ALH', numpy.float64), ('MAD', numpy.float64),
+                                ('headAngle', numpy.float64)])
+
+# the glyph positions and directions of a glyph window, see pycasadata.positionMeasures
+POSITIONS_DTYPE = numpy.dtype([(name, numpy.float64, (2,)) for name in
+                               ('startPosition', 'middlePosition', 'endPosition', 'averagePosition',
+                                'midPointPosition', 'startDirection', 'middleDirection', 'endDirection',
+                                'averageDirection', 'midPointDirection')])
+
+# two coordinates that differ by less than this times the smaller of them are the same, as qFuzzyCompare for QPointF
+FUZZY = 1e-12
+
+
+def windowBounds(ranges):
+    """
+        Return starts, ends; the arrays of the first frame and one past the last frame of the (start, end) ranges.
+    """
+    bounds = numpy.asarray(ranges, dtype=numpy.int64).reshape(-1, 2)
+    return bounds[:, 0].copy(), bounds[:, 1].copy()
+
+
+def fuzzyEqual(a, b):
+    """
+        Return where the coordinates of a and b are the same as for QPointF ==, i.e. qFuzzyCompare, equal to a
+        relative precision of FUZZY, or within FUZZY of a coordinate that is zero.
+    """
+
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    difference = numpy.abs(a - b)
+
+    return numpy.where((a == 0.0) | (b == 0.0), difference <= FUZZY,
+                       difference <= FUZZY * numpy.minimum(numpy.abs(a), numpy.abs(b)))
+
+
+def prefixSums(values):
+    """
+        Return the prefix sums of values along the first axis with a leading zero, so that the sum of
+        values[i:j] is prefix[j] - prefix[i].
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    prefix = numpy.zeros((len(values) + 1,) + values.shape[1:])
+    numpy.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+
+def stepLengths(points):
+    """
+        Return the N - 1 lengths of the steps between consecutive points of an (N, 2) array.
+    """
+    steps = numpy.diff(points, axis=0)
+    return numpy.hypot(steps[:, 0], steps[:, 1])
+
+
+def turningAngles(points):
+    """
+        Return the N - 2 turning angles, in radians, at the inner points of an (N, 2) array, the angle between the
+        slopes of the steps before and after a point as computation.signedAngle.
+    """
+
+    steps = numpy.diff(points, axis=0)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slopes = numpy.where(steps[:, 0] == 0.0, steps[:, 1], steps[:, 1] / steps[:, 0])
+        m1 = slopes[:-1]
+        m2 = slopes[1:]
+        return numpy.arctan(numpy.abs(m2 - m1) / (1.0 + m1 * m2))
+
+
+def meanVelocities(lengths, starts, ends):
+    """
+        Return the averageVelocity of every window from the step lengths of the whole path.
+
+        The first and last steps of a window are counted one and a half times, the others once.
+    """
+
+    prefix = prefixSums(lengths)
+    n = ends - starts
+    valid = n >= 3
+
+    s = starts[valid]
+    e = ends[valid]
+
+    velocities = numpy.zeros(len(starts))
+    velocities[valid] = (prefix[e - 1] - prefix[s] + 0.5 * (lengths[s] + lengths[e - 2])) / n[valid]
+
+    return velocities
+
+
+def windowMaxima(values, starts, ends):
+    """
+        Return the maximum of values over every window, zero for an empty window.
+    """
+
+    maxima = numpy.zeros(len(starts))
+    valid = ends > starts
+
+    if numpy.any(valid):
+        # reduceat over start, end pairs, the end indices reduce the gaps and are dropped
+        padded = numpy.append(values, 0.0)
+        indices = numpy.column_stack((starts[valid], ends[valid])).ravel()
+        maxima[valid] = numpy.maximum.reduceat(padded, indices)[::2]
+
+    return maxima
+
+
+def windowCrossings(path, smoothed, starts, ends):
+    """
+        Return the number of crossings of the path and the smoothed path inside every window, less one when the
+        last of them is the last point of the window, i.e. len(intersectPoints) - 1 of the window.
+    """
+
+    W = len(starts)
+    T = len(path)
+
+    # the window of every step of the path, a step between two windows belongs to neither
+    steps = numpy.arange(max(T - 1, 0))
+    windows = numpy.searchsorted(starts, steps, side='right') - 1
+    inside = (windows >= 0) & (steps <= ends[numpy.maximum(windows, 0)] - 2)
+    windows = numpy.where(inside, windows, -1)
+
+    # only the steps of the same window are paired, so the cost grows with the windows and not the whole track,
+    # the crossings stay in path then smoothed path order
+    i, j, points = crossingSegments(path, smoothed, windows)
+    owner = windows[i]
+
+    counts = numpy.bincount(owner, minlength=W)[:W] if len(owner) else numpy.zeros(W, dtype=numpy.int64)
+    crossed = counts > 0
+
+    last = points[numpy.cumsum(counts)[crossed] - 1]
+    closing = numpy.all(fuzzyEqual(last, path[ends[crossed] - 1]), axis=1)
+
+    beats = counts.astype(numpy.int64)
+    beats[crossed] -= closing
+
+    return beats
+
+
+def kinematicWindows(path, smoothed, ranges):
+    """
+        Return a KINEMATICS_DTYPE record for every glyph window of a track.
+
+        path     : (N, 2) array of the centroids of the whole track
+        smoothed : (N, 2) array of the smoothed centroids of the whole track, see pycasadata.averagePath
+        ranges   : the (start, end) frame ranges of the glyph windows
+    """
+
+    path = numpy.asarray(path, dtype=numpy.float64).reshape(-1, 2)
+    smoothed = numpy.asarray(smoothed, dtype=numpy.float64).reshape(-1, 2)
+    starts, ends = windowBounds(ranges)
+
+    windows = numpy.zeros(len(starts), dtype=KINEMATICS_DTYPE)
+
+    if not len(starts):
+        return windows
+
+    n = ends - starts
+
+    windows['VCL'] = meanVelocities(stepLengths(path), starts, ends)
+    windows['VAP'] = meanVelocities(stepLengths(smoothed), starts, ends)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        chord = path[ends - 1] - path[starts]
+        windows['VSL'] = numpy.hypot(chord[:, 0], chord[:, 1]) / n
+
+        offsets = path - smoothed
+        windows['ALH'] = windowMaxima(2.0 * numpy.hypot(offsets[:, 0], offsets[:, 1]), starts, ends)
+
+        # the turning angles of the inner points start + 1 to end - 2 of a window
+        angles = turningAngles(path)
+        total = prefixSums(angles)
+        absolute = prefixSums(numpy.abs(angles))
+        first = numpy.minimum(starts, len(angles))
+        last = numpy.clip(ends - 2, first, len(angles))
+
+        windows['MAD'] = numpy.degrees((absolute[last] - absolute[first]) / (n - 2))
+        windows['headAngle'] = numpy.degrees((total[last] - total[first]) / (n - 2))
+
+    windows['BCF'] = windowCrossings(path, smoothed, starts, ends)
+
+    return windows
+
+
+def positionWindows(path, ranges):
+    """
+        Return a POSITIONS_DTYPE record for every glyph window of a track, path is the (N, 2) array of the centroids
+        of the whole track. A window needs at least three frames for its directions.
+    """
+
+    path = numpy.asarray(path, dtype=numpy.float64).reshape(-1, 2)
+    starts, ends = windowBounds(ranges)
+
+    windows = numpy.zeros(len(starts), dtype=POSITIONS_DTYPE)
+
+    if not len(starts):
+        return windows
+
+    n = ends - starts
+
+    if numpy.any(n < 3) or numpy.any(starts < 0) or numpy.any(ends > len(path)):
+        raise IndexError('IndexError <index out of bounds>')
+
+    middle = starts + (n * 0.5).astype(numpy.int64)
+    prefix = prefixSums(path)
+
+    windows['startPosition'] = path[starts]
+    windows['middlePosition'] = path[middle]
+    windows['endPosition'] = path[ends - 1]
+    windows['averagePosition'] = (prefix[ends] - prefix[starts]) / n[:, numpy.newaxis]
+    windows['midPointPosition'] = (path[starts] + path[ends - 1]) * 0.5
+    windows['startDirection'] = path[starts + 1] - path[starts]
+    windows['middleDirection'] = path[middle + 1] - path[middle]
+    windows['endDirection'] = path[ends - 1] - path[ends - 2]
+    windows['averageDirection'] = (path[ends - 1] - path[starts]) / (n - 1)[:, numpy.newaxis]
+    windows['midPointDirection'] = path[ends - 1] - path[starts]
+
+    return windows
+
+
+def testKinematicWindows(root='data', timeStep=1.0, fps=50.0, tolerance=1e-5):
+    """
+        Compare kinematicWindows and positionWindows with the point by point functions of computation.py on every
+        glyph window of every track file.
+
+        The references do their arithmetic with QVector2D, which holds single precision values in Qt 4, so the
+        tolerance is relative and near single precision.
+    """
+
+    from computation import (averageVelocity, straightLineVelocity, intersectPoints, amplitudes,
+                             meanAngularDensity, averagePosition, averageVector, convertArrayToPath)
+    from pycasadata import (AcquisitionContext, glyphFrameRanges, averagePath, positionMeasures)
+    from spermtrack import (buildSpermTrack)
+    from trackfile import (readTrackFile, trackFiles)
+
+    print('testing kinematicWindows against computation.py on : %s' % root)
+
+    context = AcquisitionContext(fps)
+    failures = 0
+
+    def differ(a, b):
+        return abs(a - b) > tolerance * max(1.0, abs(b))
+
+    for fileName in trackFiles(root):
+
+        track = buildSpermTrack(readTrackFile(fileName))
+        ranges = [(s, e) for (s, e) in glyphFrameRanges(len(track), context, timeStep) if e - s >= 3]
+
+        path = numpy.asarray(track.centroids)
+        smoothed = numpy.array([(p.x(), p.y()) for p in averagePath(convertArrayToPath(path))]).reshape(-1, 2)
+
+        kinematics = kinematicWindows(path, smoothed, ranges)
+        positions = positionWindows(path, ranges)
+        errors = []
+
+        for (index, (start, end)) in enumerate(ranges):
+
+            window = convertArrayToPath(path[start:end])
+            avgWindow = convertArrayToPath(smoothed[start:end])
+            amps = amplitudes(window, avgWindow)
+
+            try:
+                mad, angle = meanAngularDensity(window)
+            except ZeroDivisionError:
+                # the reference divides by zero for perpendicular steps, which the kernel takes as a right angle
+                mad = angle = None
+
+            expected = {'VCL': averageVelocity(window), 'VSL': straightLineVelocity(window),
+                        'VAP': averageVelocity(avgWindow), 'BCF': len(intersectPoints(window, avgWindow)) - 1,
+                        'ALH': max(amps) if len(amps) else 0.0, 'MAD': mad, 'headAngle': angle}
+
+            for (name, value) in expected.items():
+                if value is not None and differ(kinematics[name][index], value):
+                    errors.append('%s %d' % (name, index))
+
+            expected = positionMeasures(window)
+            expected['averagePosition'] = averagePosition(window)
+            expected['averageDirection'] = averageVector(window)
+
+            for (name, value) in expected.items():
+                if differ(positions[name][index][0], value.x()) or differ(positions[name][index][1], value.y()):
+                    errors.append('%s %d' % (name, index))
+
+        failures += len(errors)
+        print('%-50s %4d windows %s' % (fileName, len(ranges), 'ok' if not errors else ', '.join(errors[:5])))
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+def testStationaryTrack(N=8000, fps=50.0, timeStep=1.0, jitter=0.6, seed=0):
+    """
+        Compare the beat cross frequencies of kinematicWindows with intersectPoints, window by window, on a long
+        synthetic track of an immotile sperm jittering about a point, with its centroids on whole pixels. The steps
+        of the path then overlap all the time and a search over the whole track pairs every step with most others.
+    """
+
+    import time
+
+    from computation import (convertArrayToPath, intersectPoints)
+    from pycasadata import (AcquisitionContext, glyphFrameRanges, averagePath)
+
+    print('testing kinematicWindows on a stationary track of %d frames' % N)
+
+    path = 100.0 + numpy.round(numpy.random.RandomState(seed).normal(0.0, jitter, (N, 2)))
+    smoothed = numpy.array([(p.x(), p.y()) for p in averagePath(convertArrayToPath(path))]).reshape(-1, 2)
+    ranges = [(s, e) for (s, e) in glyphFrameRanges(N, AcquisitionContext(fps), timeStep) if e - s >= 3]
+
+    t0 = time.time()
+    kinematics = kinematicWindows(path, smoothed, ranges)
+    t1 = time.time()
+
+    failures = 0
+
+    for (index, (start, end)) in enumerate(ranges):
+
+        expected = len(intersectPoints(convertArrayToPath(path[start:end]), convertArrayToPath(smoothed[start:end])))
+
+        if kinematics['BCF'][index] != expected - 1:
+            failures += 1
+            print('FAILED window %d : BCF %d, expected %d' % (index, kinematics['BCF'][index], expected - 1))
+
+    print('%d windows %8.2f ms, %d beats' % (len(ranges), (t1 - t0) * 1000.0, kinematics['BCF'].sum()))
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testKinematicWindows(sys.argv[1])
+    else:
+        testKinematicWindows()
+        testStationaryTrack()
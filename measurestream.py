@@ -0,0 +1,366 @@
+"""
+    This module computes the CASA measures of a single sperm incrementally, while a tracker is still emitting frames.
+
+    Sperm.computeMeasures needs the whole centroid path up front. A MeasureStream is instead fed the frames in
+    batches with addFrames, and returns every glyph window as soon as its time range has closed. The smoothed path
+    is kept as a rolling state: the smoothed point of a frame is final once the half window of frames after it has
+    arrived, so only the frames that are still needed for the open window and the smoothing are buffered and a
+    finished frame is never processed again. finish() closes the stream and returns the last, shorter window.
+
+    The windows and their measures are the same as those of computeMeasures on the whole track, see
+    testMeasureStream. A track shorter than the smoothing window is smoothed with a shorter window by
+    computeMeasures, so nothing is returned until the track is known to be at least that long.
+"""
+
+import sys
+
+import numpy
+
+import pycasadata
+
+from computation import (hanning, smoothArray, windowSums, fitSplines)
+from pycasadata import (MIN_GLYPH_FRAMES, AcquisitionContext, convertToSeconds, convertFromSeconds, windowMeasures)
+
+
+class GlyphWindow:
+    """
+        GlyphWindow holds the measures of one finished glyph window, the frames start to end of the stream.
+    """
+
+    def __init__(self, index, start, end, measures):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.measures = measures
+
+    def __repr__(self):
+        return 'GlyphWindow( index : %d, frames : %d - %d )' % (self.index, self.start, self.end)
+
+
+class MeasureStream:
+    """
+        MeasureStream computes the glyph window measures of a sperm from frames that arrive in batches.
+    """
+
+    def __init__(self, context=None, timeStep=1.0, w=500, smoothness=None, degree=None, nPoints=None):
+
+        self.__context = AcquisitionContext() if context is None else context
+        self.__timeStep = timeStep
+        self.__w = w
+        self.__window = hanning(w)
+        self.__m = int(len(self.__window) * 0.5)
+
+        self.__smoothness = pycasadata.SPLINE_SMOOTHNESS if smoothness is None else smoothness
+        self.__degree = pycasadata.SPLINE_DEGREE if degree is None else degree
+        self.__nPoints = pycasadata.SPLINE_POINTS if nPoints is None else nPoints
+
+        self.__nFrames = 0
+        self.__finished = False
+
+        # the buffered frames are the frames base to nFrames
+        self.__base = 0
+        self.__centroids = numpy.zeros((0, 2))
+        self.__lengths = numpy.zeros(0)
+        self.__widths = numpy.zeros(0)
+        self.__hCerts = numpy.zeros(0)
+        self.__fCerts = numpy.zeros(0)
+        self.__flagella = []
+
+        # the final smoothed points of the frames base to base + len(smoothed), the first point pads the path
+        self.__first = None
+        self.__smoothed = numpy.zeros((0, 2))
+
+        # the last good fitted flagellum, reused by the frames that have none
+        self.__lastGood = numpy.zeros((0, 2))
+
+        # the time range of the next glyph window
+        self.__index = 0
+        self.__t1 = 0.0
+        self.__t2 = timeStep
+
+    def __len__(self):
+        return self.__nFrames
+
+    def isFinished(self):
+        return self.__finished
+
+    def getNumberOfGlyphs(self):
+        return self.__index
+
+    def getBufferedFrames(self):
+        return self.__nFrames - self.__base
+
+    def addFrames(self, centroids, lengths, widths, flagella, hCerts, fCerts, fitted=False):
+        """
+            Append a batch of frames and return the list of GlyphWindows that it closed, in order.
+
+            centroids : (N, 2) array of the head centroids
+            lengths   : N head lengths, widths the N head widths
+            flagella  : N (n_i, 2) arrays of the captured flagella, a spline is fitted to every one with more
+                        than one point and the others reuse the last good one. With fitted=True they are the
+                        fitted flagella and are kept as they are.
+            hCerts    : N head certainties, fCerts the N flagellum certainties
+        """
+
+        if self.__finished:
+            raise ValueError('ValueError adding frames : the stream is finished')
+
+        centroids = numpy.asarray(centroids, dtype=numpy.float64).reshape(-1, 2)
+        N = len(centroids)
+
+        if not (len(lengths) == len(widths) == len(flagella) == len(hCerts) == len(fCerts) == N):
+            raise ValueError('ValueError adding frames : %d centroids and columns of different lengths' % N)
+
+        if N == 0:
+            return []
+
+        if self.__first is None:
+            self.__first = centroids[0].copy()
+
+        self.__centroids = numpy.concatenate((self.__centroids, centroids))
+        self.__lengths = numpy.concatenate((self.__lengths, numpy.asarray(lengths, dtype=numpy.float64)))
+        self.__widths = numpy.concatenate((self.__widths, numpy.asarray(widths, dtype=numpy.float64)))
+        self.__hCerts = numpy.concatenate((self.__hCerts, numpy.asarray(hCerts, dtype=numpy.float64)))
+        self.__fCerts = numpy.concatenate((self.__fCerts, numpy.asarray(fCerts, dtype=numpy.float64)))
+        self.__flagella.extend(self.__fitFlagella(flagella, fitted))
+
+        self.__nFrames += N
+
+        # until the track is as long as the smoothing window computeMeasures would use a shorter one
+        if self.__nFrames < len(self.__window):
+            return []
+
+        self.__smoothTo(self.__nFrames - self.__m)
+
+        return self.__closeWindows()
+
+    def finish(self):
+        """
+            Close the stream and return the list of the GlyphWindows that are still open, the last of them ends
+            with the last frame.
+        """
+
+        if self.__finished:
+            return []
+
+        self.__finished = True
+
+        N = self.__nFrames
+
+        # computeMeasures makes no glyphs for a track that is not longer than one time step
+        if not convertToSeconds(N, self.__context) > self.__timeStep:
+            return []
+
+        if N < len(self.__window):
+            w = self.__w if N >= self.__w else N - 1
+            self.__smoothed = smoothArray(self.__centroids, hanning(w))
+        else:
+            self.__smoothTo(N)
+
+        return self.__closeWindows(True)
+
+    def __fitFlagella(self, flagella, fitted):
+        """
+            Return the list of fitted flagella of a batch of frames, carrying the last good one between batches.
+        """
+
+        flagella = [numpy.asarray(f, dtype=numpy.float64).reshape(-1, 2) for f in flagella]
+
+        if fitted:
+            return flagella
+
+        good = [f for f in flagella if len(f) > 1]
+        splines = iter(fitSplines(good, self.__smoothness, self.__degree, self.__nPoints) if good else [])
+
+        result = []
+
+        for f in flagella:
+            if len(f) > 1:
+                self.__lastGood = next(splines)
+            result.append(self.__lastGood)
+
+        return result
+
+    def __smoothTo(self, end):
+        """
+            Extend the final smoothed points up to the frame end, the frames after end - 1 must already be here
+            for half a window or the stream must be finished.
+        """
+
+        m = self.__m
+        done = self.__base + len(self.__smoothed)
+
+        if end <= done:
+            return
+
+        # the padded run of the path that covers the frames done to end, padded with the end points as in smooth
+        lo = done - m
+        parts = [numpy.repeat(self.__first[numpy.newaxis], max(-lo, 0), axis=0),
+                 self.__centroids[max(lo, 0) - self.__base:end + m - self.__base]]
+
+        if end + m > self.__nFrames:
+            parts.append(numpy.repeat(self.__centroids[-1:], end + m - self.__nFrames, axis=0))
+
+        smoothed = windowSums(numpy.concatenate(parts), self.__window)
+
+        if done == 0:
+            smoothed[0] = self.__first
+
+        if self.__finished and end == self.__nFrames:
+            smoothed[-1] = self.__centroids[-1]
+
+        self.__smoothed = numpy.concatenate((self.__smoothed, smoothed))
+
+    def __closeWindows(self, final=False):
+        """
+            Return the GlyphWindows whose time ranges have closed and drop the frames no longer needed.
+        """
+
+        windows = []
+        totalTime = convertToSeconds(self.__nFrames, self.__context)
+        smoothedEnd = self.__base + len(self.__smoothed)
+
+        while self.__t2 < totalTime and convertFromSeconds(self.__t2, self.__context) <= smoothedEnd:
+            windows.append(self.__glyphWindow(self.__t1, self.__t2))
+            self.__t1 = self.__t2
+            self.__t2 += self.__timeStep
+
+        if final:
+            windows.append(self.__glyphWindow(self.__t1, totalTime))
+            return [window for window in windows if window is not None]
+
+        # keep the open window and the half window of frames the next smoothed points are padded with
+        self.__trim(min(convertFromSeconds(self.__t1, self.__context), smoothedEnd - self.__m))
+
+        return [window for window in windows if window is not None]
+
+    def __glyphWindow(self, t1, t2):
+        """
+            Return the GlyphWindow of the time range t1 to t2, or None if it is too short for a glyph, as for
+            glyphFrameRanges.
+        """
+
+        start = convertFromSeconds(t1, self.__context)
+        end = convertFromSeconds(t2, self.__context)
+
+        if end - start < MIN_GLYPH_FRAMES:
+            return None
+
+        i = start - self.__base
+        j = end - self.__base
+
+        measures = windowMeasures(self.__centroids[i:j], self.__smoothed[i:j],
+                                  self.__lengths[i:j], self.__widths[i:j], self.__flagella[i:j],
+                                  self.__hCerts[i:j], self.__fCerts[i:j], self.__context)
+
+        window = GlyphWindow(self.__index, start, end, measures)
+        self.__index += 1
+
+        return window
+
+    def __trim(self, base):
+
+        n = base - self.__base
+
+        if n <= 0:
+            return
+
+        self.__base = base
+        self.__centroids = self.__centroids[n:]
+        self.__lengths = self.__lengths[n:]
+        self.__widths = self.__widths[n:]
+        self.__hCerts = self.__hCerts[n:]
+        self.__fCerts = self.__fCerts[n:]
+        self.__flagella = self.__flagella[n:]
+        self.__smoothed = self.__smoothed[n:]
+
+
+def streamSperm(sperm, batchSize=100, fitted=False):
+    """
+        Return the list of GlyphWindows of a loaded Sperm fed to a MeasureStream batchSize frames at a time.
+    """
+
+    track = sperm.getTrack()
+    stream = MeasureStream(sperm.getContext())
+    windows = []
+
+    for start in range(0, len(track), batchSize):
+        end = min(start + batchSize, len(track))
+
+        if fitted:
+            flagella = track.flagella(start, end)
+        else:
+            flagella = [track.capturedFlagellum(i) for i in range(start, end)]
+
+        windows.extend(stream.addFrames(track.centroids[start:end], track.lengths[start:end],
+                                        track.widths[start:end], flagella,
+                                        track.hCerts[start:end], track.fCerts[start:end], fitted))
+
+    windows.extend(stream.finish())
+
+    return windows
+
+
+def testMeasureStream(headers=('data/set2/set2_main.txt', 'data/AllSpermData/set3_main.txt'),
+                      batchSizes=(1, 37, 500, 100000), tolerance=1e-5):
+    """
+        Compare the windows of a MeasureStream with computeMeasures for every sperm of the data sets headers.
+
+        computeMeasures works with QVector2D, which holds single precision values in Qt 4, so the measures are
+        compared to a relative tolerance near single precision.
+    """
+
+    from PyQt4.QtCore import (QString)
+
+    getters = (('VCL', 'getVCL'), ('VAP', 'getVAP'), ('VSL', 'getVSL'), ('BCF', 'getBCF'), ('ALH', 'getALH'),
+               ('MAD', 'getMAD'), ('headAngle', 'getHeadAngle'), ('headLength', 'getHeadLength'),
+               ('headWidth', 'getHeadWidth'), ('arcLength', 'getArcLength'), ('changeInAngle', 'getChangeInAngle'),
+               ('asymmetry', 'getAsymmetry'), ('torque', 'getTorque'))
+
+    failures = 0
+
+    for header in headers:
+
+        print('testing MeasureStream against computeMeasures on : %s' % header)
+
+        container = pycasadata.SpermContainer()
+        ok, msg = container.loadDataSet(QString(header))
+
+        if not ok:
+            print('could not load : %s' % msg)
+            failures += 1
+            continue
+
+        for (index, sperm) in enumerate(container):
+            for batchSize in batchSizes:
+                for fitted in (False, True):
+
+                    windows = streamSperm(sperm, batchSize, fitted)
+
+                    if len(windows) != sperm.getNumberOfGlyphs():
+                        print('sperm %d batch %d : %d windows, %d glyphs' %
+                              (index, batchSize, len(windows), sperm.getNumberOfGlyphs()))
+                        failures += 1
+                        continue
+
+                    for window in windows:
+                        for (name, getter) in getters:
+                            expected = getattr(sperm, getter)(window.index)
+                            value = window.measures[name]
+                            if abs(value - expected) > tolerance * max(1.0, abs(expected)):
+                                print('sperm %d batch %d fitted %s glyph %d %s : %r != %r' %
+                                      (index, batchSize, fitted, window.index, name, value, expected))
+                                failures += 1
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testMeasureStream(sys.argv[1:])
+    else:
+        testMeasureStream()
@@ -13,7 +13,7 @@ from random            import ( uniform  )
 from geometry          import ( midpoint )
 from math              import ( pi, sin  )
 from copy              import ( deepcopy )  
-from computation       import ( smooth, fitSpline )
+from computation       import ( smooth, fitSplines, lastGoodIndices, convertArrayToPath, convertPathToArray )
 
 class Sperm(QObject):
     '''
@@ -89,18 +89,13 @@ class Sperm(QObject):
             # end while
             print "done..."
         
-            # fit a cubic spline to the flagella
+            # fit a cubic spline to the flagella, all in one batch, a bad flagellum reuses the last good one
             print "fitting flagella with cubic spline"
-            last_good_flagellum = []
-            N = len(self.flagella)
-            for i in range(N):
-                if len(self.flagella[i]) > 1:
-                    self.flagella[i] = fitSpline(self.flagella[i], 10.0, 3)
-                    last_good_flagellum = self.flagella[i]
-                else:
-                    self.flagella[i] = last_good_flagellum
-                # end if
-            # end for
+            last_good = lastGoodIndices( [ len(flagellum) for flagellum in self.flagella ] )
+            good = sorted( set( last_good.tolist() ) - set( [-1] ) )
+            fitted = fitSplines( [ convertPathToArray( self.flagella[i] ) for i in good ], 10.0, 3 )
+            fitted = dict( zip( good, fitted ) )
+            self.flagella = [ convertArrayToPath( fitted[i] ) if i >= 0 else [] for i in last_good.tolist() ]
             print "done fitting..."
             
             print "done..."
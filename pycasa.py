@@ -15,7 +15,6 @@ from PyQt4.QtCore import (SIGNAL, QString, QFileInfo, QSize)
 
 from glyphview import (GlyphView)
 from pycasadata import (SpermContainer)
-from timeseries import (timeSeries, timeSeriesAll)
 from parallelcoordinates import (ParallelCoordinates, Axis)
 from dialogs import ( GlyphControlDialog )
 from glyphdesigns import(CHEN_DESIGN, AVERAGE_POSITION)
@@ -98,6 +97,9 @@ class MainWindow(QMainWindow):
         self.glyphControlDialog.connectToSegmentsCheckBox  ( self.__myGlyphView, "toggleSegmentsOn(int)" )
 
         self.glyphControlDialog.connectToThicknessSpinBox( self.__myGlyphView, "thicknessChanged(int)")
+
+        self.glyphControlDialog.connectToTimeStepSpinBox ( self.__myGlyphView, "timeStepChanged(double)" )
+        self.glyphControlDialog.connectToSmoothingSpinBox( self.__myGlyphView, "smoothingWindowChanged(int)" )
     # end def 
     
     def changeRendering(self,value):
@@ -154,9 +156,10 @@ class MainWindow(QMainWindow):
                                             "Sperm file (%s)" % self.__mySpermContainer.formats())
         if not fName.isEmpty():
             try:
-                ok, msg = self.__mySpermContainer.loadDataSet(fName)
+                ok, msg = self.__mySpermContainer.loadDataSet(fName, processes=None)
                 self.statusBar().showMessage(msg, 5000)
                 if ok:
+                    self.glyphControlDialog.setMinimumTimeStep(self.__myGlyphView.getMinimumTimeStep())
                     self.__myGlyphView.update()
             except (IOError, OSError) as e:
                 QMessageBox.warning( None, "File Load Error ", unicode(e))
@@ -291,6 +294,9 @@ class MainWindow(QMainWindow):
     # end def
 
     def displayTimeSeries(self):
+        # pylab is only imported when the time series are plotted
+        from timeseries import (timeSeriesAll)
+
         print('rendering time series of the data...')
         id = 1
         for sperm in self.__mySpermContainer:
@@ -2,11 +2,26 @@
     This module handles all of the sperm data down the video frames
 """
 
+from multiprocessing import (Pool, cpu_count)
+
+from PyQt4.QtGui import (QVector2D)
 from PyQt4.QtCore import (Qt, QPointF, QString, QRegExp, QFile, QFileInfo, QIODevice, QTextStream)
 
-from computation import (straightLineVelocity, smooth, hanning, average, averageVelocity, averagePosition,
-                         averageVector, meanAngularDensity, averageArcLength, averageChangeInAngle,
-                         averageAsymmetry, averageTorque, amplitudes, fitSpline, intersectPoints)
+import numpy
+
+from computation import (straightLineVelocity, smooth, smoothArray, hanning, average, averageVelocity,
+                         averagePosition, averageVector, meanAngularDensity, averageArcLength, averageChangeInAngle,
+                         averageAsymmetry, averageTorque, frameTorques, amplitudes, intersectPoints,
+                         convertArrayToPath, convertPathToArray)
+
+from trackfile import (writeTrackFile)
+from trackbinary import (readAnyTrackFile, isBinaryTrack, writeBinaryTrack)
+from spermtrack import (SpermTrack, buildSpermTrack, trackData)
+from trackcache import (cachedSpermTrack)
+from trackindex import (MappedSpermTrack)
+from kinematics import (kinematicWindows, positionWindows)
+from flagellumshape import (frameShapes, shapeSums, windowShapes)
+from framesums import (FrameSums, windowTorque)
 
 from geometry import (toVector, midpoint)
 
@@ -16,47 +31,151 @@ from glyphdesigns import (START_POSITION, MIDDLE_POSITION, END_POSITION, AVERAGE
 
 CODEC = "UTF-8"
 
-maxAsymmetry = 8000.0
-maxTorque = 3500000.0
-maxBCF = 30.0
+# the smallest maxima the torques, asymmetries and beat frequencies of a data set are normalised by
+MIN_MAX_ASYMMETRY = 8000.0
+MIN_MAX_TORQUE = 3500000.0
+MIN_MAX_BCF = 30.0
+
+# the default length of the glyph windows in seconds and of the Hanning window of the average path in frames
+TIME_STEP = 1.0
+SMOOTHING_WINDOW = 500
+
+# the fewest frames of a glyph window, the directions of a glyph need three
+MIN_GLYPH_FRAMES = 3
+
+# parameters of the spline fitted to the captured flagella
+SPLINE_SMOOTHNESS = 10.0
+SPLINE_DEGREE = 3
+SPLINE_POINTS = 100
+
+# the number of processes fitting the flagella of a single sperm, None uses every core
+SPLINE_PROCESSES = 1
+
+# keep parsed and fitted tracks in a cache next to the data set, see trackcache.py
+USE_TRACK_CACHE = True
+
+
+class AcquisitionContext:
+    """
+        AcquisitionContext holds the acquisition values of a data set, the frame rate, the pixel size and the
+        viscosity, together with the maxima that the torques and asymmetries of its sperms are normalised by.
+
+        A SpermContainer and each of its Sperms share one context, so data sets with different acquisition
+        values can be loaded and measured side by side in one process.
+    """
+
+    def __init__(self, fps=1.0, pixelScale=1.0, viscosity=1.0):
+        self.fps = fps
+        self.pixelScale = pixelScale
+        self.viscosity = viscosity
+
+        self.maxTorque = MIN_MAX_TORQUE
+        self.maxAsymmetry = MIN_MAX_ASYMMETRY
+        self.maxBCF = MIN_MAX_BCF
+
+        # the sperms whose torques and asymmetries are not yet part of the maxima, see updateMaxValues
+        self.__pending = []
+
+    def __getstate__(self):
+        # the sperms are pickled on their own, a context sent to a worker only carries its values
+        state = self.__dict__.copy()
+        state['_AcquisitionContext__pending'] = []
+        return state
+
+    def __repr__(self):
+        return 'AcquisitionContext( fps : %s, pixelScale : %s, viscosity : %s )' % \
+               (self.fps, self.pixelScale, self.viscosity)
+
+    def key(self):
+        """
+            Return the acquisition values the measures depend on, the measures cached by a Sperm are dropped when
+            they change.
+        """
+        return self.fps, self.pixelScale, self.viscosity
+
+    def addSperms(self, sperms):
+        """
+            Queue sperms to be folded into the maxima when they are first needed.
+        """
+        self.__pending.extend(sperms)
+
+    def resetMaxValues(self, sperms):
+        """
+            Start the maxima again from the sperms, their torques and asymmetries change with their glyph windows.
+        """
+        self.maxTorque = MIN_MAX_TORQUE
+        self.maxAsymmetry = MIN_MAX_ASYMMETRY
+        self.__pending = list(sperms)
+
+    def updateMaxValues(self):
+        """
+            Fold the torques and asymmetries of the sperms added since the last call into maxTorque and maxAsymmetry.
+
+            This is left until a normalised measure is needed so that loading a data set does not compute the
+            flagellum mechanics of every glyph.
+        """
+
+        if not self.__pending:
+            return
+
+        while self.__pending:
+
+            sperm = self.__pending.pop(0)
+
+            torque = 0.0
+
+            if len(sperm.getTorques()) > 0:
+                torque = max(sperm.getTorques())
+
+            asymmetry = 1.0
+
+            if len(sperm.getAsymmetries()) > 0:
+                if max(sperm.getAsymmetries()) > abs(min(sperm.getAsymmetries())):
+                    asymmetry = max(sperm.getAsymmetries())
+                else:
+                    asymmetry = abs(min(sperm.getAsymmetries()))
+
+            if asymmetry == 0.0:
+                asymmetry = 1.0
+
+            if self.maxAsymmetry < asymmetry:
+                self.maxAsymmetry = asymmetry
 
-FRAMES_PER_SECOND = 1.0
-PIXEL_SCALE = 1.0
-VISCOSITY_VALUE = 1.0
+            if self.maxTorque < torque:
+                self.maxTorque = torque
 
+        print('Max Asymmetry     : %f ' % self.maxAsymmetry)
+        print('Max Torque        : %f ' % self.maxTorque)
 
-def convertToNMS(value):
+
+def convertToNMS(value, context):
     """
         Return value converted to nano meters per second  mu/sec.
     """
-    global FRAMES_PER_SECOND, PIXEL_SCALE
-    dt = 1.0 / FRAMES_PER_SECOND
-    return (value * PIXEL_SCALE) / dt
+    dt = 1.0 / context.fps
+    return (value * context.pixelScale) / dt
 
 
-def convertToNM(value):
+def convertToNM(value, context):
     """
         Return value converted to nano meters.
     """
-    global PIXELS_SCALE
-    return value * PIXEL_SCALE
+    return value * context.pixelScale
 
 
-def convertToSeconds(frame):
+def convertToSeconds(frame, context):
     """
         Return frame number converted to second
     """
-    global FRAMES_PER_SECOND
-    dt = 1.0 / FRAMES_PER_SECOND
+    dt = 1.0 / context.fps
     return frame * dt
 
 
-def convertFromSeconds(seconds):
+def convertFromSeconds(seconds, context):
     """
         Return seconds converted to the closest frame number
     """
-    global FRAMES_PER_SECOND
-    dt = 1.0 / FRAMES_PER_SECOND
+    dt = 1.0 / context.fps
     return int(seconds / dt)
 
 
@@ -79,15 +198,154 @@ def temporalRanges(start, end, step):
     return temporal
 
 
-def convertToFrameRanges(temporal):
+def convertToFrameRanges(temporal, context):
     frames = []
 
     for t in temporal:
-        frames.append((convertFromSeconds(t[0]), convertFromSeconds(t[1])))
+        frames.append((convertFromSeconds(t[0], context), convertFromSeconds(t[1], context)))
 
     return frames
 
 
+def positionMeasures(path):
+    """
+        Return a dict of the positions and directions of a glyph window, path is a list of QPointF objects.
+    """
+    middle = int(len(path) * 0.5)
+
+    return {'startPosition': path[0],
+            'middlePosition': path[middle],
+            'endPosition': path[-1],
+            'averagePosition': averagePosition(path),
+            'midPointPosition': midpoint(path[0], path[-1]),
+            'startDirection': toVector(path[1] - path[0]),
+            'middleDirection': toVector(path[middle + 1] - path[middle]),
+            'endDirection': toVector(path[-1] - path[-2]),
+            'averageDirection': averageVector(path),
+            'midPointDirection': toVector(path[-1] - path[0])}
+
+
+def kinematicValues(windows, context):
+    """
+        Return a dict of arrays of the kinematic measures of the KINEMATICS_DTYPE records windows, see
+        kinematics.kinematicWindows, converted from pixels and frames with the AcquisitionContext context.
+    """
+    return {'VCL': convertToNMS(windows['VCL'], context),
+            'VSL': convertToNMS(windows['VSL'], context),
+            'VAP': convertToNMS(windows['VAP'], context),
+            'BCF': windows['BCF'],
+            'ALH': convertToNM(windows['ALH'], context),
+            'MAD': windows['MAD'],
+            'headAngle': windows['headAngle']}
+
+
+def kinematicMeasures(centroids, smoothed, context):
+    """
+        Return a dict of the kinematic measures of a glyph window, centroids and smoothed are the (N, 2) arrays of
+        its path and smoothed path and context is the AcquisitionContext of the sperm. They are computed by
+        kinematicWindows, as for Sperm.computeMeasures.
+    """
+    windows = kinematicWindows(centroids, smoothed, [(0, len(centroids))])
+
+    return dict((name, values.tolist()[0]) for (name, values) in kinematicValues(windows, context).items())
+
+
+def headMeasures(lengths, widths, hCerts, context):
+    """
+        Return a dict of the head measures of a glyph window from its per frame head dimensions and certainties.
+    """
+    return {'headLength': convertToNM(average(lengths), context),
+            'headWidth': convertToNM(average(widths), context),
+            'headUncertainty': average(hCerts)}
+
+
+def flagellumMeasures(path, flagella, fCerts, context):
+    """
+        Return a dict of the flagellum mechanics measures of a glyph window.
+
+        flagella is an (N, nPoints, 2) array or a list of (nPoints, 2) arrays of the fitted flagella, see
+        Sperm.getDenseFlagella. The shape measures are computed for all of the frames at once, see flagellumshape.py
+    """
+    shapes = windowShapes(shapeSums(convertPathToArray(path), flagella), [(0, len(path))])[0]
+
+    return {'arcLength': convertToNM(float(shapes['arcLength']), context),
+            'changeInAngle': float(shapes['changeInAngle']),
+            'asymmetry': convertToNM(float(shapes['asymmetry']), context),
+            'torque': convertToNMS(averageTorque(flagella, context.viscosity), context),
+            'flagellumUncertainty': average(fCerts)}
+
+
+def windowMeasures(centroids, smoothed, lengths, widths, flagella, hCerts, fCerts, context):
+    """
+        Return a dict of every measure of a single glyph window, keyed by measure name, centroids and smoothed are
+        the (N, 2) arrays of its path and smoothed path.
+    """
+    path = convertArrayToPath(centroids)
+
+    measures = positionMeasures(path)
+    measures.update(kinematicMeasures(centroids, smoothed, context))
+    measures.update(headMeasures(lengths, widths, hCerts, context))
+    measures.update(flagellumMeasures(path, flagella, fCerts, context))
+
+    return measures
+
+
+# the measures of a glyph window in the families that are computed together, see Sperm.computeMeasures
+POSITION_MEASURES = ('startPosition', 'middlePosition', 'endPosition', 'averagePosition', 'midPointPosition',
+                     'startDirection', 'middleDirection', 'endDirection', 'averageDirection', 'midPointDirection')
+KINEMATIC_MEASURES = ('VCL', 'VSL', 'VAP', 'BCF', 'ALH', 'MAD', 'headAngle')
+HEAD_MEASURES = ('headLength', 'headWidth', 'headUncertainty')
+FLAGELLUM_MEASURES = ('arcLength', 'changeInAngle', 'asymmetry', 'torque', 'flagellumUncertainty')
+
+MEASURE_FAMILIES = (('positions', POSITION_MEASURES), ('kinematics', KINEMATIC_MEASURES),
+                    ('head', HEAD_MEASURES), ('flagellum', FLAGELLUM_MEASURES))
+
+ALL_FAMILIES = tuple(family for (family, names) in MEASURE_FAMILIES)
+
+# the families computed when a sperm is loaded, every view needs the glyph positions and they reject bad windows
+LOAD_FAMILIES = ('positions',)
+
+FAMILY_OF = dict((name, family) for (family, names) in MEASURE_FAMILIES for name in names)
+
+# the prefix of the position and direction measures of each glyph position strategy
+STRATEGY_NAMES = {START_POSITION: 'start', MIDDLE_POSITION: 'middle', END_POSITION: 'end',
+                  AVERAGE_POSITION: 'average', MIDPOINT_POSITION: 'midPoint'}
+
+
+def glyphFrameRanges(nFrames, context, timeStep=TIME_STEP):
+    """
+        Return the (start, end) frame ranges of the glyph windows of a track of nFrames frames. A window of fewer
+        than MIN_GLYPH_FRAMES frames, e.g. the last few frames of the track, has no glyph and is left out.
+    """
+    totalTime = convertToSeconds(nFrames, context)
+
+    if not totalTime > timeStep:
+        return []
+
+    return [(start, end) for (start, end) in convertToFrameRanges(temporalRanges(0.0, totalTime, timeStep), context)
+            if end - start >= MIN_GLYPH_FRAMES]
+
+
+def averagePath(path, w=SMOOTHING_WINDOW):
+    """
+        Return a list of QPointF objects, the path smoothed with a Hanning window that is shortened for short paths.
+    """
+    if len(path) < w:
+        w = len(path) - 1
+
+    return smooth(path, hanning(w))
+
+
+def smoothedPath(points, w=SMOOTHING_WINDOW):
+    """
+        Return the (N, 2) array of averagePath for an (N, 2) array of points.
+    """
+    if len(points) < w:
+        w = len(points) - 1
+
+    return smoothArray(points, hanning(w))
+
+
 def intFromQString(string):
     """
         Return a integer conversion of a QString object.
@@ -196,80 +454,155 @@ class Sperm:
         The Sperm class holds all of the data about an individual sperm.
     """
 
-    def __init__(self, beatCycleLength=1, fileName=None):
+
+    def __init__(self, beatCycleLength=1, fileName=None, context=None, mapped=False):
 
         self.clear()
         self.__myBeatCycleLength = beatCycleLength
 
+        if context is not None:
+            self.__myContext = context
+
         if fileName is not None:
 
-            ok, msg = self.loadSperm(fileName)
+            ok, msg = self.loadSperm(fileName, mapped)
 
             if not ok:
                 print msg
                 raise IOError('IOError opening : %s' % fileName)
 
     def clear(self):
-        self.__myFrames = []
+        self.__myTrack = SpermTrack()
 
         self.__myBeatCycleLength = 1.0
-        self.__myNumberOfGlyphs = 0
-
-        # Kinematic measures
-        self.__myVCLs = []
-        self.__myVAPs = []
-        self.__myVSLs = []
-        self.__myALHs = []
-        self.__myBCFs = []
-        self.__myMADs = []
-
-        # Head Mechanics
-        self.__myHeadLengths = []
-        self.__myHeadWidths = []
-        self.__myHeadAngles = []
-
-        # Flagellum Mechanics
-        self.__myArcLengths = []
-        self.__myChangesInAngles = []
-        self.__myTorques = []
-        self.__myAsymmetries = []
-
-        self.__myHeadUncertainties = []
-        self.__myFlagellumUncertainties = []
-
-        # Positioning and Directions
-        self.__myStartPositions = []
-        self.__myMiddlePositions = []
-        self.__myEndPositions = []
-        self.__myAveragePositions = []
-        self.__myMidPointPositions = []
-
-        self.__myStartDirections = []
-        self.__myMiddleDirections = []
-        self.__myEndDirections = []
-        self.__myAverageDirections = []
-        self.__myMidPointDirections = []
+        self.__myTimeStep = TIME_STEP
+        self.__mySmoothingWindow = SMOOTHING_WINDOW
+        self.__myContext = AcquisitionContext()
+
+        self.clearMeasures()
+
+    def clearMeasures(self):
+        """
+            Drop every computed measure, the measures are computed again per family and per glyph window when they
+            are next asked for, see computeMeasures.
+        """
+
+        # the acquisition values and time step the glyph ranges and the cached measures were computed with
+        self.__myUnits = None
+        self.__myGlyphRanges = []
+        self.__myAveragePath = None
+
+        # the glyph ranges, measures and computed windows of the other time steps used, keyed by their units
+        self.__myLevels = {}
+
+        # the prefix sums of the per frame series, they only depend on the frames and are kept for any glyph windows
+        self.__mySeries = FrameSums()
+
+        # one list per measure with a value or None for every glyph window, and the windows done for each family
+        self.__myMeasures = dict((name, []) for name in FAMILY_OF)
+        self.__myComputed = dict((family, []) for family in ALL_FAMILIES)
 
     def __len__(self):
-        return len(self.__myFrames)
+        return len(self.__myTrack)
+
+    def __getstate__(self):
+        """
+            Return a compact picklable state, the track as NumPy columns and the positions and directions
+            as coordinate pairs, so that a Sperm can be loaded in a worker process and sent back cheaply.
+        """
+        state = self.__dict__.copy()
+
+        # a mapped track is pickled as its file name and mapped again
+        if isinstance(self.__myTrack, SpermTrack):
+            state['_Sperm__myTrack'] = dict((name, numpy.asarray(value))
+                                            for (name, value) in self.__myTrack.columns().items())
+
+        state['_Sperm__myAveragePath'] = None
+        state['_Sperm__myLevels'] = {}
+
+        measures = dict(self.__myMeasures)
+
+        for name in POSITION_MEASURES:
+            measures[name] = [None if p is None else (p.x(), p.y()) for p in measures[name]]
+
+        state['_Sperm__myMeasures'] = measures
+
+        return state
+
+    def __setstate__(self, state):
+
+        if isinstance(state['_Sperm__myTrack'], dict):
+
+            track = SpermTrack()
+
+            for (name, value) in state['_Sperm__myTrack'].items():
+                setattr(track, name, value)
+
+            state['_Sperm__myTrack'] = track
+
+        measures = state['_Sperm__myMeasures']
+
+        for name in POSITION_MEASURES:
+            qtType = QPointF if name.endswith('Position') else QVector2D
+            measures[name] = [None if p is None else qtType(*p) for p in measures[name]]
+
+        self.__dict__.update(state)
 
     def __repr__(self):
         return ('Sperm( frames : %s, beatCycleLength : %s, positions %s ' %
-                (len(self.__myFrames), self.__myBeatCycleLength, len(self.__myMidPointPositions)))
+                (len(self.__myTrack), self.__myBeatCycleLength, len(self.__myGlyphRanges)))
 
     def __str__(self):
         return ('Sperm( frames : %s, beatCycleLength : %s, positions %s ' %
-                (len(self.__myFrames), self.__myBeatCycleLength, len(self.__myMidPointPositions)))
+                (len(self.__myTrack), self.__myBeatCycleLength, len(self.__myGlyphRanges)))
 
     def getBeatCycleLength(self):
         return self.__myBeatCycleLength
 
+    def getContext(self):
+        return self.__myContext
+
+    def setContext(self, context):
+        """
+            Share an AcquisitionContext, the cached measures are kept if its acquisition values are the same.
+        """
+        self.__myContext = context
+
+    def getTimeStep(self):
+        return self.__myTimeStep
+
+    def setTimeStep(self, timeStep):
+        """
+            Set the length of the glyph windows in seconds. The measures are computed again for the new windows when
+            they are next asked for, from the per frame series that are already known, see framesums.py
+        """
+        self.__myTimeStep = float(timeStep)
+
+    def getSmoothingWindow(self):
+        return self.__mySmoothingWindow
+
+    def setSmoothingWindow(self, w):
+        """
+            Set the length in frames of the Hanning window of the average path. Only the kinematics depend on the
+            average path, they are computed again for every glyph window when they are next asked for.
+        """
+        w = int(w)
+
+        if w != self.__mySmoothingWindow:
+            self.__mySmoothingWindow = w
+            self.__myAveragePath = None
+            self.__myComputed['kinematics'] = [False] * len(self.__myComputed['kinematics'])
+
+            for (glyphRanges, measures, computed) in self.__myLevels.values():
+                computed['kinematics'] = [False] * len(computed['kinematics'])
+
     def getNumberOfGlyphs(self):
-        return self.__myNumberOfGlyphs
+        return len(self.__glyphRanges())
 
     def getParameters(self, index):
 
-        global maxAsymmetry, maxTorque
+        context = self.__myContext
+        context.updateMaxValues()
 
         return [self.getHeadUncertainty(index), self.getFlagellumUncertainty(index),
                 self.getVCL(index), self.getVAP(index), self.getVSL(index),
@@ -277,12 +610,13 @@ class Sperm:
                 self.getHeadAngle(index), self.getHeadLength(index), self.getHeadWidth(index),
                 self.getArcLength(index),
                 self.getChangeInAngle(index),
-                self.getTorque(index) / maxTorque,
-                self.getAsymmetry(index) / maxAsymmetry]
+                self.getTorque(index) / context.maxTorque,
+                self.getAsymmetry(index) / context.maxAsymmetry]
 
     def getSummaryParameters(self):
 
-        global maxAsymmetry, maxTorque
+        context = self.__myContext
+        context.updateMaxValues()
 
         return [self.getAvgHeadUncertainty(), self.getAvgFlagellumUncertainty(),
                 self.getAvgVCL(), self.getAvgVAP(), self.getAvgVSL(),
@@ -290,181 +624,99 @@ class Sperm:
                 self.getAvgHeadAngle(), self.getAvgHeadLength(), self.getAvgHeadWidth(),
                 self.getAvgArcLength(),
                 self.getAvgChangeInAngle(),
-                self.getAvgTorques() / maxTorque,
-                self.getAvgAsymmetry() / maxAsymmetry]
+                self.getAvgTorques() / context.maxTorque,
+                self.getAvgAsymmetry() / context.maxAsymmetry]
 
     def getCentroid(self, index):
 
         pos = None
 
-        if 0 <= index < len(self.__myFrames):
-            pos = self.__myFrames[index].getCentroid()
+        if 0 <= index < len(self.__myTrack):
+            pos = QPointF(*self.__myTrack.centroids[index])
 
         return pos
 
     def getPosition(self, index, strategy):
 
-        pos = None
-
-        if (strategy is AVERAGE_POSITION) and (0 <= index < len(self.__myAveragePositions)):
-            pos = self.__myAveragePositions[index]
-
-        elif (strategy is START_POSITION) and (0 <= index < len(self.__myStartPositions)):
-            pos = self.__myStartPositions[index]
-
-        elif (strategy is END_POSITION) and (0 <= index < len(self.__myEndPositions)):
-            pos = self.__myEndPositions[index]
-
-        elif (strategy is MIDDLE_POSITION) and (0 <= index < len(self.__myMiddlePositions)):
-            pos = self.__myMiddlePositions[index]
-
-        elif (strategy is MIDPOINT_POSITION) and (0 <= index < len(self.__myMidPointPositions)):
-            pos = self.__myMidPointPositions[index]
+        if strategy not in STRATEGY_NAMES:
+            return None
 
-        return pos
+        return self.__measure(STRATEGY_NAMES[strategy] + 'Position', index)
 
     def getPositions(self, strategy):
 
-        if strategy is AVERAGE_POSITION:
-            return self.__myAveragePositions
-
-        elif strategy is START_POSITION:
-            return self.__myStartPositions
-
-        elif strategy is END_POSITION:
-            return self.__myEndPositions
-
-        elif strategy is MIDDLE_POSITION:
-            return self.__myMiddlePositions
-
-        elif strategy is MIDPOINT_POSITION:
-            return self.__myMidPointPositions
+        if strategy in STRATEGY_NAMES:
+            return self.__measures(STRATEGY_NAMES[strategy] + 'Position')
 
     def getDirection(self, index, strategy):
 
-        directory = None
-
-        if (strategy is AVERAGE_POSITION) and (0 <= index < len(self.__myAverageDirections)):
-            directory = self.__myAverageDirections[index]
-
-        elif (strategy is START_POSITION) and (0 <= index < len(self.__myStartDirections)):
-            directory = self.__myStartDirections[index]
-
-        elif (strategy is END_POSITION) and (0 <= index < len(self.__myEndDirections)):
-            directory = self.__myEndDirections[index]
-
-        elif (strategy is MIDDLE_POSITION) and (0 <= index < len(self.__myMiddleDirections)):
-            directory = self.__myMiddleDirections[index]
-
-        elif (strategy is MIDPOINT_POSITION) and (0 <= index < len(self.__myMidPointDirections)):
-            directory = self.__myMidPointDirections[index]
+        if strategy not in STRATEGY_NAMES:
+            return None
 
-        return directory
+        return self.__measure(STRATEGY_NAMES[strategy] + 'Direction', index)
 
     def getDirections(self, strategy):
 
-        if strategy is AVERAGE_POSITION:
-            return self.__myAverageDirections
-
-        elif strategy is START_POSITION:
-            return self.__myStartDirections
-
-        elif strategy is END_POSITION:
-            return self.__myEndDirections
-
-        elif strategy is MIDDLE_POSITION:
-            return self.__myMiddleDirections
-
-        elif strategy is MIDPOINT_POSITION:
-            return self.__myMidPointDirections
+        if strategy in STRATEGY_NAMES:
+            return self.__measures(STRATEGY_NAMES[strategy] + 'Direction')
 
     def getHeadUncertainty(self, index):
-
-        uncertainty = None
-
-        if 0 <= index < len(self.__myHeadUncertainties):
-            uncertainty = self.__myHeadUncertainties[index]
-
-        return uncertainty
+        return self.__measure('headUncertainty', index)
 
     def getFlagellumUncertainty(self, index):
-
-        uncertainty = None
-
-        if 0 <= index < len(self.__myFlagellumUncertainties):
-            uncertainty = self.__myFlagellumUncertainties[index]
-
-        return uncertainty
+        return self.__measure('flagellumUncertainty', index)
 
     def getHeadUncertainties(self):
-        return self.__myHeadUncertainties
+        return self.__measures('headUncertainty')
 
     def getAvgHeadUncertainty(self):
-        return average(self.__myHeadUncertainties)
+        return average(self.__measures('headUncertainty'))
 
     def getFlagellumUncertainties(self):
-        return self.__myFlagellumUncertainties
+        return self.__measures('flagellumUncertainty')
 
     def getAvgFlagellumUncertainty(self):
-        return average(self.__myFlagellumUncertainties)
+        return average(self.__measures('flagellumUncertainty'))
 
     def getVCL(self, index):
-
-        vcl = None
-
-        if 0 <= index < len(self.__myVCLs):
-            vcl = self.__myVCLs[index]
-
-        return vcl
+        return self.__measure('VCL', index)
 
     def getVCLs(self):
-        return self.__myVCLs
+        return self.__measures('VCL')
 
     def getAvgVCL(self):
-        return average(self.__myVCLs)
+        return average(self.__measures('VCL'))
 
     def getVAP(self, index):
-
-        vap = None
-
-        if 0 <= index < len(self.__myVAPs):
-            vap = self.__myVAPs[index]
-
-        return vap
+        return self.__measure('VAP', index)
 
     def getVAPs(self):
-        return self.__myVAPs
+        return self.__measures('VAP')
 
     def getAvgVAP(self):
-        return average(self.__myVAPs)
+        return average(self.__measures('VAP'))
 
     def getVSL(self, index):
-
-        vsl = None
-
-        if 0 <= index < len(self.__myVSLs):
-            vsl = self.__myVSLs[index]
-
-        return vsl
+        return self.__measure('VSL', index)
 
     def getVSLs(self):
-        return self.__myVSLs
+        return self.__measures('VSL')
 
     def getAvgVSL(self):
-        return average(self.__myVSLs)
+        return average(self.__measures('VSL'))
 
     def getWOB(self, index):
 
         wob = None
 
-        if 0 <= index < len(self.__myVAPs) and index < len(self.__myVCLs):
-            wob = self.__myVAPs[index] / self.__myVCLs[index]
+        if 0 <= index < self.getNumberOfGlyphs():
+            wob = self.getVAP(index) / self.getVCL(index)
 
         return wob
 
     def getWOBs(self):
-        vap = self.__myVAPs
-        vcl = self.__myVCLs
+        vap = self.getVAPs()
+        vcl = self.getVCLs()
         size = len(vcl)
         return [vap[i] / vcl[i] for i in range(size)]
 
@@ -475,15 +727,15 @@ class Sperm:
 
         lin = None
 
-        if 0 <= index < len(self.__myVSLs) and index < len(self.__myVCLs):
-            lin = self.__myVSLs[index] / self.__myVCLs[index]
+        if 0 <= index < self.getNumberOfGlyphs():
+            lin = self.getVSL(index) / self.getVCL(index)
 
         return lin
 
     def getLINs(self):
 
-        vsl = self.__myVSLs
-        vcl = self.__myVCLs
+        vsl = self.getVSLs()
+        vcl = self.getVCLs()
         size = len(vcl)
 
         return [vsl[i] / vcl[i] for i in range(size)]
@@ -493,14 +745,14 @@ class Sperm:
 
     def getSTR(self, index):
         lin = None
-        if 0 <= index < len(self.__myVSLs) and index < len(self.__myVAPs):
-            lin = self.__myVSLs[index] / self.__myVAPs[index]
-            
+        if 0 <= index < self.getNumberOfGlyphs():
+            lin = self.getVSL(index) / self.getVAP(index)
+
         return lin
 
     def getSTRs(self):
-        vap = self.__myVAPs
-        vsl = self.__myVSLs
+        vap = self.getVAPs()
+        vsl = self.getVSLs()
         size = len(vsl)
         return [vsl[i] / vap[i] for i in range(size)]
 
@@ -508,174 +760,124 @@ class Sperm:
         return average(self.getSTRs())
 
     def getBCF(self, index):
-
-        bcf = None
-
-        if 0 <= index < len(self.__myBCFs):
-            bcf = self.__myBCFs[index]
-
-        return bcf
+        return self.__measure('BCF', index)
 
     def getBCFs(self):
-        return self.__myBCFs
+        return self.__measures('BCF')
 
     def getAvgBCF(self):
-        return average(self.__myBCFs)
+        return average(self.__measures('BCF'))
 
     def getALH(self, index):
-
-        alh = None
-
-        if 0 <= index < len(self.__myALHs):
-            alh = self.__myALHs[index]
-
-        return alh
+        return self.__measure('ALH', index)
 
     def getALHs(self):
-        return self.__myALHs
+        return self.__measures('ALH')
 
     def getAvgALH(self):
-        return average(self.__myALHs)
+        return average(self.__measures('ALH'))
 
     def getMAD(self, index):
-
-        mad = None
-
-        if 0 <= index < len(self.__myMADs):
-            mad = self.__myMADs[index]
-
-        return mad
+        return self.__measure('MAD', index)
 
     def getMADs(self):
-        return self.__myMADs
+        return self.__measures('MAD')
 
     def getAvgMAD(self):
-        return average(self.__myMADs)
+        return average(self.__measures('MAD'))
 
     def getHeadAngle(self, index):
-
-        angle = None
-
-        if 0 <= index < len(self.__myHeadAngles):
-            angle = self.__myHeadAngles[index]
-
-        return angle
+        return self.__measure('headAngle', index)
 
     def getHeadAngles(self):
-        return self.__myHeadAngles
+        return self.__measures('headAngle')
 
     def getAvgHeadAngle(self):
-        return average(self.__myHeadAngles)
+        return average(self.__measures('headAngle'))
 
     def getHeadLength(self, index):
-
-        length = None
-
-        if 0 <= index < len(self.__myHeadLengths):
-            length = self.__myHeadLengths[index]
-
-        return length
+        return self.__measure('headLength', index)
 
     def getHeadLengths(self):
-        return self.__myHeadLengths
+        return self.__measures('headLength')
 
     def getAvgHeadLength(self):
-        return average(self.__myHeadLengths)
+        return average(self.__measures('headLength'))
 
     def getHeadWidth(self, index):
-
-        width = None
-
-        if 0 <= index < len(self.__myHeadWidths):
-            width = self.__myHeadWidths[index]
-
-        return width
+        return self.__measure('headWidth', index)
 
     def getHeadWidths(self):
-        return self.__myHeadWidths
+        return self.__measures('headWidth')
 
     def getAvgHeadWidth(self):
-        return average(self.__myHeadWidths)
+        return average(self.__measures('headWidth'))
 
     def getArcLength(self, index):
-
-        length = None
-
-        if 0 <= index < len(self.__myArcLengths):
-            length = self.__myArcLengths[index]
-
-        return length
+        return self.__measure('arcLength', index)
 
     def getArcLengths(self):
-        return self.__myArcLengths
+        return self.__measures('arcLength')
 
     def getAvgArcLength(self):
-        return average(self.__myArcLengths)
+        return average(self.__measures('arcLength'))
 
     def getChangeInAngle(self, index):
-
-        angle = None
-
-        if 0 <= index < len(self.__myChangesInAngles):
-            angle = self.__myChangesInAngles[index]
-
-        return angle
+        return self.__measure('changeInAngle', index)
 
     def getChangesInAngles(self):
-        return self.__myChangesInAngles
+        return self.__measures('changeInAngle')
 
     def getAvgChangeInAngle(self):
-        return average(self.__myChangesInAngles)
+        return average(self.__measures('changeInAngle'))
 
     def getTorque(self, index, normalized=False):
 
-        torque = None
+        torque = self.__measure('torque', index)
 
-        if 0 <= index < len(self.__myTorques):
-            if not normalized:
-                torque = self.__myTorques[index]
-            else:
-                scale = 1.0 / max(self.__myTorques)
-                torque = self.__myTorques[index] * scale
+        if torque is not None and normalized:
+            scale = 1.0 / max(self.__measures('torque'))
+            torque = torque * scale
 
         return torque
 
     def getTorques(self, normalized=False):
 
+        torques = self.__measures('torque')
+
         if not normalized:
-            return self.__myTorques
+            return torques
         else:
-            scale = 1.0 / max(self.__myTorques)
-            return [scale * value for value in self.__myTorques]
+            scale = 1.0 / max(torques)
+            return [scale * value for value in torques]
 
     def getAvgTorques(self, normalized=False):
         return average(self.getTorques(normalized))
 
     def getAsymmetry(self, index, normalized=False):
 
-        asymmetry = None
+        asymmetry = self.__measure('asymmetry', index)
 
-        if 0 <= index < len(self.__myAsymmetries):
-            if not normalized:
-                asymmetry = self.__myAsymmetries[index]
-            else:
-                scale = 1.0 / max(self.__myAsymmetries)
-                asymmetry = self.__myAsymmetries[index] * scale
+        if asymmetry is not None and normalized:
+            scale = 1.0 / max(self.__measures('asymmetry'))
+            asymmetry = asymmetry * scale
 
         return asymmetry
 
     def getAsymmetries(self, normalized=False):
 
+        asymmetries = self.__measures('asymmetry')
+
         if not normalized:
 
-            return self.__myAsymmetries
+            return asymmetries
 
         else:
-            maxValue = max(self.__myAsymmetries)
-            minValue = min(self.__myAsymmetries)
+            maxValue = max(asymmetries)
+            minValue = min(asymmetries)
             maxMax = max([maxValue, abs(minValue)])
             scale = 1.0 / maxMax
-            return [scale * value for value in self.__myAsymmetries]
+            return [scale * value for value in asymmetries]
 
     def getAvgAsymmetry(self, normalized=False):
         return average(self.getAsymmetries(normalized))
@@ -685,127 +887,74 @@ class Sperm:
         print "adding frame"
 
         if isinstance(frame, Frame):
-            self.__myFrames.append(frame)
+            self.__myTrack.appendFrame(frame.frameID, (frame.centroid.x(), frame.centroid.y()), frame.tCert,
+                                       frame.length, frame.width, (frame.centre.x(), frame.centre.y()),
+                                       frame.tilt, convertPathToArray(frame.head), frame.hCert,
+                                       convertPathToArray(frame.capturedFlagellum),
+                                       convertPathToArray(frame.flagellum), frame.fCert)
         else:
             raise TypeError('TypeError : object added must be of type Frame')
 
     def getFrame(self, i):
-
-        if 0 <= i < len(self.__myFrames):
-            return self.__myFrames[i]
-        else:
-            return None
-
-    def loadSperm(self, filename):
         """
-        This function loads the basic data captured about the sperms motion from file.
-        Due to the format of the file the data is stored in intermediate data structures
+            Return a Frame object for the ith frame, it is built on demand from the columns of the track.
         """
 
-        exception = None
-
-        # there will be certainty associated with the tracking, the head and the flagellu
-        centroids = {}
-        heads = {}
-        capturedFlagella = {}
-        flagella = {}
-        tCerts = {}
-        fCerts = {}
-        hCerts = {}
-        lengths = {}
-        widths = {}
-        centres = {}
-        tilts = {}
-
-        try:
-            inFile = QFile(filename)
-            if not inFile.open(QIODevice.ReadOnly):
-                raise IOError('IOError opening : %s' % filename)
-            stream = QTextStream(inFile)
-
-            # set the codec to UTF-8
-            stream.setCodec(CODEC)
-
-            print "processing : %s" % filename
-
-            # in the main loop active the subroutines when the tags are found
-
-            while not stream.atEnd():
-                line = self.__nomNomNom(stream)
-
-                # it is a tag and some useful data follows
-                if line.startsWith("["):
+        if not (0 <= i < len(self.__myTrack)):
+            return None
 
-                    if QRegExp(r"\[HEADER\]", Qt.CaseInsensitive).exactMatch(line):
-                        print "reading header info..."
-                        self.__readHeader(stream)
+        track = self.__myTrack
 
-                    elif QRegExp(r"\[CENTROID\]", Qt.CaseInsensitive).exactMatch(line):
-                        print "reading centroids..."
-                        self.__readCentroids(stream, centroids, tCerts)
+        frame = Frame()
+        frame.load(int(track.frameIDs[i]), QPointF(*track.centroids[i]), convertArrayToPath(track.head(i)),
+                   track.lengths[i], track.widths[i], QPointF(*track.centres[i]), track.tilts[i],
+                   convertArrayToPath(track.capturedFlagellum(i)), convertArrayToPath(track.flagellum(i)),
+                   track.tCerts[i], track.hCerts[i], track.fCerts[i])
 
-                    elif QRegExp(r"\[HEADELLIPSE\]", Qt.CaseInsensitive).exactMatch(line):
-                        print "reading head ellipses..."
-                        self.__readEllipses(stream, lengths, widths, centres, tilts)
+        return frame
 
-                    elif QRegExp(r"\[HEAD\]", Qt.CaseInsensitive).exactMatch(line) or \
-                            QRegExp(r"\[HEADPOINTS\]", Qt.CaseInsensitive).exactMatch(line):
-                        print "reading head points..."
-                        self.__readFormatData(stream, heads, hCerts)
+    def getTrack(self):
+        return self.__myTrack
 
-                    elif QRegExp(r"\[FLAGELLUM\]", Qt.CaseInsensitive).exactMatch(line):
-                        print "reading flagella points..."
-                        self.__readFormatData(stream, capturedFlagella, fCerts)
-                        print "finished"
+    def loadSperm(self, filename, mapped=False):
+        """
+        This function loads the basic data captured about the sperms motion from file.
+        The file is parsed in bulk into NumPy arrays and stored column by column, see spermtrack.py
+        With mapped=True the file is memory mapped instead and a frame is only read when it is asked for, see
+        trackindex.py. A binary track file, see trackbinary.py, is always read whole with a single read.
+        """
 
-                    elif QRegExp(r"\[END\]", Qt.CaseInsensitive).exactMatch(line):
-                        # print "early termination with [END] tag"
-                        break
+        global SPLINE_SMOOTHNESS, SPLINE_DEGREE, SPLINE_POINTS, SPLINE_PROCESSES, USE_TRACK_CACHE
 
-                    else:
-                        print "this line shouldn't happen", line
-                        # if it is not one of the above cases then there is something wrong
-                        raise IOError('IOError reading from : %s' % filename)
+        context = self.__myContext
 
-            print "done..."
+        exception = None
 
+        def build():
+            print "reading track file..."
+            track = readAnyTrackFile(filename)
             print "fitting flagella with cubic spline"
+            # only frames with data in every section are kept
+            return buildSpermTrack(track, SPLINE_SMOOTHNESS, SPLINE_DEGREE, SPLINE_POINTS, SPLINE_PROCESSES)
 
-            last_good_flagellum = []
-            keySet = capturedFlagella.keys()
-
-            for k in keySet:
-                if len(capturedFlagella[k]) > 1:
-                    fitted = fitSpline(capturedFlagella[k], 10.0, 3)
-                    flagella[k] = fitted
-                    #flagella[k] = catMullRomFit(flagella[k])
-                    last_good_flagellum = fitted
-                else:
-                    flagella[k] = last_good_flagellum
-
-            print "done fitting..."
-
-            # Now we have all of the data stored in local Python structures
-            # To make things easier we will transfer the data to custom Frame objects
-            keys = centroids.keys()
-
-            for k in keys:
-            #print "current frame number %d " % (k)
-            # actively ignore frames that have incomplete data
-                if (k in centroids) and (k in heads) and (k in lengths) and (k in widths) and \
-                        (k in centres) and (k in tilts) and (k in capturedFlagella) and (k in flagella) and \
-                        (k in tCerts) and (k in hCerts) and (k in fCerts):
+        try:
+            print "processing : %s" % filename
 
-                    frame = Frame()
-                    frame.load(k, centroids[k], heads[k], lengths[k], widths[k], centres[k],
-                               tilts[k], capturedFlagella[k], flagella[k], tCerts[k], hCerts[k], fCerts[k])
-                    self.__myFrames.append(frame)
+            if mapped and not isBinaryTrack(filename):
+                self.__myTrack = MappedSpermTrack(filename, SPLINE_SMOOTHNESS, SPLINE_DEGREE, SPLINE_POINTS)
+            elif USE_TRACK_CACHE:
+                self.__myTrack = cachedSpermTrack(filename, build, SPLINE_SMOOTHNESS, SPLINE_DEGREE, SPLINE_POINTS,
+                                                  context.fps, context.pixelScale, context.viscosity)
+            else:
+                self.__myTrack = build()
 
             print "frames loaded..."
 
-            print "computing mechanics measures"
+            self.clearMeasures()
+
+            print "computing glyph positions"
 
-            self.computeMeasures()
+            self.computeMeasures(LOAD_FAMILIES)
 
             print "done..."
 
@@ -830,6 +979,26 @@ class Sperm:
             else:
                 return False, "File : %s exception of type <%s> raised" % (filename, exception)
 
+    def saveSperm(self, filename, binary=True, compress=True, single=True):
+        """
+        This function writes the frames of the sperm to a track file, in the binary format of trackbinary.py or
+        in the text format of data/dataformat.txt. The fitted flagella are not written, they are fitted again
+        when the file is loaded. With single=False the binary coordinates are stored as float64 and are lossless.
+        """
+
+        try:
+            data = trackData(self.__myTrack)
+
+            if binary:
+                writeBinaryTrack(data, filename, compress, single)
+            else:
+                writeTrackFile(data, filename)
+
+        except (IOError, OSError) as e:
+            return False, "File : %s exception of type <%s> raised" % (filename, e)
+
+        return True, "File : %s saved successfully" % filename
+
     def writeJSON(self, fileName):
 
         print 'writing JSON file...'
@@ -893,11 +1062,11 @@ class Sperm:
 
         output.write('var spermFrameData = [ \n')
 
-        for (index, frame) in enumerate(self.__myFrames):
+        for index in range(len(self.__myTrack)):
 
-            javaObj = frame.jsonObjectFormat()
+            javaObj = self.getFrame(index).jsonObjectFormat()
 
-            if index < len(self.__myFrames) - 1:
+            if index < len(self.__myTrack) - 1:
                 javaObj += ',\n'
 
             output.write(javaObj)
@@ -905,162 +1074,65 @@ class Sperm:
         output.write('];\n')
         output.close()
 
-    def __nomNomNom(self, stream):
+    def getCentroids(self, start, end):
         """
-            This helper method is private and is used to remove unwanted whitespaces and comments
+            Return an (N, 2) view on the centroids of the frames start to end.
         """
+        if not (0 <= start < end):
+            return []
 
-        line = stream.readLine()
-
-        while not stream.atEnd() and (line.startsWith("#") or line.startsWith("%") or line.isEmpty()):
-            line = stream.readLine()
-
-        return line
+        return self.__myTrack.centroids[start:end]
 
-    def __readHeader(self, stream):
+    def getFlagella(self, start, end):
         """
-            This subroutine grabs the header information form the file
-            so far this is just
+            Return a list of (nPoints, 2) views on the fitted flagella of the frames start to end.
         """
+        if not (0 <= start < end):
+            return []
 
-        line = self.__nomNomNom(stream)
-
-        if QRegExp(r"SpermID").exactMatch(line):
-            lst = line.split("=")
-            self.__spermID = intFromQString(lst[1])
-
-    def __readCentroids(self, stream, data, tracking):
-
-        # eat everything between the tag and the data
-
-        line = self.__nomNomNom(stream)
-
-        while not line.isEmpty():
-            lst = line.split(",")
-            frameID = intFromQString(lst[0])
-            tracked = floatFromQString(lst[1])
-            xCoord = floatFromQString(lst[2])
-            yCoord = floatFromQString(lst[3])
-            # put the (frameID, Point) in a tuple to group them
-            data[frameID] = QPointF(xCoord, yCoord)
-            tracking[frameID] = tracked
-            line = stream.readLine()
-
-    def __readEllipses(self, stream, lengths, widths, centres, tilts):
-
-        # eat everything between the tag and the data
-
-        line = self.__nomNomNom(stream)
-
-        while not line.isEmpty():
-            lst = line.split(",")
-            frameID = intFromQString(lst[0])
-            length = floatFromQString(lst[1])
-            width = floatFromQString(lst[2])
-            xCoord = floatFromQString(lst[3])
-            yCoord = floatFromQString(lst[4])
-            tilt = floatFromQString(lst[5])
-
-            lengths[frameID] = length
-            widths[frameID] = width
-            centres[frameID] = QPointF(xCoord, yCoord)
-            tilts[frameID] = tilt
-
-            line = stream.readLine()
-
-    def __readFormatData(self, stream, data, certainty):
-
-        # eat everything between the tag and the data
+        return self.__myTrack.flagella(start, end)
 
-        line = self.__nomNomNom(stream)
+    def getDenseFlagella(self, start, end):
+        """
+            Return an (end - start, nPoints, 2) view on the fitted flagella of the frames start to end, falling
+            back to the list of getFlagella if some of the frames have no fitted flagellum.
+        """
+        dense = self.__myTrack.denseFlagella(start, end) if 0 <= start < end else None
 
-        # process head information until we have none left
-        while not line.isEmpty():
-            
-            #print line
-            lst = line.split(",")
-            frameID = intFromQString(lst[0])
-            certain = floatFromQString(lst[1])
-            nPoints = intFromQString(lst[2])
-            
-            points = []
-            
-            for i in xrange(nPoints):
-                try:
-                    xCoord = floatFromQString(lst[3 + 2 * i])
-                    yCoord = floatFromQString(lst[3 + 2 * i + 1])
-                    points.append(QPointF(xCoord, yCoord))
-                except IndexError:
-                    raise IndexError('IndexError <index out of bounds>')
+        if dense is None:
+            return self.getFlagella(start, end)
 
-            data[frameID] = points   # add points to the collection
-            certainty[frameID] = certain  # add the certainty to the collection
-            line = stream.readLine()    
+        return dense
 
-    def getCentroids(self, start, end):
-        if not (0 <= start < end):
-            return []
-            
-        centroids = []
-        for i in range(start, end):
-            centroids.append(self.__myFrames[i].centroid)
-            
-        return centroids
-    
-    def getFlagella(self, start, end):
-        if not (0 <= start < end):
-            return []
-            
-        flagella = []
-        for i in range(start, end):
-            flagella.append(self.__myFrames[i].flagellum)
-            
-        return flagella
-    
     def getHeadDimensions(self, start, end):
         if not (0 <= start < end):
             return []
-            
-        lengths = []
-        widths = []
-        for i in range(start, end):
-            lengths.append(self.__myFrames[i].length)
-            widths.append(self.__myFrames[i].width)
-            
-        return lengths, widths
+
+        return self.__myTrack.lengths[start:end], self.__myTrack.widths[start:end]
 
     def getHeadUncertainties(self, start, end):
         if not (0 <= start < end):
             return []
-            
-        uncertainties = []
-        # average the uncertainty for now
-        for i in range(start, end):
-            uncertainties.append(self.__myFrames[i].hCert)
-            
-        return uncertainties
+
+        return self.__myTrack.hCerts[start:end]
 
     def getFlagellumUncertainties(self, start, end):
         if not (0 <= start < end):
             return []
-            
-        uncertainties = []
-        # average the uncertainty for now
-        for i in range(start, end):
-            uncertainties.append(self.__myFrames[i].fCert)
-            
-        return uncertainties
+
+        return self.__myTrack.fCerts[start:end]
 
     def testMeasures(self):
-        global VISCOSITY_VALUE
+
+        context = self.__myContext
     
         print('\n\t#### TEST MEASURES ####\n')
     
-        N = len(self.__myFrames)
+        N = len(self.__myTrack)
         w = 500
     
         # compute average parameters
-        totalPath = self.getCentroids(0, N)
+        totalPath = convertArrayToPath(self.getCentroids(0, N))
     
         print('number of frames  = %d' % N)
         print('total path length = %d' % len(totalPath))
@@ -1075,9 +1147,9 @@ class Sperm:
         amps = amplitudes(totalPath, avgPath)
         mad, angle = meanAngularDensity(totalPath)
     
-        vcl = convertToNMS(averageVelocity(totalPath))
-        vap = convertToNMS(averageVelocity(avgPath))
-        vsl = convertToNMS(straightLineVelocity(totalPath))
+        vcl = convertToNMS(averageVelocity(totalPath), context)
+        vap = convertToNMS(averageVelocity(avgPath), context)
+        vsl = convertToNMS(straightLineVelocity(totalPath), context)
     
         print('VCL : %f' % vcl)
         print('VAP : %f' % vap)
@@ -1085,7 +1157,7 @@ class Sperm:
     
         bcf = 0.0
         if len(ints) > 0.0:
-            bcf = len(ints) / convertToSeconds(N)
+            bcf = len(ints) / convertToSeconds(N, context)
     
         alh = 0.0
         if len(amps) > 0:
@@ -1097,19 +1169,19 @@ class Sperm:
     
         lens, widths = self.getHeadDimensions(0, N)
     
-        averageLengths = convertToNM(average(lens))
-        averageWidths = convertToNM(average(widths))
+        averageLengths = convertToNM(average(lens), context)
+        averageWidths = convertToNM(average(widths), context)
     
         print('head angle            : %f' % angle)
         print('head width            : %f' % averageWidths)
         print('head length           : %f' % averageLengths)
     
         # flagellum mechanics measures
-        flagella = self.getFlagella(0, N)
-        arcLength = convertToNM(averageArcLength(flagella))
+        flagella = [convertArrayToPath(f) for f in self.getFlagella(0, N)]
+        arcLength = convertToNM(averageArcLength(flagella), context)
         changesInAngles = averageChangeInAngle(totalPath, flagella)
-        asymmetries = convertToNM(averageAsymmetry(totalPath, flagella))
-        torques = convertToNMS(averageTorque(flagella, VISCOSITY_VALUE))
+        asymmetries = convertToNM(averageAsymmetry(totalPath, flagella), context)
+        torques = convertToNMS(averageTorque(self.getDenseFlagella(0, N), context.viscosity), context)
     
         print('arc length            : %f' % arcLength)
         print('change in angle       : %f' % changesInAngles)
@@ -1124,105 +1196,171 @@ class Sperm:
     
         print('\n\t#######################\n')
 
-    def computeMeasures(self):
+    def computeMeasures(self, families=ALL_FAMILIES):
+        """
+            Compute the measures of the named families for every glyph window now, rather than when they are
+            first asked for.
+        """
 
         print "\n\n !!!!!!! COMPUTING MEASURES !!!!!!!!!!\n\n"
-        global VISCOSITY_VALUE, maxBCF, maxTorque, maxAsymmetry
 
-        # self.testMeasures()
+        glyphRanges = self.__glyphRanges()
+        print "glyph ranges -- %s" % glyphRanges
 
-        N = len(self.__myFrames)
-        w = 500
+        for family in families:
+            for index in range(len(glyphRanges)):
+                if not self.__myComputed[family][index]:
+                    self.__computeWindow(family, index)
 
-        # compute average parameters
-        totalPath = self.getCentroids(0, N)
-        nFrames = len(totalPath)
-        totalTime = convertToSeconds(nFrames)
+    def __glyphRanges(self):
+        """
+            Return the frame ranges of the glyph windows. The measures of every time step used are kept, so going
+            back to a time step, e.g. a level of GlyphView, finds them computed. Every cached measure is dropped if
+            the acquisition values of the context have changed.
+        """
 
-        print "totalTime -- %s" % totalTime
+        units = (self.__myContext.key(), self.__myTimeStep)
 
-        timeStep = 1.0
+        if units != self.__myUnits:
 
-        if nFrames < w:
-            w = nFrames - 1
+            if self.__myUnits is not None and self.__myUnits[0] == units[0]:
+                self.__myLevels[self.__myUnits] = (self.__myGlyphRanges, self.__myMeasures, self.__myComputed)
+            else:
+                self.__myLevels = {}
 
-        avgPath = smooth(totalPath, hanning(w))
+            self.__myUnits = units
 
-        if totalTime > timeStep:
+            if units in self.__myLevels:
+                self.__myGlyphRanges, self.__myMeasures, self.__myComputed = self.__myLevels.pop(units)
 
-            temp = temporalRanges(0.0, totalTime, timeStep)
+            else:
+                self.__myGlyphRanges = glyphFrameRanges(len(self.__myTrack), self.__myContext, self.__myTimeStep)
 
-            glyphRanges = convertToFrameRanges(temp)
-            print "glyph ranges -- %s" % glyphRanges
+                n = len(self.__myGlyphRanges)
+                self.__myMeasures = dict((name, [None] * n) for name in FAMILY_OF)
+                self.__myComputed = dict((family, [False] * n) for family in ALL_FAMILIES)
 
-            self.__myNumberOfGlyphs = len(glyphRanges)
+        return self.__myGlyphRanges
 
-            for glyph in glyphRanges:
+    def __computeWindows(self, family):
+        """
+            Compute the measures of the positions or the kinematics family for every glyph window in one pass over
+            the centroids, see kinematics.py.
+        """
+
+        glyphRanges = self.__myGlyphRanges
+        centroids = numpy.asarray(self.getCentroids(0, len(self.__myTrack)), dtype=numpy.float64).reshape(-1, 2)
+
+        if family == 'positions':
+            windows = positionWindows(centroids, glyphRanges)
+
+            for name in POSITION_MEASURES:
+                qtType = QPointF if name.endswith('Position') else QVector2D
+                self.__myMeasures[name] = [qtType(*p) for p in windows[name].tolist()]
+
+        else:
+            if self.__myAveragePath is None:
+                self.__myAveragePath = smoothedPath(centroids, self.__mySmoothingWindow)
+
+            windows = kinematicWindows(centroids, self.__myAveragePath, glyphRanges)
+
+            for (name, value) in kinematicValues(windows, self.__myContext).items():
+                self.__myMeasures[name] = value.tolist()
+
+        self.__myComputed[family] = [True] * len(glyphRanges)
+
+    def __computeWindow(self, family, index):
+        """
+            Compute the measures of one family for the glyph window index, the positions and the kinematics are
+            computed for every window at once.
+        """
+
+        if family in ('positions', 'kinematics'):
+            self.__computeWindows(family)
+            return
+
+        start, end = self.__myGlyphRanges[index]
+        context = self.__myContext
+
+        if family == 'head':
+            measures = {'headLength': convertToNM(self.__average('lengths', start, end), context),
+                        'headWidth': convertToNM(self.__average('widths', start, end), context),
+                        'headUncertainty': self.__average('hCerts', start, end)}
+
+        else:
+            series = self.__series('shapes')
+            shapes = windowShapes(series.prefix('shapes'), [(start, end)])[0]
+
+            # the torques are only known per frame when every frame has a fitted flagellum
+            if 'torques' in series:
+                torque = windowTorque(series, start, end) * context.viscosity
+            else:
+                torque = averageTorque(self.getDenseFlagella(start, end), context.viscosity)
+
+            measures = {'arcLength': convertToNM(float(shapes['arcLength']), context),
+                        'changeInAngle': float(shapes['changeInAngle']),
+                        'asymmetry': convertToNM(float(shapes['asymmetry']), context),
+                        'torque': convertToNMS(torque, context),
+                        'flagellumUncertainty': self.__average('fCerts', start, end)}
+
+        for (name, value) in measures.items():
+            self.__myMeasures[name][index] = value
+
+        self.__myComputed[family][index] = True
+
+    def __series(self, name):
+        """
+            Return the FrameSums of the track, with the per frame series name added if it is not there yet.
+        """
+
+        if name not in self.__mySeries:
 
-                start = glyph[0]
-                end = glyph[1]
+            N = len(self.__myTrack)
 
-                # 1. Kinematic measures
-                path = totalPath[start: end]
-                avgP = avgPath[start: end]
-                ints = intersectPoints(path, avgP)
-                amps = amplitudes(path, avgP)
+            if name == 'shapes':
+                flagella = self.getDenseFlagella(0, N)
+                self.__mySeries.add('shapes', frameShapes(self.getCentroids(0, N), flagella))
 
-                # orientation and position
-                middle = int(len(path) * 0.5)
-                self.__myStartPositions.append(path[0])
-                self.__myMiddlePositions.append(path[middle])
-                self.__myEndPositions.append(path[-1])
-                self.__myAveragePositions.append(averagePosition(path))
-                self.__myMidPointPositions.append(midpoint(path[0], path[-1]))
+                if isinstance(flagella, numpy.ndarray):
+                    self.__mySeries.add('torques', frameTorques(flagella, 1.0))
 
-                self.__myStartDirections.append(toVector(path[1] - path[0]))
-                self.__myMiddleDirections.append(toVector(path[middle + 1] - path[middle]))
-                self.__myEndDirections.append(toVector(path[-1] - path[-2]))
-                self.__myAverageDirections.append(averageVector(path))
-                self.__myMidPointDirections.append(toVector(path[-1] - path[0]))
+            else:
+                self.__mySeries.add(name, getattr(self.__myTrack, name)[0:N])
 
-                # velocities
-                self.__myVCLs.append(convertToNMS(averageVelocity(path)))
-                vsl = straightLineVelocity(path)
+        return self.__mySeries
 
-                self.__myVSLs.append(convertToNMS(vsl))
+    def __average(self, name, start, end):
+        return float(self.__series(name).average(name, start, end))
 
-                self.__myVAPs.append(convertToNMS(averageVelocity(avgP)))
-                self.__myBCFs.append(len(ints) - 1)
+    def __measures(self, name):
+        """
+            Return the list of a measure for every glyph window, computing the windows that are missing.
+        """
 
-                # swim measures
-                alh = 0.0
+        glyphRanges = self.__glyphRanges()
+        family = FAMILY_OF[name]
+        computed = self.__myComputed[family]
 
-                if len(amps) > 0:
-                    alh = max(amps)
+        for index in range(len(glyphRanges)):
+            if not computed[index]:
+                self.__computeWindow(family, index)
 
-                self.__myALHs.append(convertToNM(alh))
-                mad, angle = meanAngularDensity(path)
-                self.__myMADs.append(mad)
-                self.__myHeadAngles.append(angle)
+        return self.__myMeasures[name]
 
-                # head mechanics measures
-                lens, widths = self.getHeadDimensions(start, end)
+    def __measure(self, name, index):
+        """
+            Return a measure of the glyph window index, or None if there is no such window.
+        """
 
-                averageLengths = convertToNM(average(lens))
-                averageWidths = convertToNM(average(widths))
+        if not 0 <= index < len(self.__glyphRanges()):
+            return None
 
-                self.__myHeadLengths.append(averageLengths)
-                self.__myHeadWidths.append(averageWidths)
+        family = FAMILY_OF[name]
 
-                # flagellum mechanics measures
-                flagella = self.getFlagella(start, end)
-                self.__myArcLengths.append(convertToNM(averageArcLength(flagella)))
-                self.__myChangesInAngles.append(averageChangeInAngle(path, flagella))
-                self.__myAsymmetries.append(convertToNM(averageAsymmetry(path, flagella)))
-                self.__myTorques.append(convertToNMS(averageTorque(flagella, VISCOSITY_VALUE)))
+        if not self.__myComputed[family][index]:
+            self.__computeWindow(family, index)
 
-                # certainty
-                headUncertainty = self.getHeadUncertainties(start, end)
-                flagellumUncertainty = self.getFlagellumUncertainties(start, end)
-                self.__myHeadUncertainties.append(average(headUncertainty))
-                self.__myFlagellumUncertainties.append(average(flagellumUncertainty))
+        return self.__myMeasures[name][index]
 
 
 class SpermContainer:
@@ -1246,12 +1384,58 @@ class SpermContainer:
         return self.__myNFrames
 
     def getPixelSize(self):
-        global PIXEL_SCALE
-        return PIXEL_SCALE
+        return self.__myContext.pixelScale
 
     def getFPS(self):
-        global FRAMES_PER_SECOND
-        return FRAMES_PER_SECOND
+        return self.__myContext.fps
+
+    def getViscosity(self):
+        return self.__myContext.viscosity
+
+    def getContext(self):
+        return self.__myContext
+
+    def getTimeStep(self):
+        return self.__myTimeStep
+
+    def setTimeStep(self, timeStep):
+        """
+            Set the length of the glyph windows of every sperm in seconds. Only the window measures are computed
+            again, from the per frame series the sperms already hold, see Sperm.setTimeStep.
+        """
+        self.__myTimeStep = float(timeStep)
+
+        for sperm in self.__mySperms:
+            sperm.setTimeStep(self.__myTimeStep)
+
+        self.__myContext.resetMaxValues(self.__mySperms)
+
+    def getSmoothingWindow(self):
+        return self.__mySmoothingWindow
+
+    def setSmoothingWindow(self, w):
+        """
+            Set the length in frames of the Hanning window of the average path of every sperm, see
+            Sperm.setSmoothingWindow.
+        """
+        self.__mySmoothingWindow = int(w)
+
+        for sperm in self.__mySperms:
+            sperm.setSmoothingWindow(self.__mySmoothingWindow)
+
+    def computeGlyphLevels(self, timeSteps, families=ALL_FAMILIES):
+        """
+            Compute the measures of the glyph windows of every time step now. The sperms keep the measures of each
+            time step, so a GlyphView switching between them as it zooms does not compute anything.
+        """
+
+        for sperm in self.__mySperms:
+
+            for timeStep in timeSteps:
+                sperm.setTimeStep(timeStep)
+                sperm.computeMeasures(families)
+
+            sperm.setTimeStep(self.__myTimeStep)
 
     def getMaxNumberOfGlyphs(self):
         if self.isEmpty():
@@ -1263,9 +1447,13 @@ class SpermContainer:
         self.__myFrameWidth = 0
         self.__myFrameHeight = 0
         self.__myBeatCycles = 0
+        self.__myBeatCycleLength = 1
         self.__myNFrames = 0
+        self.__myTimeStep = TIME_STEP
+        self.__mySmoothingWindow = SMOOTHING_WINDOW
 
         self.__myFileName = QString()
+        self.__myContext = AcquisitionContext()
 
         self.__mySpermFiles = []
         self.__mySperms = []
@@ -1274,16 +1462,21 @@ class SpermContainer:
     def formats():
         return "*.txt *.spm"
 
-    def loadDataSet(self, filename):
+    def loadDataSet(self, filename, processes=1, families=LOAD_FAMILIES, mapped=False):
+        """
+            Load the data set described by the header file filename, either all or none of the sperms are loaded.
 
-        global FRAMES_PER_SECOND
-        global PIXEL_SCALE
-        global VISCOSITY_VALUE
+            The sperm files are independent so with processes > 1 they are parsed, fitted and measured in a pool
+            of worker processes, processes=None uses every core. Only the measures of the named families are
+            computed while loading, the others when they are first asked for. With mapped=True the sperm files are
+            memory mapped and only the frames that are used are read, see Sperm.loadSperm.
+        """
 
         exception = None
         # we do not want to dirty the loaded data with a bad read
         tempSpermFiles = []
         tempSperms = []
+        context = AcquisitionContext()
 
         print 'loading data....'
 
@@ -1322,21 +1515,21 @@ class SpermContainer:
                     self.__myBeatCycleLength = intFromQString(lst[1])
 
                 elif QRegExp(r"FPS", Qt.CaseInsensitive).exactMatch(tag):
-                    FRAMES_PER_SECOND = floatFromQString(lst[1])
+                    context.fps = floatFromQString(lst[1])
 
                 elif QRegExp(r"viscosity", Qt.CaseInsensitive).exactMatch(tag):
-                    VISCOSITY_VALUE = floatFromQString(lst[1])
+                    context.viscosity = floatFromQString(lst[1])
 
                 elif QRegExp(r"nFrames", Qt.CaseInsensitive).exactMatch(tag):
                     self.__myNFrames = intFromQString(lst[1])
 
                 elif QRegExp(r"pixelSize", Qt.CaseSensitive).exactMatch(tag):
-                    PIXEL_SCALE = floatFromQString(lst[1])
+                    context.pixelScale = floatFromQString(lst[1])
 
                 elif QRegExp(r"dataFile", Qt.CaseInsensitive).exactMatch(tag):
                     tempSpermFiles.append(lst[1])
 
-            print('viscosity is : %s' % VISCOSITY_VALUE)
+            print('viscosity is : %s' % context.viscosity)
 
             print('nFiles : %d ' % nFiles)
 
@@ -1356,11 +1549,38 @@ class SpermContainer:
             filename = filePath.fileName()
 
             # iterate over the sperm files and load them into the container
+            jobs = []
+
             for pair in enumerate(tempSpermFiles):
                 pathToFile = filePath.path().append("/").append(pair[1].trimmed())
                 print "file %d : %s" % (pair[0] + 1, pathToFile)
-                sperm = Sperm(self.__myBeatCycleLength, pathToFile)
-                tempSperms.append(sperm)
+                jobs.append((self.__myBeatCycleLength, unicode(pathToFile), context, families, mapped))
+
+            if processes is None:
+                processes = cpu_count()
+
+            processes = min(processes, len(jobs))
+
+            if processes > 1:
+
+                print "loading %d sperm files with %d processes" % (len(jobs), processes)
+
+                pool = Pool(processes, initLoadWorker)
+
+                try:
+                    tempSperms = pool.map(loadSpermFile, jobs)
+                finally:
+                    pool.terminate()
+                    pool.join()
+
+            else:
+                tempSperms = [loadSpermFile(job) for job in jobs]
+
+            # a sperm loaded in a worker comes back with a copy of the context, share the one of the data set
+            for sperm in tempSperms:
+                sperm.setContext(context)
+                sperm.setTimeStep(self.__myTimeStep)
+                sperm.setSmoothingWindow(self.__mySmoothingWindow)
 
             print('file : %s loaded successfully... number of sperms %d' % (filename, len(tempSperms)))
 
@@ -1386,54 +1606,14 @@ class SpermContainer:
                 self.__myFileName = filename
                 self.__mySpermFiles = tempSpermFiles
                 self.__mySperms = tempSperms
-                self.__computeMaxValues()
+                self.__myContext = context
+                context.addSperms(tempSperms)
 
                 print "Everything loaded successfully..."
                 return True, "File : %s loaded successfully" % filename
             else:
                 return False, "File : %s exception of type <%s> raised" % (filename, exception)
 
-    def __computeMaxValues(self):
-        # now determine if this sperm is the global maximum
-        global maxTorque
-        global maxAsymmetry
-
-        #        def maxVector(vectors=None):
-        #            if not vectors: vectors = []
-        #            maxLength = 0.0
-        #            for vec in vectors:
-        #                if maxLength > vec.length(): maxLength = vec.length()
-        #
-        #
-
-        for sperm in self.__mySperms:
-            #displacement = maxVector(sperm.getDirections())
-
-            torque = 0.0
-
-            if len(sperm.getTorques()) > 0:
-                torque = max(sperm.getTorques())
-
-            asymmetry = 1.0
-
-            if len(sperm.getAsymmetries()) > 0:
-                if max(sperm.getAsymmetries()) > abs(min(sperm.getAsymmetries())):
-                    asymmetry = max(sperm.getAsymmetries())
-                else:
-                    asymmetry = abs(min(sperm.getAsymmetries()))
-
-            if asymmetry == 0.0:
-                asymmetry = 1.0
-
-            if maxAsymmetry < asymmetry:
-                maxAsymmetry = asymmetry
-
-            if maxTorque < torque:
-                maxTorque = torque
-
-        print('Max Asymmetry     : %f ' % maxAsymmetry)
-        print('Max Torque        : %f ' % maxTorque)
-
     def __nomNomNom(self, stream):
         """
                 This helper method is private and is used to conaveragee unwanted whitespaces and comments
@@ -1456,6 +1636,29 @@ class SpermContainer:
         return len(self.__mySperms)
 
 
+def initLoadWorker():
+    """
+        Prepare a worker process of loadDataSet, a worker of a pool can not start a pool of its own.
+    """
+
+    global SPLINE_PROCESSES
+
+    SPLINE_PROCESSES = 1
+
+
+def loadSpermFile(job):
+    """
+        Return the Sperm loaded from a single sperm file, job is a picklable tuple so this can run in a worker.
+    """
+
+    beatCycleLength, pathToFile, context, families, mapped = job
+
+    sperm = Sperm(beatCycleLength, pathToFile, context, mapped)
+    sperm.computeMeasures(families)
+
+    return sperm
+
+
 def testLoad():
     print('running unit test on SpermContainer Data structures')
 
@@ -1477,15 +1680,14 @@ def testLoad():
 
 
 def testRanges():
-    global FRAMES_PER_SECOND
 
-    FRAMES_PER_SECOND = 293.4
+    context = AcquisitionContext(293.4)
 
     temp = temporalRanges(0.0, 2.93, 1.0)
 
     print temp
 
-    frames = convertToFrameRanges(temp)
+    frames = convertToFrameRanges(temp, context)
 
     print frames
 
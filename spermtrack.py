@@ -0,0 +1,219 @@
+"""
+    This module provides a columnar, array backed store for the frames of a single sperm track.
+
+    Every per frame quantity is held in one contiguous NumPy array that is indexed by frame, i.e. row i of
+    centroids, lengths, tCerts, ... all belong to the same frame. The head points, the captured flagellum points
+    and the fitted flagellum points have a different number of points per frame so each of them is stored as one
+    flat (M, 2) buffer with an offsets array of length N + 1, the points of the ith frame being
+    points[offsets[i]:offsets[i + 1]]. Slices of the store are views and so no data is copied on access.
+"""
+
+import numpy
+
+from computation import (fitSplines, lastGoodIndices)
+from trackfile import (TrackData, latestRows, rowsOf)
+
+
+def emptyOffsets(n=0):
+    return numpy.zeros(n + 1, dtype=numpy.int64)
+
+
+def raggedFromList(arrays):
+    """
+        Return offsets, points; a list of (n_i, 2) arrays packed into one flat buffer of points with offsets.
+    """
+    offsets = emptyOffsets(len(arrays))
+    numpy.cumsum([len(a) for a in arrays], out=offsets[1:])
+
+    if offsets[-1] == 0:
+        return offsets, numpy.zeros((0, 2))
+
+    return offsets, numpy.concatenate([numpy.asarray(a, dtype=numpy.float64).reshape(-1, 2) for a in arrays])
+
+
+class SpermTrack:
+    """
+        SpermTrack holds the per frame data of a single sperm as contiguous arrays, one row per frame.
+    """
+
+    def __init__(self):
+
+        self.frameIDs = numpy.zeros(0, dtype=numpy.int64)
+
+        # tracking
+        self.centroids = numpy.zeros((0, 2))
+        self.tCerts = numpy.zeros(0)
+
+        # head ellipse columns
+        self.lengths = numpy.zeros(0)
+        self.widths = numpy.zeros(0)
+        self.centres = numpy.zeros((0, 2))
+        self.tilts = numpy.zeros(0)
+
+        # ragged head points
+        self.hCerts = numpy.zeros(0)
+        self.headOffsets = emptyOffsets()
+        self.headPoints = numpy.zeros((0, 2))
+
+        # ragged captured flagellum points and the flagella fitted to them
+        self.fCerts = numpy.zeros(0)
+        self.capturedOffsets = emptyOffsets()
+        self.capturedPoints = numpy.zeros((0, 2))
+        self.flagellumOffsets = emptyOffsets()
+        self.flagellumPoints = numpy.zeros((0, 2))
+
+    def __len__(self):
+        return len(self.frameIDs)
+
+    def __repr__(self):
+        return 'SpermTrack( frames : %d, head points : %d, flagellum points : %d, %.1f KB )' % \
+               (len(self), len(self.headPoints), len(self.flagellumPoints), self.nbytes() / 1024.0)
+
+    def columns(self):
+        """
+            Return a dict of all of the arrays that make up the track, keyed by attribute name.
+        """
+        return dict((name, value) for (name, value) in vars(self).items() if isinstance(value, numpy.ndarray))
+
+    def nbytes(self):
+        return sum(value.nbytes for value in self.columns().values())
+
+    def head(self, i):
+        return self.headPoints[self.headOffsets[i]:self.headOffsets[i + 1]]
+
+    def capturedFlagellum(self, i):
+        return self.capturedPoints[self.capturedOffsets[i]:self.capturedOffsets[i + 1]]
+
+    def flagellum(self, i):
+        return self.flagellumPoints[self.flagellumOffsets[i]:self.flagellumOffsets[i + 1]]
+
+    def flagella(self, start, end):
+        """
+            Return a list of views on the fitted flagella of the frames start to end.
+        """
+        offsets = self.flagellumOffsets
+        return [self.flagellumPoints[offsets[i]:offsets[i + 1]] for i in range(start, end)]
+
+    def denseFlagella(self, start, end):
+        """
+            Return an (end - start, nPoints, 2) view on the fitted flagella of the frames start to end, or None if
+            they do not all have the same number of points.
+        """
+        offsets = self.flagellumOffsets[start:end + 1]
+        counts = numpy.diff(offsets)
+
+        if not len(counts) or counts[0] < 1 or numpy.any(counts != counts[0]):
+            return None
+
+        return self.flagellumPoints[offsets[0]:offsets[-1]].reshape(len(counts), counts[0], 2)
+
+    def appendFrame(self, frameID, centroid, tCert, length, width, centre, tilt,
+                    head, hCert, capturedFlagellum, flagellum, fCert):
+        """
+            Append a single frame to the end of the track, this copies the arrays and is meant for small edits.
+        """
+
+        def extend(offsets, points, new):
+            new = numpy.asarray(new, dtype=numpy.float64).reshape(-1, 2)
+            return numpy.append(offsets, offsets[-1] + len(new)), numpy.concatenate((points, new))
+
+        self.frameIDs = numpy.append(self.frameIDs, frameID)
+        self.centroids = numpy.concatenate((self.centroids, [centroid]))
+        self.tCerts = numpy.append(self.tCerts, tCert)
+        self.lengths = numpy.append(self.lengths, length)
+        self.widths = numpy.append(self.widths, width)
+        self.centres = numpy.concatenate((self.centres, [centre]))
+        self.tilts = numpy.append(self.tilts, tilt)
+        self.hCerts = numpy.append(self.hCerts, hCert)
+        self.fCerts = numpy.append(self.fCerts, fCert)
+        self.headOffsets, self.headPoints = extend(self.headOffsets, self.headPoints, head)
+        self.capturedOffsets, self.capturedPoints = extend(self.capturedOffsets, self.capturedPoints,
+                                                           capturedFlagellum)
+        self.flagellumOffsets, self.flagellumPoints = extend(self.flagellumOffsets, self.flagellumPoints, flagellum)
+
+
+def buildSpermTrack(track, smoothness=10.0, degree=3, nPoints=100, processes=1):
+    """
+        Return a SpermTrack built from the raw sections of a TrackData object.
+
+        Only the frames that have data in every section are kept. A spline is fitted to every captured
+        flagellum with more than one point, any other frame reuses the last good fitted flagellum. The fitting
+        is done in one batch, see computation.fitSplines for processes.
+    """
+
+    keys = track.completeFrameIDs()
+
+    centroidRows = rowsOf(track.centroidIDs, keys)
+    ellipseRows = rowsOf(track.ellipseIDs, keys)
+    headRows = rowsOf(track.headIDs, keys)
+    flagellumRows = rowsOf(track.flagellumIDs, keys)
+
+    sperm = SpermTrack()
+
+    sperm.frameIDs = keys.astype(numpy.int64)
+    sperm.centroids = track.centroids[centroidRows]
+    sperm.tCerts = track.tCerts[centroidRows]
+    sperm.lengths = track.lengths[ellipseRows]
+    sperm.widths = track.widths[ellipseRows]
+    sperm.centres = track.centres[ellipseRows]
+    sperm.tilts = track.tilts[ellipseRows]
+    sperm.hCerts = track.hCerts[headRows]
+    sperm.fCerts = track.fCerts[flagellumRows]
+
+    sperm.headOffsets, sperm.headPoints = gatherRagged(track.headOffsets, track.headPoints, headRows)
+    sperm.capturedOffsets, sperm.capturedPoints = gatherRagged(track.flagellumOffsets, track.flagellumPoints,
+                                                               flagellumRows)
+
+    # in frame order a frame with a bad flagellum reuses the last good one, only the flagella that are actually
+    # kept are fitted and each of them only once
+    ids, rows = latestRows(track.flagellumIDs)
+    offsets = track.flagellumOffsets
+    lastGood = lastGoodIndices(offsets[rows + 1] - offsets[rows])[numpy.searchsorted(ids, keys)]
+    valid = lastGood >= 0
+
+    fitRows, inverse = numpy.unique(rows[lastGood[valid]], return_inverse=True)
+    fitted = fitSplines([track.flagellumPoints[offsets[row]:offsets[row + 1]] for row in fitRows],
+                        smoothness, degree, nPoints, processes)
+
+    sperm.flagellumOffsets = emptyOffsets(len(keys))
+    numpy.cumsum(numpy.where(valid, nPoints, 0), out=sperm.flagellumOffsets[1:])
+    sperm.flagellumPoints = fitted[inverse].reshape(-1, 2)
+
+    return sperm
+
+
+def trackData(track, spermID=0):
+    """
+        Return a TrackData object with the frames of a sperm track, the inverse of buildSpermTrack. The captured
+        flagella are kept, the fitted ones are fitted again when it is read back.
+    """
+
+    n = len(track)
+    data = TrackData()
+    frameIDs = numpy.asarray(track.frameIDs, dtype=numpy.int64)
+
+    data.spermID = spermID
+    data.centroidIDs = data.ellipseIDs = data.headIDs = data.flagellumIDs = frameIDs
+    data.tCerts = numpy.asarray(track.tCerts[:n], dtype=numpy.float64)
+    data.centroids = numpy.asarray(track.centroids[:n], dtype=numpy.float64).reshape(-1, 2)
+    data.lengths = numpy.asarray(track.lengths[:n], dtype=numpy.float64)
+    data.widths = numpy.asarray(track.widths[:n], dtype=numpy.float64)
+    data.centres = numpy.asarray(track.centres[:n], dtype=numpy.float64).reshape(-1, 2)
+    data.tilts = numpy.asarray(track.tilts[:n], dtype=numpy.float64)
+    data.hCerts = numpy.asarray(track.hCerts[:n], dtype=numpy.float64)
+    data.fCerts = numpy.asarray(track.fCerts[:n], dtype=numpy.float64)
+    data.headOffsets, data.headPoints = raggedFromList([track.head(i) for i in range(n)])
+    data.flagellumOffsets, data.flagellumPoints = raggedFromList([track.capturedFlagellum(i) for i in range(n)])
+
+    return data
+
+
+def gatherRagged(offsets, points, rows):
+    """
+        Return offsets, points for the ragged records rows of a flat buffer of points.
+    """
+    counts = offsets[rows + 1] - offsets[rows]
+    newOffsets = emptyOffsets(len(rows))
+    numpy.cumsum(counts, out=newOffsets[1:])
+    index = numpy.repeat(offsets[rows] - newOffsets[:-1], counts) + numpy.arange(newOffsets[-1])
+    return newOffsets, points[index]
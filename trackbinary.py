@@ -0,0 +1,279 @@
+"""
+    This module reads and writes sperm tracks in a compact, versioned binary format.
+
+    The text format of data/dataformat.txt stores every number as ASCII. A binary track file holds the same
+    sections as a TrackData object, one typed column per array, with the coordinates and certainties stored as
+    float32 and the points of the head and flagellum sections as one ragged buffer with offsets. The whole file is
+    read with a single read and every column is a view on that buffer, the columns may be compressed with zlib.
+
+    layout : MAGIC, a little endian (version, flags, manifest length, payload length) prelude, the manifest, i.e.
+             one "name dtype shape" line per column, and the payload, the columns back to back in manifest order.
+
+    convertTree writes a binary copy of every track file and data set header found below a directory.
+
+    usage : python trackbinary.py [convert source_directory output_directory | test [root]]
+"""
+
+import os
+import re
+import struct
+import sys
+import tempfile
+import zlib
+
+import numpy
+
+from trackfile import (TrackData, readTrackFile, isTrackFile, trackFiles)
+
+MAGIC = b'PYCASA\x00T'
+FORMAT_VERSION = 1
+PRELUDE = struct.Struct('<8sHHII')
+
+# flags
+COMPRESSED = 1
+
+BINARY_EXTENSION = '.spt'
+
+# the TrackData columns and their types on disk, coordinates and certainties are stored with single precision
+ID_TYPE = '<i4'
+OFFSET_TYPE = '<u4'
+COLUMNS = (('centroidIDs', ID_TYPE), ('tCerts', 'f'), ('centroids', 'f'),
+           ('ellipseIDs', ID_TYPE), ('lengths', 'f'), ('widths', 'f'), ('centres', 'f'), ('tilts', 'f'),
+           ('headIDs', ID_TYPE), ('hCerts', 'f'), ('headOffsets', OFFSET_TYPE), ('headPoints', 'f'),
+           ('flagellumIDs', ID_TYPE), ('fCerts', 'f'), ('flagellumOffsets', OFFSET_TYPE), ('flagellumPoints', 'f'))
+
+DATA_FILE = re.compile(r'^(\s*DataFile\s*=\s*)(\S+)(\s*)$', re.MULTILINE | re.IGNORECASE)
+
+
+def isBinaryTrack(filename):
+    """
+        Return True if the file is a binary sperm track file.
+    """
+    with open(unicode(filename), 'rb') as inFile:
+        return inFile.read(len(MAGIC)) == MAGIC
+
+
+def writeBinaryTrack(track, filename, compress=True, single=True):
+    """
+        Write a TrackData object to the binary track file filename.
+
+        compress : compress the columns with zlib
+        single   : store the coordinates and certainties as float32, otherwise as float64 which is lossless
+    """
+
+    floatType = '<f4' if single else '<f8'
+
+    columns = [('spermID', numpy.array([track.spermID], dtype='<i8'))]
+    columns.extend((name, numpy.ascontiguousarray(getattr(track, name), dtype=floatType if kind == 'f' else kind))
+                   for (name, kind) in COLUMNS)
+
+    manifest = ''.join('%s %s %s\n' % (name, value.dtype.str, ' '.join(str(n) for n in value.shape))
+                       for (name, value) in columns)
+    payload = b''.join(value.tostring() for (name, value) in columns)
+
+    flags = 0
+
+    if compress:
+        payload = zlib.compress(payload, 6)
+        flags |= COMPRESSED
+
+    with open(unicode(filename), 'wb') as outFile:
+        outFile.write(PRELUDE.pack(MAGIC, FORMAT_VERSION, flags, len(manifest), len(payload)))
+        outFile.write(manifest)
+        outFile.write(payload)
+
+
+def readBinaryTrack(filename):
+    """
+        Return a TrackData object holding the contents of the binary track file filename, the columns are
+        converted back to the types of TrackData.
+    """
+
+    with open(unicode(filename), 'rb') as inFile:
+        data = inFile.read()
+
+    try:
+        magic, version, flags, manifestLength, payloadLength = PRELUDE.unpack_from(data)
+    except struct.error:
+        raise IOError('IOError reading from : %s' % filename)
+
+    if magic != MAGIC:
+        raise IOError('IOError reading from : %s is not a binary track file' % filename)
+
+    if version > FORMAT_VERSION:
+        raise IOError('IOError reading from : %s has format version %d, %d is supported' %
+                      (filename, version, FORMAT_VERSION))
+
+    start = PRELUDE.size + manifestLength
+    manifest = data[PRELUDE.size:start]
+    payload = data[start:start + payloadLength]
+
+    if len(payload) != payloadLength:
+        raise IOError('IOError reading from : %s is truncated' % filename)
+
+    if flags & COMPRESSED:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error:
+            raise IOError('IOError reading from : %s is corrupt' % filename)
+
+    track = TrackData()
+    position = 0
+
+    try:
+        for line in manifest.splitlines():
+
+            fields = line.split()
+            name, dtype, shape = fields[0], numpy.dtype(fields[1]), tuple(int(n) for n in fields[2:])
+            size = dtype.itemsize * int(numpy.prod(shape))
+            value = numpy.frombuffer(payload, dtype, int(numpy.prod(shape)), position).reshape(shape)
+            position += size
+
+            if name == 'spermID':
+                track.spermID = int(value[0])
+            elif hasattr(track, name):
+                # in the types of TrackData, the float32 columns are widened to float64
+                setattr(track, name, value.astype(getattr(track, name).dtype))
+
+    except (IndexError, ValueError, TypeError):
+        raise ValueError('ValueError converting : %s' % filename)
+
+    return track
+
+
+def readAnyTrackFile(filename):
+    """
+        Return the TrackData of a sperm track file in either the binary or the text format.
+    """
+    if isBinaryTrack(filename):
+        return readBinaryTrack(filename)
+
+    return readTrackFile(filename)
+
+
+def binaryName(name):
+    return os.path.splitext(name)[0] + BINARY_EXTENSION
+
+
+def convertTree(root='data', output='data_binary', compress=True, single=True):
+    """
+        Write a binary copy of every track file below root to the same place below output, and a copy of every
+        data set header with its DataFile entries renamed to the binary files. Return the number of text and
+        binary bytes of the converted track files.
+    """
+
+    textBytes = 0
+    binaryBytes = 0
+
+    for (path, dirs, files) in os.walk(root):
+
+        target = os.path.join(output, os.path.relpath(path, root))
+
+        for name in sorted(files):
+
+            fileName = os.path.join(path, name)
+
+            if not name.endswith('.txt'):
+                continue
+
+            if not os.path.isdir(target):
+                os.makedirs(target)
+
+            if isTrackFile(fileName):
+
+                outName = os.path.join(target, binaryName(name))
+                writeBinaryTrack(readTrackFile(fileName), outName, compress, single)
+
+                textBytes += os.path.getsize(fileName)
+                binaryBytes += os.path.getsize(outName)
+
+                print('%-50s %8.1f KB -> %8.1f KB' % (fileName, os.path.getsize(fileName) / 1024.0,
+                                                     os.path.getsize(outName) / 1024.0))
+
+            else:
+
+                with open(fileName, 'rb') as inFile:
+                    text = inFile.read()
+
+                # only the track files that exist are converted, a missing one is left as it is
+                def rename(match):
+                    dataFile = os.path.join(path, match.group(2))
+                    if os.path.isfile(dataFile) and isTrackFile(dataFile):
+                        return match.group(1) + binaryName(match.group(2)) + match.group(3)
+                    return match.group(0)
+
+                if DATA_FILE.search(text) is not None:
+                    with open(os.path.join(target, name), 'wb') as outFile:
+                        outFile.write(DATA_FILE.sub(rename, text))
+
+    if binaryBytes:
+        print('converted %.1f KB to %.1f KB, %.1f times smaller' %
+              (textBytes / 1024.0, binaryBytes / 1024.0, textBytes / float(binaryBytes)))
+
+    return textBytes, binaryBytes
+
+
+def testTrackBinary(root='data'):
+    """
+        Write every track file below root to the binary format with and without compression and with single and
+        double precision, read it back and compare it with the text file.
+    """
+
+    print('testing the binary track format on : %s' % root)
+
+    directory = tempfile.mkdtemp()
+    names = ['spermID'] + [name for (name, kind) in COLUMNS]
+    kinds = dict(COLUMNS)
+    failures = 0
+
+    try:
+        for fileName in trackFiles(root):
+
+            track = readTrackFile(fileName)
+            sizes = []
+            errors = []
+
+            for compress in (False, True):
+                for single in (False, True):
+
+                    outName = os.path.join(directory, binaryName(os.path.basename(fileName)))
+                    writeBinaryTrack(track, outName, compress, single)
+                    sizes.append(os.path.getsize(outName))
+
+                    copy = readAnyTrackFile(outName)
+
+                    for name in names:
+
+                        a = numpy.asarray(getattr(track, name))
+                        b = numpy.asarray(getattr(copy, name))
+
+                        # single precision columns are compared at single precision, but read back as float64
+                        expected = a.astype(numpy.float32) if single and kinds.get(name) == 'f' else a
+
+                        if b.dtype != a.dtype or not numpy.array_equal(expected, b):
+                            errors.append('%s compress %s single %s' % (name, compress, single))
+
+            failures += len(errors)
+            print('%-50s %8.1f KB -> %s KB %s' % (fileName, os.path.getsize(fileName) / 1024.0,
+                                                  ' '.join('%.1f' % (size / 1024.0) for size in sizes),
+                                                  'ok' if not errors else ', '.join(errors[:5])))
+
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 3 and sys.argv[1] == 'convert':
+        convertTree(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 2 and sys.argv[1] == 'test':
+        testTrackBinary(sys.argv[2])
+    else:
+        testTrackBinary()
@@ -0,0 +1,147 @@
+"""
+    This module keeps an on disk cache of parsed and spline fitted sperm tracks.
+
+    The cache lives in a .pycasa_cache directory next to the data set. Every sperm track is stored as a directory
+    of .npy files, one per column of the SpermTrack, so that a repeat open can memory map the arrays and skip
+    both the parsing of the text file and the fitting of the flagella. An entry is keyed by a hash of the content
+    of the track file together with the spline parameters and the acquisition values from the data set header,
+    so changing any of them simply misses the cache. Writing an entry removes the older entries of the same track
+    file, so the cache holds one entry per track file and does not grow when a file or a parameter changes.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+import numpy
+
+from spermtrack import SpermTrack
+
+CACHE_DIRECTORY = '.pycasa_cache'
+KEY_FILE = 'key.txt'
+
+
+def fileHash(filename):
+    """
+        Return the SHA-1 hex digest of the content of a file.
+    """
+    digest = hashlib.sha1()
+
+    with open(unicode(filename), 'rb') as inFile:
+        for block in iter(lambda: inFile.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def cacheKey(filename, smoothness, degree, nPoints, fps, pixelSize, viscosity):
+    """
+        Return the string that identifies a cached track, the file content hash and every parameter used.
+    """
+    return 'sha1=%s smoothness=%r degree=%d nPoints=%d fps=%r pixelSize=%r viscosity=%r' % \
+           (fileHash(filename), float(smoothness), degree, nPoints, float(fps), float(pixelSize), float(viscosity))
+
+
+def cachePath(filename, key):
+    """
+        Return the directory that holds the cache entry of a track file for a given key.
+    """
+    filename = unicode(filename)
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRECTORY)
+    digest = hashlib.sha1(key).hexdigest()[:16]
+    return os.path.join(directory, '%s-%s' % (os.path.basename(filename), digest))
+
+
+def removeStaleEntries(path):
+    """
+        Remove every cache entry of the same track file as the entry at path, other than path itself.
+    """
+
+    parent, name = os.path.split(path)
+    entry = re.compile(re.escape(name.rsplit('-', 1)[0]) + r'-[0-9a-f]{16}$')
+
+    for other in os.listdir(parent):
+        otherPath = os.path.join(parent, other)
+        if other != name and entry.match(other) and os.path.isdir(otherPath):
+            shutil.rmtree(otherPath, ignore_errors=True)
+
+
+def loadCachedTrack(path, key):
+    """
+        Return the SpermTrack memory mapped from the cache entry at path, or None if there is no valid entry.
+    """
+
+    try:
+        with open(os.path.join(path, KEY_FILE), 'rb') as keyFile:
+            if keyFile.read() != key:
+                return None
+
+        track = SpermTrack()
+
+        for name in track.columns():
+            setattr(track, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+    except (IOError, OSError, ValueError):
+        return None
+
+    return track
+
+
+def saveCachedTrack(path, key, track):
+    """
+        Write a SpermTrack to the cache entry at path, the entry is written in full before it becomes visible.
+    """
+
+    parent = os.path.dirname(path)
+
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    temp = tempfile.mkdtemp(dir=parent)
+
+    try:
+        for (name, value) in track.columns().items():
+            numpy.save(os.path.join(temp, name + '.npy'), numpy.ascontiguousarray(value))
+
+        # the key is written last so that a partially written entry is never valid
+        with open(os.path.join(temp, KEY_FILE), 'wb') as keyFile:
+            keyFile.write(key)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+        os.rename(temp, path)
+
+    except (IOError, OSError):
+        shutil.rmtree(temp, ignore_errors=True)
+        raise
+
+    removeStaleEntries(path)
+
+
+def cachedSpermTrack(filename, build, smoothness, degree, nPoints, fps, pixelSize, viscosity):
+    """
+        Return the SpermTrack of a track file, from the cache if possible and otherwise by calling build().
+
+        A failure to write the cache, for instance on a read only data set, is reported but is not an error.
+    """
+
+    key = cacheKey(filename, smoothness, degree, nPoints, fps, pixelSize, viscosity)
+    path = cachePath(filename, key)
+
+    track = loadCachedTrack(path, key)
+
+    if track is not None:
+        print('track loaded from cache : %s' % path)
+        return track
+
+    track = build()
+
+    try:
+        saveCachedTrack(path, key, track)
+    except (IOError, OSError) as e:
+        print('could not write track cache %s : %s' % (path, e))
+
+    return track
@@ -0,0 +1,326 @@
+"""
+    This module reads the sperm track files described in data/dataformat.txt in bulk using NumPy.
+
+    Rather than converting every field of every line one at a time the file is sliced into its tagged sections
+    and each section is handed to NumPy as a single block of text. The head and flagellum sections hold a
+    different number of points on every line, so these are returned as one flat buffer of points together with
+    an array of offsets, i.e. the points of the ith record are points[offsets[i]:offsets[i + 1]].
+"""
+
+import os
+import re
+import sys
+import time
+
+import numpy
+
+TAG = re.compile(r'^\[(\w+)\][ \t\r]*$', re.MULTILINE)
+
+
+class TrackData:
+    """
+        TrackData holds the raw numeric contents of a sperm track file, one group of arrays per section.
+    """
+
+    def __init__(self):
+        self.spermID = 0
+
+        # [CENTROID] FrameID, certainty, x, y
+        self.centroidIDs = numpy.zeros(0, dtype=numpy.int64)
+        self.tCerts = numpy.zeros(0)
+        self.centroids = numpy.zeros((0, 2))
+
+        # [HEADELLIPSE] FrameID, semimajor_axis, semiminor_axis, x0, y0, phi
+        self.ellipseIDs = numpy.zeros(0, dtype=numpy.int64)
+        self.lengths = numpy.zeros(0)
+        self.widths = numpy.zeros(0)
+        self.centres = numpy.zeros((0, 2))
+        self.tilts = numpy.zeros(0)
+
+        # [HEADPOINTS] FrameID, certainty, NPoints, x1, y1, ..., xn, yn
+        self.headIDs = numpy.zeros(0, dtype=numpy.int64)
+        self.hCerts = numpy.zeros(0)
+        self.headOffsets = numpy.zeros(1, dtype=numpy.int64)
+        self.headPoints = numpy.zeros((0, 2))
+
+        # [FLAGELLUM] FrameID, certainty, NPoints, x1, y1, ..., xn, yn
+        self.flagellumIDs = numpy.zeros(0, dtype=numpy.int64)
+        self.fCerts = numpy.zeros(0)
+        self.flagellumOffsets = numpy.zeros(1, dtype=numpy.int64)
+        self.flagellumPoints = numpy.zeros((0, 2))
+
+    def __repr__(self):
+        return 'TrackData( centroids : %d, ellipses : %d, heads : %d, flagella : %d )' % \
+               (len(self.centroidIDs), len(self.ellipseIDs), len(self.headIDs), len(self.flagellumIDs))
+
+    def completeFrameIDs(self):
+        """
+            Return the sorted frame IDs that have data in every section, incomplete frames are ignored.
+        """
+        ids = numpy.unique(self.centroidIDs)
+
+        for other in (self.ellipseIDs, self.headIDs, self.flagellumIDs):
+            ids = numpy.intersect1d(ids, other)
+
+        return ids
+
+
+def latestRows(ids):
+    """
+        Return the sorted unique frame IDs and the row holding the last occurrence of each of them.
+
+        When a frame ID is repeated inside a section the last record read wins, as it would with a dict.
+    """
+    ids = numpy.asarray(ids)
+    unique, first = numpy.unique(ids[::-1], return_index=True)
+    return unique, len(ids) - 1 - first
+
+
+def rowsOf(ids, frameIDs):
+    """
+        Return the rows of a section that hold the (last) record for each of the frame IDs frameIDs.
+    """
+    unique, rows = latestRows(ids)
+    return rows[numpy.searchsorted(unique, frameIDs)]
+
+
+def isTrackFile(filename):
+    """
+        Return True if the file looks like a sperm track file rather than a data set header.
+    """
+    with open(unicode(filename), 'rb') as inFile:
+        head = inFile.read(4096)
+
+    return re.search(r'^\[CENTROID\]', head, re.MULTILINE | re.IGNORECASE) is not None
+
+
+def readTrackFile(filename):
+    """
+        Return a TrackData object holding the contents of the sperm track file filename.
+    """
+
+    with open(unicode(filename), 'rb') as inFile:
+        text = inFile.read()
+
+    track = TrackData()
+    tags = list(TAG.finditer(text))
+
+    for (index, tag) in enumerate(tags):
+
+        name = tag.group(1).upper()
+        end = tags[index + 1].start() if index + 1 < len(tags) else len(text)
+        lines = sectionLines(text[tag.end():end])
+
+        if name == 'HEADER':
+            readHeader(track, lines)
+
+        elif name == 'CENTROID':
+            values = readColumns(lines, 4)
+            track.centroidIDs = values[:, 0].astype(numpy.int64)
+            track.tCerts = values[:, 1].copy()
+            track.centroids = values[:, 2:4].copy()
+
+        elif name == 'HEADELLIPSE':
+            values = readColumns(lines, 6)
+            track.ellipseIDs = values[:, 0].astype(numpy.int64)
+            track.lengths = values[:, 1].copy()
+            track.widths = values[:, 2].copy()
+            track.centres = values[:, 3:5].copy()
+            track.tilts = values[:, 5].copy()
+
+        elif name == 'HEAD' or name == 'HEADPOINTS':
+            track.headIDs, track.hCerts, track.headOffsets, track.headPoints = readPoints(lines)
+
+        elif name == 'FLAGELLUM':
+            track.flagellumIDs, track.fCerts, track.flagellumOffsets, track.flagellumPoints = readPoints(lines)
+
+        elif name == 'END':
+            break
+
+        else:
+            raise IOError('IOError reading from : %s' % filename)
+
+    return track
+
+
+def sectionLines(block):
+    """
+        Return the data lines of a section, skipping the comments that precede them and stopping at the first
+        empty line.
+    """
+    lines = block.splitlines()
+    start = 0
+
+    while start < len(lines) and (not lines[start].strip() or lines[start][:1] in '#%'):
+        start += 1
+
+    data = []
+
+    for line in lines[start:]:
+        if not line.strip():
+            break
+        if line[:1] not in '#%':
+            data.append(line)
+
+    return data
+
+
+def readHeader(track, lines):
+    for line in lines:
+        lst = line.split('=')
+        if len(lst) == 2 and lst[0].strip().lower() == 'spermid':
+            track.spermID = int(lst[1])
+
+
+def readRecords(lines):
+    """
+        Return values, starts, counts; every number in lines as one flat array together with the index of the
+        first value of each line and the number of values on each line.
+    """
+
+    counts = numpy.array([line.rstrip(', \t\r').count(',') + 1 for line in lines], dtype=numpy.int64)
+    values = numpy.fromstring(' '.join(lines).replace(',', ' '), dtype=numpy.float64, sep=' ')
+
+    if values.size != counts.sum():
+        raise ValueError('ValueError converting : %d values found, %d expected' % (values.size, counts.sum()))
+
+    starts = numpy.cumsum(counts) - counts
+
+    return values, starts, counts
+
+
+def readColumns(lines, nColumns):
+    """
+        Return an (N, nColumns) array from N lines of comma separated numbers.
+    """
+
+    if not lines:
+        return numpy.zeros((0, nColumns))
+
+    values, starts, counts = readRecords(lines)
+
+    if numpy.any(counts < nColumns):
+        raise ValueError('ValueError converting : expected %d columns' % nColumns)
+
+    return values[starts[:, numpy.newaxis] + numpy.arange(nColumns)]
+
+
+def readPoints(lines):
+    """
+        Return frameIDs, certainties, offsets, points for lines of the form FrameID, certainty, NPoints, x1, y1, ...
+    """
+
+    if not lines:
+        return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0),
+                numpy.zeros(1, dtype=numpy.int64), numpy.zeros((0, 2)))
+
+    values, starts, counts = readRecords(lines)
+
+    frameIDs = values[starts].astype(numpy.int64)
+    certainties = values[starts + 1]
+    nPoints = values[starts + 2].astype(numpy.int64)
+
+    if numpy.any(counts < 3 + 2 * nPoints):
+        raise IndexError('IndexError <index out of bounds>')
+
+    offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int64)
+    numpy.cumsum(nPoints, out=offsets[1:])
+
+    # gather the 2 * nPoints coordinates that follow the three leading columns of every line
+    nValues = 2 * nPoints
+    first = numpy.repeat(starts + 3 - 2 * offsets[:-1], nValues)
+    points = values[first + numpy.arange(2 * offsets[-1])].reshape(-1, 2)
+
+    return frameIDs, certainties, offsets, points
+
+
+def writeTrackFile(track, filename):
+    """
+        Write a TrackData object to the sperm track file filename in the format read by readTrackFile.
+    """
+
+    def pointRecords(frameIDs, certainties, offsets, points):
+        for (row, (frameID, certainty)) in enumerate(zip(frameIDs, certainties)):
+            fields = ['%d' % frameID, '%.2f' % certainty, '%d' % (offsets[row + 1] - offsets[row])]
+            fields.extend('%.2f,\t%.2f' % (x, y) for (x, y) in points[offsets[row]:offsets[row + 1]])
+            yield ',\t'.join(fields) + '\n'
+
+    with open(unicode(filename), 'wb') as outFile:
+
+        outFile.write('[HEADER]\nSpermId=%d\n\n' % track.spermID)
+
+        outFile.write('[CENTROID]\n#FrameID,Uncertainty,X,Y\n')
+        for (frameID, certainty, (x, y)) in zip(track.centroidIDs, track.tCerts, track.centroids):
+            outFile.write('%d,\t%.2f,\t%.2f,\t%.2f\n' % (frameID, certainty, x, y))
+
+        outFile.write('\n[HEADPOINTS]\n#FrameID,Uncertainty,NPOINTS,X,Y...\n')
+        outFile.writelines(pointRecords(track.headIDs, track.hCerts, track.headOffsets, track.headPoints))
+
+        outFile.write('\n[HEADELLIPSE]\n#FrameID,semimajor_axis,semiminor_axis,x0,y0,phi\n')
+        for (frameID, length, width, (x, y), tilt) in zip(track.ellipseIDs, track.lengths, track.widths,
+                                                          track.centres, track.tilts):
+            outFile.write('%d,\t%.2f,\t%.2f,\t%.2f,\t%.2f,\t%.2f\n' % (frameID, length, width, x, y, tilt))
+
+        outFile.write('\n[FLAGELLUM]\n#FrameID,Uncertainty,NPOINTS,X,Y...\n')
+        outFile.writelines(pointRecords(track.flagellumIDs, track.fCerts, track.flagellumOffsets,
+                                        track.flagellumPoints))
+
+        outFile.write('\n[END]\n')
+
+
+def trackFiles(root='data'):
+    """
+        Return the sorted paths of all of the sperm track files found below the directory root.
+    """
+    found = []
+
+    for (path, dirs, files) in os.walk(root):
+        for name in files:
+            fileName = os.path.join(path, name)
+            if name.endswith('.txt') and isTrackFile(fileName):
+                found.append(fileName)
+
+    return sorted(found)
+
+
+def benchmarkParser(root='data', repeats=5):
+    """
+        Time readTrackFile on every track file in the data directory.
+    """
+
+    print('benchmarking track file parser on : %s' % root)
+
+    totalBytes = 0
+    totalTime = 0.0
+
+    for fileName in trackFiles(root):
+
+        best = None
+
+        for i in range(repeats):
+            t0 = time.time()
+            track = readTrackFile(fileName)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+
+        size = os.path.getsize(fileName)
+        totalBytes += size
+        totalTime += best
+
+        print('%-40s %8.1f KB  %5d frames  %8.2f ms  %6.1f MB/s' %
+              (fileName, size / 1024.0, len(track.completeFrameIDs()), best * 1000.0,
+               size / (best * 1024.0 * 1024.0)))
+
+    if totalTime > 0.0:
+        print('total : %.1f MB in %.2f ms, %.1f MB/s' %
+              (totalBytes / (1024.0 * 1024.0), totalTime * 1000.0, totalBytes / (totalTime * 1024.0 * 1024.0)))
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        benchmarkParser(sys.argv[1])
+    else:
+        benchmarkParser()
@@ -0,0 +1,509 @@
+"""
+    This module gives random access to the frames of a sperm track file without reading the whole file.
+
+    A TrackIndex holds the byte offsets of every record of every section of a track file, together with the frame ID
+    of the record and, for the point sections, its number of points. It is built with a single scan of the file and
+    stored in the .pycasa_cache directory next to the data set, keyed by the size and modification time of the file.
+
+    A MappedSpermTrack memory maps the track file and uses the index to parse only the records of the frames that
+    are asked for, with the same parsers as trackfile.readTrackFile. The file is mapped for each read, so a track
+    holds no open file between reads. It has the read interface of a SpermTrack so a
+    Sperm can use either of them, see Sperm.loadSperm.
+"""
+
+import mmap
+import os
+import random
+import sys
+import tempfile
+
+import numpy
+
+from computation import (fitSplines, lastGoodIndices)
+from spermtrack import (buildSpermTrack)
+from trackcache import (CACHE_DIRECTORY)
+from trackfile import (TAG, readTrackFile, readColumns, readPoints, latestRows, rowsOf, trackFiles)
+
+INDEX_VERSION = 1
+
+# the indexed sections, HEAD is read as HEADPOINTS as in readTrackFile
+SECTIONS = ('CENTROID', 'HEADELLIPSE', 'HEADPOINTS', 'FLAGELLUM')
+POINT_SECTIONS = ('HEADPOINTS', 'FLAGELLUM')
+
+# the number of fitted flagella kept by a MappedSpermTrack
+FIT_CACHE_SIZE = 4096
+
+
+class TrackIndex:
+    """
+        TrackIndex holds the byte range, frame ID and number of points of every record of a sperm track file.
+    """
+
+    def __init__(self):
+        self.spermID = 0
+        self.size = 0
+        self.mtime = 0.0
+
+        # per section, one entry per record in file order
+        self.ids = dict((name, numpy.zeros(0, dtype=numpy.int64)) for name in SECTIONS)
+        self.starts = dict((name, numpy.zeros(0, dtype=numpy.int64)) for name in SECTIONS)
+        self.ends = dict((name, numpy.zeros(0, dtype=numpy.int64)) for name in SECTIONS)
+        self.counts = dict((name, numpy.zeros(0, dtype=numpy.int64)) for name in POINT_SECTIONS)
+
+    def __repr__(self):
+        return 'TrackIndex( %s )' % ', '.join('%s : %d' % (name, len(self.ids[name])) for name in SECTIONS)
+
+    def completeFrameIDs(self):
+        """
+            Return the sorted frame IDs that have a record in every section, as TrackData.completeFrameIDs.
+        """
+        ids = numpy.unique(self.ids[SECTIONS[0]])
+
+        for name in SECTIONS[1:]:
+            ids = numpy.intersect1d(ids, self.ids[name])
+
+        return ids
+
+
+def fileStamp(filename):
+    """
+        Return the size and modification time of a file, an index is stale when either of them changes.
+    """
+    info = os.stat(unicode(filename))
+    return info.st_size, info.st_mtime
+
+
+def indexPath(filename):
+    filename = unicode(filename)
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRECTORY)
+    return os.path.join(directory, os.path.basename(filename) + '.index.npz')
+
+
+def sectionRecords(text, start, end):
+    """
+        Return the byte ranges of the data lines of the section text[start:end], with the rules of sectionLines.
+    """
+
+    starts = []
+    ends = []
+    begun = False
+    position = start
+
+    while position < end:
+
+        newline = text.find(b'\n', position, end)
+
+        if newline < 0:
+            newline = end
+
+        line = text[position:newline]
+
+        if not line.strip():
+            if begun:
+                break
+        elif line[:1] not in b'#%':
+            begun = True
+            starts.append(position)
+            ends.append(newline)
+
+        position = newline + 1
+
+    return starts, ends
+
+
+def buildTrackIndex(filename):
+    """
+        Return the TrackIndex of the sperm track file filename, made with a single scan of the memory mapped file.
+    """
+
+    index = TrackIndex()
+    index.size, index.mtime = fileStamp(filename)
+
+    if index.size == 0:
+        return index
+
+    with open(unicode(filename), 'rb') as inFile:
+
+        text = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            tags = list(TAG.finditer(text))
+
+            for (i, tag) in enumerate(tags):
+
+                name = tag.group(1).upper()
+                end = tags[i + 1].start() if i + 1 < len(tags) else len(text)
+
+                if name == 'HEAD':
+                    name = 'HEADPOINTS'
+
+                if name == 'END':
+                    break
+
+                if name == 'HEADER':
+                    for line in text[tag.end():end].splitlines():
+                        fields = line.split('=')
+                        if len(fields) == 2 and fields[0].strip().lower() == 'spermid':
+                            index.spermID = int(fields[1])
+                    continue
+
+                if name not in SECTIONS:
+                    raise IOError('IOError reading from : %s' % filename)
+
+                starts, ends = sectionRecords(text, tag.end(), end)
+                fields = [text[s:e].split(',', 3) for (s, e) in zip(starts, ends)]
+
+                index.starts[name] = numpy.array(starts, dtype=numpy.int64)
+                index.ends[name] = numpy.array(ends, dtype=numpy.int64)
+                index.ids[name] = numpy.array([int(float(f[0])) for f in fields], dtype=numpy.int64)
+
+                if name in POINT_SECTIONS:
+                    index.counts[name] = numpy.array([int(float(f[2])) for f in fields], dtype=numpy.int64)
+
+        except (IndexError, ValueError):
+            raise ValueError('ValueError indexing : %s' % filename)
+
+        finally:
+            text.close()
+
+    return index
+
+
+def saveTrackIndex(index, path):
+    """
+        Write a TrackIndex to path, the file is written in full before it becomes visible.
+    """
+
+    arrays = {'version': numpy.array(INDEX_VERSION), 'spermID': numpy.array(index.spermID),
+              'size': numpy.array(index.size), 'mtime': numpy.array(index.mtime)}
+
+    for name in SECTIONS:
+        arrays[name + '_ids'] = index.ids[name]
+        arrays[name + '_starts'] = index.starts[name]
+        arrays[name + '_ends'] = index.ends[name]
+
+    for name in POINT_SECTIONS:
+        arrays[name + '_counts'] = index.counts[name]
+
+    directory = os.path.dirname(path)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.npz')
+
+    try:
+        with os.fdopen(handle, 'wb') as outFile:
+            numpy.savez(outFile, **arrays)
+
+        os.rename(temp, path)
+
+    except (IOError, OSError):
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def readTrackIndex(path, stamp):
+    """
+        Return the TrackIndex stored at path, or None if there is none or it does not match the file stamp.
+    """
+
+    try:
+        arrays = numpy.load(path)
+
+        if int(arrays['version']) != INDEX_VERSION or (int(arrays['size']), float(arrays['mtime'])) != stamp:
+            return None
+
+        index = TrackIndex()
+        index.spermID = int(arrays['spermID'])
+        index.size, index.mtime = stamp
+
+        for name in SECTIONS:
+            index.ids[name] = arrays[name + '_ids']
+            index.starts[name] = arrays[name + '_starts']
+            index.ends[name] = arrays[name + '_ends']
+
+        for name in POINT_SECTIONS:
+            index.counts[name] = arrays[name + '_counts']
+
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+    return index
+
+
+def loadTrackIndex(filename):
+    """
+        Return the TrackIndex of a track file, from the index stored beside it if that is up to date and otherwise
+        by scanning the file and storing the new index. A failure to store it is reported but is not an error.
+    """
+
+    path = indexPath(filename)
+    index = readTrackIndex(path, fileStamp(filename))
+
+    if index is not None:
+        return index
+
+    index = buildTrackIndex(filename)
+
+    try:
+        saveTrackIndex(index, path)
+    except (IOError, OSError) as e:
+        print('could not write track index %s : %s' % (path, e))
+
+    return index
+
+
+class MappedColumn:
+    """
+        MappedColumn is a read only, array like view on one column of a section of a MappedSpermTrack, indexed by
+        frame. Indexing it parses only the records of the frames asked for.
+    """
+
+    def __init__(self, track, section, nColumns, columns):
+        self.__track = track
+        self.__section = section
+        self.__nColumns = nColumns
+        self.__columns = columns
+
+    def __len__(self):
+        return len(self.__track)
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            frames = numpy.arange(len(self))[key]
+        elif isinstance(key, (int, long, numpy.integer)):
+            frames = numpy.arange(len(self))[key:key + 1 if key != -1 else None]
+            if not len(frames):
+                raise IndexError('IndexError <index out of bounds>')
+            return self.__track.readColumns(self.__section, frames, self.__nColumns)[0, self.__columns]
+        else:
+            frames = numpy.arange(len(self))[key]
+
+        return self.__track.readColumns(self.__section, frames, self.__nColumns)[:, self.__columns]
+
+    def __array__(self, dtype=None):
+        return numpy.asarray(self[:], dtype=dtype)
+
+
+class MappedSpermTrack:
+    """
+        MappedSpermTrack reads the frames of a sperm track file on demand through its TrackIndex.
+
+        Only the frames that have a record in every section are kept, and a frame without a good captured
+        flagellum reuses the last good one, as in buildSpermTrack. A flagellum is fitted the first time it is read.
+    """
+
+    def __init__(self, filename, smoothness=10.0, degree=3, nPoints=100):
+
+        self.filename = unicode(filename)
+        self.smoothness = smoothness
+        self.degree = degree
+        self.nPoints = nPoints
+
+        self.__open()
+
+    def __open(self):
+
+        index = loadTrackIndex(self.filename)
+
+        self.__index = index
+        self.__fitted = {}
+
+        keys = index.completeFrameIDs()
+
+        self.frameIDs = keys.astype(numpy.int64)
+
+        # the record of each kept frame in each section
+        self.__rows = dict((name, rowsOf(index.ids[name], keys)) for name in SECTIONS)
+
+        # the record of the fitted flagellum of each kept frame, -1 if there is no good flagellum yet
+        ids, rows = latestRows(index.ids['FLAGELLUM'])
+        lastGood = lastGoodIndices(index.counts['FLAGELLUM'][rows])[numpy.searchsorted(ids, keys)]
+        self.__fitRows = numpy.where(lastGood >= 0, rows[lastGood], -1) if len(keys) else lastGood
+
+        # tracking
+        self.centroids = MappedColumn(self, 'CENTROID', 4, slice(2, 4))
+        self.tCerts = MappedColumn(self, 'CENTROID', 4, 1)
+
+        # head ellipse columns
+        self.lengths = MappedColumn(self, 'HEADELLIPSE', 6, 1)
+        self.widths = MappedColumn(self, 'HEADELLIPSE', 6, 2)
+        self.centres = MappedColumn(self, 'HEADELLIPSE', 6, slice(3, 5))
+        self.tilts = MappedColumn(self, 'HEADELLIPSE', 6, 5)
+
+        # certainties of the point sections
+        self.hCerts = MappedColumn(self, 'HEADPOINTS', 3, 1)
+        self.fCerts = MappedColumn(self, 'FLAGELLUM', 3, 1)
+
+    def __getstate__(self):
+        # the index is loaded again on unpickling, from the cache next to the data set
+        return {'filename': self.filename, 'smoothness': self.smoothness, 'degree': self.degree,
+                'nPoints': self.nPoints}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__open()
+
+    def __len__(self):
+        return len(self.frameIDs)
+
+    def __repr__(self):
+        return 'MappedSpermTrack( %s, frames : %d )' % (self.filename, len(self))
+
+    def __records(self, section, rows):
+        """
+            Return the text of the records rows of a section, the file is only mapped for the duration of the read.
+        """
+
+        starts = self.__index.starts[section][rows]
+        ends = self.__index.ends[section][rows]
+
+        if not len(starts):
+            return []
+
+        with open(self.filename, 'rb') as inFile:
+            text = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [text[s:e] for (s, e) in zip(starts, ends)]
+            finally:
+                text.close()
+
+    def readColumns(self, section, frames, nColumns):
+        """
+            Return an (N, nColumns) array of the leading columns of the records of a section for N frames.
+        """
+        return readColumns(self.__records(section, self.__rows[section][frames]), nColumns)
+
+    def readPoints(self, section, frame):
+        """
+            Return the (n, 2) array of the points of the record of a point section for a single frame.
+        """
+        ids, certainties, offsets, points = readPoints(self.__records(section, self.__rows[section][frame:frame + 1]))
+        return points
+
+    def head(self, i):
+        return self.readPoints('HEADPOINTS', i)
+
+    def capturedFlagellum(self, i):
+        return self.readPoints('FLAGELLUM', i)
+
+    def __fittedFlagella(self, frames):
+        """
+            Return the fitted flagella of the frames, each an (nPoints, 2) array or an empty array for a frame
+            with no good flagellum, fitting only the flagella that have not been fitted yet.
+        """
+
+        rows = self.__fitRows[frames]
+        missing = sorted(set(rows[rows >= 0].tolist()) - set(self.__fitted))
+
+        if missing:
+
+            if len(self.__fitted) + len(missing) > FIT_CACHE_SIZE:
+                self.__fitted = {}
+
+            ids, certainties, offsets, points = readPoints(self.__records('FLAGELLUM', missing))
+            curves = [points[offsets[i]:offsets[i + 1]] for i in range(len(missing))]
+
+            for (row, fitted) in zip(missing, fitSplines(curves, self.smoothness, self.degree, self.nPoints)):
+                self.__fitted[row] = fitted
+
+        empty = numpy.zeros((0, 2))
+
+        return [self.__fitted[row] if row >= 0 else empty for row in rows.tolist()]
+
+    def flagellum(self, i):
+        return self.__fittedFlagella(numpy.arange(i, i + 1))[0]
+
+    def flagella(self, start, end):
+        """
+            Return a list of the fitted flagella of the frames start to end.
+        """
+        return self.__fittedFlagella(numpy.arange(len(self))[start:end])
+
+    def denseFlagella(self, start, end):
+        """
+            Return an (end - start, nPoints, 2) array of the fitted flagella of the frames start to end, or None if
+            some of the frames have no fitted flagellum.
+        """
+        frames = numpy.arange(len(self))[start:end]
+
+        if not len(frames) or numpy.any(self.__fitRows[frames] < 0):
+            return None
+
+        return numpy.array(self.__fittedFlagella(frames))
+
+
+def testTrackIndex(root='data', samples=20, seed=1):
+    """
+        Compare random frame ranges of a MappedSpermTrack with the fully loaded SpermTrack of every track file.
+    """
+
+    print('testing MappedSpermTrack against buildSpermTrack on : %s' % root)
+
+    generator = random.Random(seed)
+    failures = 0
+
+    for fileName in trackFiles(root):
+
+        try:
+            track = buildSpermTrack(readTrackFile(fileName))
+        except (IOError, IndexError, ValueError) as e:
+            print('%s not loaded : %s' % (fileName, e))
+            continue
+
+        mapped = MappedSpermTrack(fileName)
+        errors = []
+
+        if len(mapped) != len(track) or not numpy.array_equal(mapped.frameIDs, track.frameIDs):
+            errors.append('frame IDs')
+
+        for i in range(samples):
+
+            if not len(track):
+                break
+
+            start = generator.randrange(len(track))
+            end = min(len(track), start + generator.randrange(1, 200))
+
+            for name in ('centroids', 'tCerts', 'lengths', 'widths', 'centres', 'tilts', 'hCerts', 'fCerts'):
+                if not numpy.array_equal(getattr(mapped, name)[start:end], getattr(track, name)[start:end]):
+                    errors.append('%s %d:%d' % (name, start, end))
+
+            if not numpy.array_equal(mapped.centroids[start], track.centroids[start]):
+                errors.append('centroid %d' % start)
+
+            for (name, a, b) in (('head', mapped.head(start), track.head(start)),
+                                 ('captured', mapped.capturedFlagellum(start), track.capturedFlagellum(start)),
+                                 ('flagellum', mapped.flagellum(start), track.flagellum(start))):
+                if not numpy.array_equal(a, b):
+                    errors.append('%s %d' % (name, start))
+
+            if any(not numpy.array_equal(a, b) for (a, b) in zip(mapped.flagella(start, end),
+                                                                 track.flagella(start, end))):
+                errors.append('flagella %d:%d' % (start, end))
+
+            dense = mapped.denseFlagella(start, end)
+            expected = track.denseFlagella(start, end)
+
+            if (dense is None) != (expected is None) or (dense is not None and not numpy.array_equal(dense,
+                                                                                                    expected)):
+                errors.append('dense flagella %d:%d' % (start, end))
+
+        failures += len(errors)
+        print('%-50s %6d frames %s' % (fileName, len(track), 'ok' if not errors else ', '.join(errors[:5])))
+
+    print('%d failures' % failures)
+
+    return failures
+
+
+# the code for testing this module
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        testTrackIndex(sys.argv[1])
+    else:
+        testTrackIndex()